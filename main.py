@@ -1,11 +1,15 @@
 import sys
 import logging
+import time
 from pathlib import Path
 from PySide6.QtWidgets import QApplication, QMessageBox
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QTimer
 from src.main_window import MainWindow
 from src.core import database_manager as db
-from src.core.theme import get_light_theme, apply_theme_to_stylesheet
+from src.core.maintenance_service import MaintenanceService
+from src.core.startup import import_time_report, warm_up_imports
+from src.core.write_queue import WriteQueue
+from src.core.theme_manager import ThemeManager
 
 def get_writable_data_dir() -> Path:
     if getattr(sys, 'frozen', False):
@@ -14,6 +18,12 @@ def get_writable_data_dir() -> Path:
 
 DATA_DIR = get_writable_data_dir()
 LOG_FILE_PATH = DATA_DIR / "app.log"
+STYLE_CACHE_DIR = DATA_DIR / "cache"
+STARTUP_REPORT_PATH = DATA_DIR / "startup_imports.txt"
+# Antecipa o primeiro ciclo de manutenção com um integrity_check completo em vez do quick_check.
+FULL_DB_CHECK_FLAG = "--full-db-check"
+# Dá tempo de a janela ser pintada antes de a thread de pré-carregamento disputar o GIL.
+WARMUP_DELAY_MS = 300
 
 if getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS'):
     STYLE_PATH = Path(sys._MEIPASS) / "assets" / "style.qss"
@@ -31,20 +41,8 @@ def setup_logging():
         ]
     )
 
-def load_stylesheet(path: Path) -> str:
-    if not path.exists():
-        logging.warning(f"Folha de estilos não encontrada em: {path}. Usando estilo padrão.")
-        return ""
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            qss_template = f.read()
-        light_theme = get_light_theme()
-        return apply_theme_to_stylesheet(qss_template, light_theme)
-    except IOError as e:
-        logging.error(f"Não foi possível ler a folha de estilos {path}: {e}")
-        return ""
-
 def main():
+    startup_begin = time.perf_counter()
     QApplication.setHighDpiScaleFactorRoundingPolicy(
         Qt.HighDpiScaleFactorRoundingPolicy.PassThrough
     )
@@ -53,12 +51,23 @@ def main():
     app.setApplicationName("NefronApp Analisador")
     try:
         db.set_database_path(DATA_DIR)
+        db_begin = time.perf_counter()
         db.init_db()
-        stylesheet = load_stylesheet(STYLE_PATH)
-        if stylesheet:
-            app.setStyleSheet(stylesheet)
+        db_elapsed_ms = (time.perf_counter() - db_begin) * 1000
+        ThemeManager.configure(STYLE_PATH, STYLE_CACHE_DIR)
+        ThemeManager.apply(ThemeManager.saved_theme(), persist=False)
         window = MainWindow()
         window.show()
+        maintenance = MaintenanceService()
+        app.aboutToQuit.connect(lambda: shutdown_database(maintenance))
+        maintenance.start()
+        if FULL_DB_CHECK_FLAG in sys.argv:
+            maintenance.request_full_check()
+        QTimer.singleShot(WARMUP_DELAY_MS, warm_up_imports)
+        logging.info(
+            f"Tempo de inicialização: {(time.perf_counter() - startup_begin) * 1000:.0f} ms "
+            f"(init_db: {db_elapsed_ms:.1f} ms)"
+        )
         sys.exit(app.exec())
     except Exception as e:
         logging.critical(f"Ocorreu um erro fatal: {e}", exc_info=True)
@@ -69,6 +78,22 @@ def main():
         )
         sys.exit(1)
 
+def shutdown_database(maintenance: MaintenanceService):
+    # As threads de manutenção e de escrita fecham as próprias conexões ao terminar; só depois de juntá-las
+    # o fechamento geral recolhe o que restou.
+    maintenance.stop()
+    WriteQueue.shutdown()
+    db.close_all_connections()
+
+def write_startup_report():
+    report = import_time_report()
+    STARTUP_REPORT_PATH.write_text(report, encoding="utf-8")
+    print(report)
+    logging.info(f"Relatório de imports da abertura gravado em {STARTUP_REPORT_PATH}")
+
 if __name__ == "__main__":
     setup_logging()
+    if "--startup-report" in sys.argv:
+        write_startup_report()
+        sys.exit(0)
     main()
\ No newline at end of file
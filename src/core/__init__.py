@@ -1,4 +1,13 @@
-from . import database_manager as db
-from . import exam_processor as processor
+from importlib import import_module
 
-__all__ = ['db', 'processor']
\ No newline at end of file
+# Carregados no primeiro acesso: exam_processor traz o pandas, que não deve pesar na abertura do app.
+_SUBMODULES = {'db': 'database_manager', 'processor': 'exam_processor'}
+
+__all__ = ['db', 'processor']
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        module = import_module(f".{_SUBMODULES[name]}", __name__)
+        globals()[name] = module
+        return module
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,19 @@
+import threading
+
+class AnalysisCancelled(Exception):
+    """Levantada quando a análise é cancelada pelo usuário (ou substituída por uma nova)."""
+
+class CancellationToken:
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise AnalysisCancelled()
@@ -0,0 +1,89 @@
+from collections import namedtuple
+from typing import Iterable, Mapping, Optional
+import numpy as np
+import pandas as pd
+from .cancellation import CancellationToken
+from .exam_processor import exames_cobrados, identificar_pacientes_ativos, meses_de_tratamento, preparar_dados
+from .rule_engine import PERIODOS_PADRAO, Periodo, aplicar_regras
+
+MAX_MESES_A_FRENTE = 24
+AGENDA_COLUMNS = ['Mês', 'Clínica', 'Paciente', 'CNS', 'Exame', 'Tipo', 'Frequência']
+SEM_CLINICA = "Sem clínica"
+
+# agenda: uma linha por coleta prevista (AGENDA_COLUMNS); totais: coletas por mês/clínica/exame/tipo;
+# meses: os meses planejados ('AAAA-MM'), em ordem.
+PlanoColetas = namedtuple("PlanoColetas", ["agenda", "totais", "meses"])
+
+def _numero_do_mes(datas: pd.Series) -> np.ndarray:
+    return (datas.dt.year * 12 + datas.dt.month - 1).to_numpy(dtype=float, copy=True)
+
+def planejar_coletas(df_exames, data_referencia, rotina_exames, meses_a_frente: int = 6, df_movimentacoes=None,
+                     periodos: Iterable[Periodo] = PERIODOS_PADRAO, fusoes_cns: Optional[Mapping[str, str]] = None,
+                     cancel_token: Optional[CancellationToken] = None) -> PlanoColetas:
+    """Projeta as coletas de cada paciente ativo nos `meses_a_frente` meses seguintes ao de `data_referencia`.
+
+    As regras de todos os pacientes x exames x meses do horizonte são resolvidas numa única chamada de
+    aplicar_regras. Um exame entra no mês M quando a frequência cai no mês do ciclo e a última coleta
+    + intervalo já chegou em M; cada coleta prevista passa a ser a "última" dos meses seguintes, o que é
+    propagado mês a mês sobre todos os pares paciente x exame de uma vez.
+    """
+    meses_a_frente = max(1, min(int(meses_a_frente), MAX_MESES_A_FRENTE))
+    meses_plano = [(pd.Timestamp(data_referencia) + pd.DateOffset(months=k)).strftime('%Y-%m') for k in range(1, meses_a_frente + 1)]
+    indice = preparar_dados(df_exames, df_movimentacoes, None, fusoes_cns)
+    ativos = identificar_pacientes_ativos(indice, df_exames, df_movimentacoes, data_referencia)
+    cobrados = exames_cobrados(rotina_exames)
+    vazio = PlanoColetas(pd.DataFrame(columns=AGENDA_COLUMNS),
+                         pd.DataFrame(columns=['Mês', 'Clínica', 'Exame', 'Tipo', 'Quantidade']), meses_plano)
+    if ativos.empty or not cobrados:
+        return vazio
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+
+    # Linha (paciente, k) -> mês de tratamento no k-ésimo mês do horizonte; as regras saem todas de uma vez.
+    pids = np.repeat(ativos.index.to_numpy(), meses_a_frente)
+    ks = np.tile(np.arange(1, meses_a_frente + 1), len(ativos))
+    meses_ref = meses_de_tratamento(ativos['inicio_ciclo'], data_referencia).to_numpy()
+    meses = pd.Series(np.repeat(meses_ref, meses_a_frente) + ks)
+    regras = aplicar_regras(meses, {exame: rotina_exames[exame] for exame in cobrados}, periodos)
+    regras['pid'] = pids[regras['paciente'].to_numpy(dtype=int)]
+    regras['k'] = ks[regras['paciente'].to_numpy(dtype=int)]
+    # Cada (paciente, exame) vira uma linha de matriz com uma coluna por mês do horizonte.
+    regras = regras.sort_values(['pid', 'exame', 'k'], kind='stable').reset_index(drop=True)
+    devida = regras['devida'].to_numpy(dtype=bool).reshape(-1, meses_a_frente)
+    intervalo = regras['intervalo'].to_numpy(dtype=float).reshape(-1, meses_a_frente)
+    pares = regras.loc[::meses_a_frente, ['pid', 'exame']].reset_index(drop=True)
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+
+    historico = df_exames.loc[(df_exames['Data'] <= data_referencia) & df_exames['Exame'].isin(cobrados), ['pid', 'Exame', 'Data']]
+    ultimos = historico.groupby(['pid', 'Exame'], sort=False)['Data'].max().rename('ultimo').reset_index()
+    pares = pares.merge(ultimos, left_on=['pid', 'exame'], right_on=['pid', 'Exame'], how='left', sort=False)
+    ultimo = _numero_do_mes(pares['ultimo'])
+    mes_ref = data_referencia.year * 12 + data_referencia.month - 1
+    # Comparar por número do mês equivale a ultimo + intervalo <= fim do mês M (o dia nunca passa do fim do mês).
+    planejado = np.zeros_like(devida)
+    for k in range(meses_a_frente):
+        mes = mes_ref + k + 1
+        com_intervalo = ~np.isnan(intervalo[:, k])
+        vencido = np.isnan(ultimo) | (ultimo + np.where(com_intervalo, intervalo[:, k], 0) <= mes)
+        planejado[:, k] = devida[:, k] & com_intervalo & vencido
+        ultimo[planejado[:, k]] = mes
+
+    linhas, colunas = np.nonzero(planejado)
+    if not len(linhas):
+        return vazio
+    origem = regras.iloc[linhas * meses_a_frente + colunas]
+    pids_plano = origem['pid'].to_numpy()
+    clinicas = ativos['clinica'].reindex(pids_plano).fillna(SEM_CLINICA).to_numpy()
+    agenda = pd.DataFrame({
+        'Mês': np.array(meses_plano)[colunas],
+        'Clínica': clinicas,
+        'Paciente': [indice.nomes[pid] for pid in pids_plano],
+        'CNS': [indice.cns(pid) for pid in pids_plano],
+        'Exame': origem['exame'].to_numpy(),
+        'Tipo': origem['tipo'].to_numpy(),
+        'Frequência': (origem['frequencia'] + " (" + origem['periodo'] + ")").to_numpy(),
+    }).sort_values(['Mês', 'Clínica', 'Paciente', 'Exame'], kind='stable').reset_index(drop=True)
+    totais = (agenda.groupby(['Mês', 'Clínica', 'Exame', 'Tipo'], sort=True).size()
+              .rename('Quantidade').reset_index())
+    return PlanoColetas(agenda, totais, meses_plano)
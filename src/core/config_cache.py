@@ -0,0 +1,42 @@
+import threading
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+def freeze(value: Any) -> Any:
+    """Converte recursivamente dicts/listas/sets em estruturas imutáveis (MappingProxyType, tuple, frozenset)."""
+    if isinstance(value, (dict, MappingProxyType)):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, tuple) and hasattr(value, '_fields'):
+        # namedtuples continuam com o mesmo tipo (acesso por nome de campo).
+        return type(value)(*(freeze(v) for v in value))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(freeze(v) for v in value)
+    return value
+
+class ConfigCache:
+    """Cache de leitura das estruturas de configuração, invalidado por número de versão.
+
+    Cada entrada guarda a versão da configuração com que foi carregada; se o chamador informar uma
+    versão diferente, o carregador é executado novamente. Os valores são entregues congelados, então
+    podem ser compartilhados entre views e threads sem cópia.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[Hashable, Tuple[int, Any]] = {}
+
+    def get(self, key: Hashable, version: int, loader: Callable[[], Any]) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        value = freeze(loader())
+        with self._lock:
+            self._entries[key] = (version, value)
+        return value
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._entries.clear()
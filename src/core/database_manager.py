@@ -2,23 +2,42 @@ import sqlite3
 import logging
 import json
 import sys
+import threading
+import atexit
+import time
 from contextlib import contextmanager
-from typing import Dict, List, Set, Tuple, Optional
+from typing import Callable, Dict, List, Set, Tuple, Optional, Mapping, Iterable
 from pathlib import Path
+from .config_cache import ConfigCache
+from .rule_engine import PERIODOS_PADRAO, Periodo, especificidade
 
 logger = logging.getLogger(__name__)
 
 DB_FILE: Optional[Path] = None
-CODE_DB_VERSION = 3 # AUMENTAMOS A VERSÃO PARA IMPLEMENTAR A NOVA FUNCIONALIDADE
+CODE_DB_VERSION = 7
+
+# Ajustes aplicados a cada conexão persistente (uma por thread).
+BUSY_TIMEOUT_MS = 5000
+CACHE_SIZE_KIB = 8192
 
 if getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS'):
     CONFIG_PATH = Path(sys._MEIPASS) / "src" / "resources" / "config" / "default_config.json"
 else:
     CONFIG_PATH = Path(__file__).resolve().parent.parent / "resources" / "config" / "default_config.json"
 
+CONFIG_VERSION_KEY = 'config_version'
+
+_thread_state = threading.local()
+_connections_lock = threading.Lock()
+_open_connections: Dict[int, Tuple[threading.Thread, sqlite3.Connection]] = {}
+_config_cache = ConfigCache()
+_last_write_at = time.monotonic()
+
 def set_database_path(data_dir: Path):
     global DB_FILE
     data_dir.mkdir(parents=True, exist_ok=True)
+    close_all_connections()
+    _config_cache.invalidate()
     DB_FILE = data_dir / "app.db"
     logger.info(f"Caminho do banco de dados definido para: {DB_FILE}")
 
@@ -31,23 +50,182 @@ def _load_default_config() -> Dict:
         logger.error(f"Não foi possível carregar ou parsear o arquivo de configuração padrão: {e}")
         return {"clinicas": [], "exames": {}, "rotinas": {}, "perfis": {}}
 
+def _open_connection() -> sqlite3.Connection:
+    # check_same_thread=False apenas para que close_all_connections recolha conexões de threads já encerradas;
+    # cada conexão continua sendo usada exclusivamente pela thread que a criou.
+    conn = sqlite3.connect(DB_FILE, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    # Só tem efeito em bancos novos (antes da primeira tabela); bancos existentes são convertidos pela
+    # manutenção com um VACUUM completo (ver enable_incremental_vacuum).
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+    conn.execute("PRAGMA foreign_keys = ON;")
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS};")
+    journal_mode = conn.execute("PRAGMA journal_mode = WAL;").fetchone()[0]
+    if journal_mode.lower() != 'wal':
+        logger.warning(f"Não foi possível ativar o modo WAL (modo atual: {journal_mode}).")
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB};")
+    conn.execute("PRAGMA temp_store = MEMORY;")
+    return conn
+
+def _get_thread_connection() -> sqlite3.Connection:
+    conn = getattr(_thread_state, 'conn', None)
+    if conn is not None and getattr(_thread_state, 'db_file', None) == DB_FILE:
+        return conn
+    if conn is not None:
+        close_thread_connection()
+    conn = _open_connection()
+    _thread_state.conn = conn
+    _thread_state.db_file = DB_FILE
+    _thread_state.tx_depth = 0
+    with _connections_lock:
+        _open_connections[threading.get_ident()] = (threading.current_thread(), conn)
+    logger.debug(f"Nova conexão SQLite aberta para a thread {threading.current_thread().name}")
+    return conn
+
+def close_thread_connection() -> None:
+    conn = getattr(_thread_state, 'conn', None)
+    if conn is None:
+        return
+    with _connections_lock:
+        _open_connections.pop(threading.get_ident(), None)
+    _thread_state.conn = None
+    _thread_state.tx_depth = 0
+    try:
+        conn.close()
+    except sqlite3.Error as e:
+        logger.warning(f"Erro ao fechar conexão da thread: {e}")
+
+def close_all_connections() -> None:
+    """Fallback de encerramento: fecha a conexão da thread atual e as que sobraram de threads já finalizadas.
+
+    Cada thread deve fechar a própria conexão com close_thread_connection; conexões de threads ainda vivas
+    são mantidas, pois podem estar no meio de uma transação.
+    """
+    close_thread_connection()
+    with _connections_lock:
+        orfas = {ident: item for ident, item in _open_connections.items() if not item[0].is_alive()}
+        vivas = [item[0].name for ident, item in _open_connections.items() if ident not in orfas]
+        for ident in orfas:
+            del _open_connections[ident]
+    if vivas:
+        logger.warning(f"Conexões mantidas abertas porque as threads ainda estão em execução: {', '.join(vivas)}")
+    for _thread, conn in orfas.values():
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"Erro ao fechar conexão: {e}")
+
+atexit.register(close_all_connections)
+
 @contextmanager
 def get_db_connection():
-    conn = None
     try:
-        conn = sqlite3.connect(DB_FILE)
-        conn.row_factory = sqlite3.Row
-        conn.execute("PRAGMA foreign_keys = ON;")
-        yield conn
+        conn = _get_thread_connection()
     except sqlite3.Error as e:
         logger.error(f"Erro ao conectar ao banco de dados: {e}")
-        if conn:
+        raise
+    try:
+        yield conn
+    except Exception:
+        # Fora de um escopo de transação explícito, nada pendente pode vazar para o próximo uso da conexão.
+        if getattr(_thread_state, 'tx_depth', 0) == 0 and conn.in_transaction:
             conn.rollback()
         raise
-    finally:
-        if conn:
-            conn.close()
+    else:
+        if getattr(_thread_state, 'tx_depth', 0) == 0 and conn.in_transaction:
+            # Escritas fora de transaction() precisam de commit explícito; descartá-las em silêncio esconderia perda de dados.
+            logger.warning("Escritas não confirmadas descartadas ao liberar a conexão (faltou commit ou transaction()).")
+            conn.rollback()
+
+@contextmanager
+def transaction(immediate: bool = True):
+    """Escopo de transação explícito na conexão da thread atual.
+
+    Escopos aninhados viram SAVEPOINTs, de modo que uma falha interna desfaz apenas a sua parte.
+    """
+    with get_db_connection() as conn:
+        depth = _thread_state.tx_depth
+        savepoint = f"sp_{depth}"
+        if depth == 0:
+            conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            changes_before = conn.total_changes
+        else:
+            conn.execute(f"SAVEPOINT {savepoint}")
+        _thread_state.tx_depth = depth + 1
+        try:
+            yield conn
+        except BaseException:
+            _thread_state.tx_depth = depth
+            if depth == 0:
+                conn.rollback()
+            else:
+                conn.execute(f"ROLLBACK TO {savepoint}")
+                conn.execute(f"RELEASE {savepoint}")
+            raise
+        _thread_state.tx_depth = depth
+        if depth == 0:
+            conn.commit()
+            if conn.total_changes != changes_before:
+                _mark_write()
+        else:
+            conn.execute(f"RELEASE {savepoint}")
+
+def _mark_write() -> None:
+    global _last_write_at
+    _last_write_at = time.monotonic()
+
+def seconds_since_last_write() -> float:
+    """Tempo desde o último commit feito por este processo; usado pela manutenção para detectar ociosidade."""
+    return time.monotonic() - _last_write_at
+
+def _get_config_version(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT value FROM db_meta WHERE key = ?", (CONFIG_VERSION_KEY,)).fetchone()
+    return int(row['value']) if row else 0
+
+def _bump_config_version(conn: sqlite3.Connection) -> None:
+    # Toda escrita de configuração passa por aqui, na mesma transação, para invalidar os caches de leitura.
+    conn.execute(
+        "INSERT INTO db_meta (key, value) VALUES (?, '1') "
+        "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+        (CONFIG_VERSION_KEY,)
+    )
+
+def _fetch_id_map(conn: sqlite3.Connection, table: str, column: str) -> Dict[str, int]:
+    return {row[column]: row['id'] for row in conn.execute(f"SELECT id, {column} FROM {table}")}
+
+_ROTINA_CONFIG_DDL = '''
+    CREATE TABLE {nome} (
+        id INTEGER PRIMARY KEY, 
+        rotina_id INTEGER NOT NULL, 
+        exame_id INTEGER NOT NULL, 
+        periodo TEXT NOT NULL DEFAULT 'Sempre',
+        frequencia TEXT NOT NULL, 
+        tipo TEXT NOT NULL, 
+        FOREIGN KEY (rotina_id) REFERENCES rotinas (id) ON DELETE CASCADE, 
+        FOREIGN KEY (exame_id) REFERENCES exames (id) ON DELETE CASCADE, 
+        UNIQUE(rotina_id, exame_id, periodo)
+    )
+'''
+
+# Registro de migrações: versão de destino -> (descrição, função). Cada migração roda na sua própria
+# transação e fica anotada em schema_migrations. O esquema completo da versão atual é criado por
+# _create_schema, então as migrações só precisam transformar bancos antigos.
+_MIGRATIONS: Dict[int, Tuple[str, Callable[[sqlite3.Connection], None]]] = {}
+
+def _migration(version: int, description: str):
+    def register(func: Callable[[sqlite3.Connection], None]):
+        _MIGRATIONS[version] = (description, func)
+        return func
+    return register
 
+def _has_unique_constraint(conn: sqlite3.Connection, table: str, columns: List[str]) -> bool:
+    for index in conn.execute(f"PRAGMA index_list({table})"):
+        if index['unique'] and [c['name'] for c in conn.execute(f"PRAGMA index_info({index['name']})")] == columns:
+            return True
+    return False
+
+@_migration(2, "Sincroniza clínicas e exames padrão")
 def _migrate_v1_to_v2(conn: sqlite3.Connection):
     logger.info("Executando migração do DB para a v2: Sincronizando dados padrão...")
     cursor = conn.cursor()
@@ -57,57 +235,87 @@ def _migrate_v1_to_v2(conn: sqlite3.Connection):
     if default_clinicas:
         cursor.executemany("INSERT OR IGNORE INTO clinicas (nome) VALUES (?)", [(n,) for n in default_clinicas])
     if default_exames:
-        for nome, details in default_exames.items():
-            cursor.execute("INSERT OR IGNORE INTO exames (nome_padrao) VALUES (?)", (nome,))
-            exame_id = cursor.execute("SELECT id FROM exames WHERE nome_padrao = ?", (nome,)).fetchone()['id']
-            if details.get('aliases'):
-                cursor.executemany("INSERT OR IGNORE INTO exame_aliases (exame_id, alias) VALUES (?, ?)", [(exame_id, a) for a in details['aliases']])
+        cursor.executemany("INSERT OR IGNORE INTO exames (nome_padrao) VALUES (?)", [(n,) for n in default_exames])
+        exame_ids = _fetch_id_map(conn, 'exames', 'nome_padrao')
+        cursor.executemany("INSERT OR IGNORE INTO exame_aliases (exame_id, alias) VALUES (?, ?)",
+                           [(exame_ids[nome], a) for nome, details in default_exames.items() for a in details.get('aliases', [])])
+    _bump_config_version(conn)
     logger.info("Migração para v2 concluída.")
 
+@_migration(3, "Campo 'periodo' e chave única (rotina_id, exame_id, periodo) em rotina_config")
 def _migrate_v2_to_v3(conn: sqlite3.Connection):
     logger.info("Executando migração do DB para a v3: Adicionando campo 'periodo' às rotinas...")
-    cursor = conn.cursor()
-    try:
-        # Adiciona a nova coluna. O DEFAULT 'Sempre' aplica a regra padrão para dados existentes.
-        cursor.execute("ALTER TABLE rotina_config ADD COLUMN periodo TEXT NOT NULL DEFAULT 'Sempre'")
-        
-        # O SQLite não suporta DROP CONSTRAINT. A maneira mais segura de recriar a chave única
-        # seria criar uma nova tabela, copiar os dados e renomear. Para esta atualização,
-        # vamos confiar que não haverá duplicatas e adicionar a lógica na aplicação.
-        # Em sistemas maiores, um passo de recriação da tabela seria necessário aqui.
-        logger.info("Coluna 'periodo' adicionada com sucesso à tabela rotina_config.")
-        conn.commit()
-    except sqlite3.OperationalError as e:
-        if "duplicate column name" in str(e):
-            logger.warning("Coluna 'periodo' já existe em rotina_config. Pulando a migração.")
-        else:
-            logger.error(f"Erro ao migrar para v3: {e}")
-            conn.rollback()
-            raise
+    colunas = {row['name'] for row in conn.execute("PRAGMA table_info(rotina_config)")}
+    if 'periodo' in colunas and _has_unique_constraint(conn, 'rotina_config', ['rotina_id', 'exame_id', 'periodo']):
+        logger.warning("rotina_config já possui 'periodo' e a chave única nova. Pulando a migração.")
+        return
+    # O SQLite não suporta alterar constraints: recria a tabela com o esquema novo, copia os dados e troca os nomes.
+    # Linhas antigas sem período recebem 'Sempre', que era a semântica implícita antes da v3.
+    periodo_expr = 'periodo' if 'periodo' in colunas else "'Sempre'"
+    conn.execute(_ROTINA_CONFIG_DDL.format(nome='rotina_config_v3'))
+    conn.execute(
+        "INSERT OR IGNORE INTO rotina_config_v3 (id, rotina_id, exame_id, periodo, frequencia, tipo) "
+        f"SELECT id, rotina_id, exame_id, {periodo_expr}, frequencia, tipo FROM rotina_config ORDER BY id"
+    )
+    conn.execute("DROP TABLE rotina_config")
+    conn.execute("ALTER TABLE rotina_config_v3 RENAME TO rotina_config")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_rotina_config_rotina_id ON rotina_config(rotina_id)")
+    _bump_config_version(conn)
+    logger.info("Tabela rotina_config recriada com o campo 'periodo' e a nova chave única.")
 
-def _run_migrations(conn: sqlite3.Connection):
-    cursor = conn.cursor()
-    version_row = cursor.execute("SELECT value FROM db_meta WHERE key = 'db_version'").fetchone()
-    current_version = 0
-    if version_row is None:
-        has_tables = cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='clinicas'").fetchone()
-        if has_tables:
-            current_version = 1
-            cursor.execute("INSERT OR IGNORE INTO db_meta (key, value) VALUES ('db_version', ?)", (str(current_version),))
-    else:
-        current_version = int(version_row['value'])
+@_migration(4, "Índices de overrides e tabela de arquivo")
+def _migrate_v3_to_v4(conn: sqlite3.Connection):
+    logger.info("Executando migração do DB para a v4: Índices de overrides e tabela de arquivo...")
+    # Índices e tabela já são criados (IF NOT EXISTS) em _create_schema; aqui só removemos o índice substituído
+    # pelo índice de cobertura (analysis_period, patient_cns, exam).
+    conn.execute("DROP INDEX IF EXISTS idx_manual_overrides_period")
+    logger.info("Migração para v4 concluída.")
+
+@_migration(5, "Histórico de resultados de análise")
+def _migrate_v4_to_v5(conn: sqlite3.Connection):
+    # As tabelas analysis_runs, analysis_patient_results e analysis_pending_exams são criadas em _create_schema; a
+    # entrada existe para que db_version e schema_migrations registrem a v5 (sem ela _run_migrations pula a versão).
+    logger.info("Migração para v5: tabelas de histórico de análises disponíveis.")
+
+def _seed_periodos(conn: sqlite3.Connection) -> None:
+    conn.executemany("INSERT OR IGNORE INTO periodos (nome, mes_inicio, mes_fim) VALUES (?, ?, ?)", PERIODOS_PADRAO)
+
+@_migration(6, "Tabela de períodos das regras")
+def _migrate_v5_to_v6(conn: sqlite3.Connection):
+    # A tabela é criada em _create_schema; aqui recebe os períodos que antes eram fixos no código.
+    logger.info("Migração para v6: cadastrando os períodos padrão das regras...")
+    _seed_periodos(conn)
+    _bump_config_version(conn)
+
+@_migration(7, "Tabela de fusões de pacientes duplicados")
+def _migrate_v6_to_v7(conn: sqlite3.Connection):
+    # A tabela patient_merges é criada em _create_schema; como na v5, a entrada só registra a versão.
+    logger.info("Migração para v7: tabela de fusões de pacientes disponível.")
+
+def _get_stored_db_version(conn: sqlite3.Connection) -> int:
+    version_row = conn.execute("SELECT value FROM db_meta WHERE key = 'db_version'").fetchone()
+    if version_row is not None:
+        return int(version_row['value'])
+    has_tables = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='clinicas'").fetchone()
+    if has_tables:
+        conn.execute("INSERT OR IGNORE INTO db_meta (key, value) VALUES ('db_version', ?)", ('1',))
+        return 1
+    return 0
+
+def _run_migrations():
+    with transaction() as conn:
+        current_version = _get_stored_db_version(conn)
     logger.info(f"Versão do banco de dados: {current_version}. Versão do código: {CODE_DB_VERSION}")
-    while current_version < CODE_DB_VERSION:
-        logger.info(f"Aplicando migração da versão {current_version} para {current_version + 1}...")
-        if current_version == 1:
-            _migrate_v1_to_v2(conn)
-            cursor.execute("UPDATE db_meta SET value = ? WHERE key = 'db_version'", (str(2),))
-            conn.commit()
-        elif current_version == 2:
-            _migrate_v2_to_v3(conn)
-            cursor.execute("UPDATE db_meta SET value = ? WHERE key = 'db_version'", (str(3),))
-            conn.commit()
-        current_version = int(cursor.execute("SELECT value FROM db_meta WHERE key = 'db_version'").fetchone()['value'])
+    for version in range(current_version + 1, CODE_DB_VERSION + 1):
+        if version not in _MIGRATIONS:
+            logger.warning(f"Nenhuma migração registrada para a versão {version}.")
+            continue
+        description, migrate = _MIGRATIONS[version]
+        logger.info(f"Aplicando migração da versão {version - 1} para {version}: {description}")
+        with transaction() as conn:
+            migrate(conn)
+            conn.execute("UPDATE db_meta SET value = ? WHERE key = 'db_version'", (str(version),))
+            conn.execute("INSERT OR REPLACE INTO schema_migrations (version, description) VALUES (?, ?)", (version, description))
 
 def _seed_database_if_empty(conn: sqlite3.Connection) -> None:
     try:
@@ -123,192 +331,338 @@ def _seed_database_if_empty(conn: sqlite3.Connection) -> None:
             if default_clinicas:
                 cursor.executemany("INSERT INTO clinicas (nome) VALUES (?)", [(n,) for n in default_clinicas])
             if default_exames:
-                for nome, details in default_exames.items():
-                    cursor.execute("INSERT INTO exames (nome_padrao) VALUES (?)", (nome,))
-                    exame_id = cursor.lastrowid
-                    if details.get('aliases'):
-                        cursor.executemany("INSERT INTO exame_aliases (exame_id, alias) VALUES (?, ?)", [(exame_id, a) for a in details['aliases']])
+                cursor.executemany("INSERT INTO exames (nome_padrao) VALUES (?)", [(n,) for n in default_exames])
+            exame_ids = _fetch_id_map(conn, 'exames', 'nome_padrao')
+            cursor.executemany("INSERT INTO exame_aliases (exame_id, alias) VALUES (?, ?)",
+                               [(exame_ids[nome], a) for nome, details in default_exames.items() for a in details.get('aliases', [])])
             if default_rotinas:
-                for r_nome, conf in default_rotinas.items():
-                    cursor.execute("INSERT INTO rotinas (nome) VALUES (?)", (r_nome,))
-                    r_id = cursor.lastrowid
-                    for e_nome, rules_list in conf.items():
-                        e_row = cursor.execute("SELECT id FROM exames WHERE nome_padrao = ?", (e_nome,)).fetchone()
-                        if e_row:
-                            for rule in rules_list:
-                                cursor.execute("INSERT INTO rotina_config (rotina_id, exame_id, periodo, frequencia, tipo) VALUES (?, ?, ?, ?, ?)", (r_id, e_row['id'], rule['Período'], rule['Frequência'], rule['Tipo']))
+                cursor.executemany("INSERT INTO rotinas (nome) VALUES (?)", [(n,) for n in default_rotinas])
+            rotina_ids = _fetch_id_map(conn, 'rotinas', 'nome')
+            cursor.executemany(
+                "INSERT INTO rotina_config (rotina_id, exame_id, periodo, frequencia, tipo) VALUES (?, ?, ?, ?, ?)",
+                [(rotina_ids[r_nome], exame_ids[e_nome], rule['Período'], rule['Frequência'], rule['Tipo'])
+                 for r_nome, conf in default_rotinas.items()
+                 for e_nome, rules_list in conf.items() if e_nome in exame_ids
+                 for rule in rules_list]
+            )
+            _seed_periodos(conn)
             if default_perfis:
-                for p_nome, details in default_perfis.items():
-                    r_row = cursor.execute("SELECT id FROM rotinas WHERE nome = ?", (details.get('rotina'),)).fetchone()
-                    r_id = r_row['id'] if r_row else None
-                    cursor.execute("INSERT INTO perfis (nome, rotina_id) VALUES (?, ?)", (p_nome, r_id))
-                    p_id = cursor.lastrowid
-                    if details.get('clinicas'):
-                        placeholders = ','.join(['?'] * len(details['clinicas']))
-                        c_ids = [row['id'] for row in cursor.execute(f"SELECT id FROM clinicas WHERE nome IN ({placeholders})", details['clinicas']).fetchall()]
-                        cursor.executemany("INSERT INTO perfil_clinicas (perfil_id, clinica_id) VALUES (?, ?)", [(p_id, c_id) for c_id in c_ids])
+                cursor.executemany("INSERT INTO perfis (nome, rotina_id) VALUES (?, ?)",
+                                   [(p_nome, rotina_ids.get(details.get('rotina'))) for p_nome, details in default_perfis.items()])
+            perfil_ids = _fetch_id_map(conn, 'perfis', 'nome')
+            clinica_ids = _fetch_id_map(conn, 'clinicas', 'nome')
+            cursor.executemany(
+                "INSERT INTO perfil_clinicas (perfil_id, clinica_id) VALUES (?, ?)",
+                [(perfil_ids[p_nome], clinica_ids[c_nome])
+                 for p_nome, details in default_perfis.items()
+                 for c_nome in set(details.get('clinicas', [])) if c_nome in clinica_ids]
+            )
             cursor.execute("INSERT OR IGNORE INTO db_meta (key, value) VALUES ('db_version', ?)", (str(CODE_DB_VERSION),)) # POPULA COM A VERSÃO ATUAL
-            conn.commit()
+            # Banco criado já na versão atual: as migrações até ela ficam registradas como aplicadas, como num banco migrado.
+            cursor.executemany("INSERT OR IGNORE INTO schema_migrations (version, description) VALUES (?, ?)",
+                               [(v, desc) for v, (desc, _) in sorted(_MIGRATIONS.items()) if v <= CODE_DB_VERSION])
+            _bump_config_version(conn)
             logger.info("Dados padrão inseridos com sucesso")
     except Exception as e:
         logger.error(f"Erro ao popular banco de dados: {e}")
-        conn.rollback()
         raise
 
+def _create_schema(conn: sqlite3.Connection) -> None:
+    cursor = conn.cursor()
+    cursor.execute('CREATE TABLE IF NOT EXISTS clinicas (id INTEGER PRIMARY KEY, nome TEXT NOT NULL UNIQUE)')
+    cursor.execute('CREATE TABLE IF NOT EXISTS exames (id INTEGER PRIMARY KEY, nome_padrao TEXT NOT NULL UNIQUE)')
+    cursor.execute('CREATE TABLE IF NOT EXISTS exame_aliases (id INTEGER PRIMARY KEY, exame_id INTEGER NOT NULL, alias TEXT NOT NULL, FOREIGN KEY (exame_id) REFERENCES exames (id) ON DELETE CASCADE)')
+    cursor.execute('CREATE TABLE IF NOT EXISTS rotinas (id INTEGER PRIMARY KEY, nome TEXT NOT NULL UNIQUE)')
+    cursor.execute(_ROTINA_CONFIG_DDL.format(nome='IF NOT EXISTS rotina_config'))
+    # Faixa de meses de tratamento [mes_inicio, mes_fim] de cada período; NULL deixa o limite aberto.
+    cursor.execute('CREATE TABLE IF NOT EXISTS periodos (id INTEGER PRIMARY KEY, nome TEXT NOT NULL UNIQUE, mes_inicio INTEGER, mes_fim INTEGER, CHECK (mes_inicio IS NULL OR mes_fim IS NULL OR mes_inicio <= mes_fim))')
+    cursor.execute('CREATE TABLE IF NOT EXISTS perfis (id INTEGER PRIMARY KEY, nome TEXT NOT NULL UNIQUE, rotina_id INTEGER, FOREIGN KEY (rotina_id) REFERENCES rotinas (id) ON DELETE SET NULL)')
+    cursor.execute('CREATE TABLE IF NOT EXISTS perfil_clinicas (perfil_id INTEGER NOT NULL, clinica_id INTEGER NOT NULL, PRIMARY KEY (perfil_id, clinica_id), FOREIGN KEY (perfil_id) REFERENCES perfis (id) ON DELETE CASCADE, FOREIGN KEY (clinica_id) REFERENCES clinicas (id) ON DELETE CASCADE)')
+    cursor.execute('CREATE TABLE IF NOT EXISTS manual_overrides (id INTEGER PRIMARY KEY, patient_cns TEXT NOT NULL, exam TEXT NOT NULL, analysis_period TEXT NOT NULL, marked_by TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, UNIQUE(patient_cns, exam, analysis_period))')
+    cursor.execute('CREATE TABLE IF NOT EXISTS manual_overrides_archive (id INTEGER PRIMARY KEY, original_id INTEGER NOT NULL, patient_cns TEXT NOT NULL, exam TEXT NOT NULL, analysis_period TEXT NOT NULL, marked_by TEXT, timestamp DATETIME, archived_at DATETIME DEFAULT CURRENT_TIMESTAMP)')
+    # CNS de pacientes duplicados -> CNS canônico, aplicado pelo índice de pacientes da análise.
+    cursor.execute('CREATE TABLE IF NOT EXISTS patient_merges (cns TEXT PRIMARY KEY, canonical_cns TEXT NOT NULL, created_at DATETIME DEFAULT CURRENT_TIMESTAMP, CHECK (cns != canonical_cns))')
+    cursor.execute('CREATE TABLE IF NOT EXISTS db_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+    cursor.execute('CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY, description TEXT NOT NULL, applied_at DATETIME DEFAULT CURRENT_TIMESTAMP)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_exame_aliases_exame_id ON exame_aliases(exame_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_rotina_config_rotina_id ON rotina_config(rotina_id)')
+    # Cobre a leitura de get_overrides_for_period sem acessar a tabela.
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_manual_overrides_period_cns_exam ON manual_overrides(analysis_period, patient_cns, exam)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_manual_overrides_timestamp ON manual_overrides(timestamp)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_manual_overrides_archive_period ON manual_overrides_archive(analysis_period)')
+    cursor.execute('CREATE TABLE IF NOT EXISTS analysis_runs (id INTEGER PRIMARY KEY, perfil TEXT NOT NULL, analysis_period TEXT NOT NULL, total_pacientes INTEGER NOT NULL, num_ativos INTEGER NOT NULL, created_at DATETIME DEFAULT CURRENT_TIMESTAMP, UNIQUE(perfil, analysis_period))')
+    cursor.execute('CREATE TABLE IF NOT EXISTS analysis_patient_results (id INTEGER PRIMARY KEY, run_id INTEGER NOT NULL, patient_nome TEXT NOT NULL, patient_cns TEXT NOT NULL, clinica TEXT, status TEXT NOT NULL, resumo TEXT, motivo_internacao TEXT, FOREIGN KEY (run_id) REFERENCES analysis_runs (id) ON DELETE CASCADE)')
+    cursor.execute('CREATE TABLE IF NOT EXISTS analysis_pending_exams (result_id INTEGER NOT NULL, categoria TEXT NOT NULL, exame TEXT NOT NULL, frequencia TEXT, ultimo_realizado TEXT, proxima_data TEXT, FOREIGN KEY (result_id) REFERENCES analysis_patient_results (id) ON DELETE CASCADE)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_analysis_patient_results_run_status ON analysis_patient_results(run_id, status)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_analysis_patient_results_run_cns ON analysis_patient_results(run_id, patient_cns)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_analysis_pending_exams_result ON analysis_pending_exams(result_id)')
+
 def init_db() -> None:
+    inicio = time.perf_counter()
     try:
         with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('CREATE TABLE IF NOT EXISTS clinicas (id INTEGER PRIMARY KEY, nome TEXT NOT NULL UNIQUE)')
-            cursor.execute('CREATE TABLE IF NOT EXISTS exames (id INTEGER PRIMARY KEY, nome_padrao TEXT NOT NULL UNIQUE)')
-            cursor.execute('CREATE TABLE IF NOT EXISTS exame_aliases (id INTEGER PRIMARY KEY, exame_id INTEGER NOT NULL, alias TEXT NOT NULL, FOREIGN KEY (exame_id) REFERENCES exames (id) ON DELETE CASCADE)')
-            cursor.execute('CREATE TABLE IF NOT EXISTS rotinas (id INTEGER PRIMARY KEY, nome TEXT NOT NULL UNIQUE)')
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS rotina_config (
-                    id INTEGER PRIMARY KEY, 
-                    rotina_id INTEGER NOT NULL, 
-                    exame_id INTEGER NOT NULL, 
-                    periodo TEXT NOT NULL DEFAULT 'Sempre',
-                    frequencia TEXT NOT NULL, 
-                    tipo TEXT NOT NULL, 
-                    FOREIGN KEY (rotina_id) REFERENCES rotinas (id) ON DELETE CASCADE, 
-                    FOREIGN KEY (exame_id) REFERENCES exames (id) ON DELETE CASCADE, 
-                    UNIQUE(rotina_id, exame_id, periodo)
-                )
-            ''')
-            cursor.execute('CREATE TABLE IF NOT EXISTS perfis (id INTEGER PRIMARY KEY, nome TEXT NOT NULL UNIQUE, rotina_id INTEGER, FOREIGN KEY (rotina_id) REFERENCES rotinas (id) ON DELETE SET NULL)')
-            cursor.execute('CREATE TABLE IF NOT EXISTS perfil_clinicas (perfil_id INTEGER NOT NULL, clinica_id INTEGER NOT NULL, PRIMARY KEY (perfil_id, clinica_id), FOREIGN KEY (perfil_id) REFERENCES perfis (id) ON DELETE CASCADE, FOREIGN KEY (clinica_id) REFERENCES clinicas (id) ON DELETE CASCADE)')
-            cursor.execute('CREATE TABLE IF NOT EXISTS manual_overrides (id INTEGER PRIMARY KEY, patient_cns TEXT NOT NULL, exam TEXT NOT NULL, analysis_period TEXT NOT NULL, marked_by TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, UNIQUE(patient_cns, exam, analysis_period))')
-            cursor.execute('CREATE TABLE IF NOT EXISTS db_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_exame_aliases_exame_id ON exame_aliases(exame_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_rotina_config_rotina_id ON rotina_config(rotina_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_manual_overrides_period ON manual_overrides(analysis_period)')
-            conn.commit()
+            schema_version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if schema_version > CODE_DB_VERSION:
+            # Banco gravado por uma versão mais nova do programa: usado como está, sem DDL nem rebaixar a versão.
+            logger.warning(f"Esquema do banco na versão {schema_version}, mais nova que a do código ({CODE_DB_VERSION}); "
+                           "nenhuma alteração de esquema será feita.")
+            return
+        if schema_version == CODE_DB_VERSION:
+            # Caminho rápido: esquema já na versão do código, nada de DDL, carga inicial ou migrações.
+            logger.info(f"Esquema do banco na versão {schema_version}; inicialização rápida em {(time.perf_counter() - inicio) * 1000:.1f} ms")
+            return
+        with transaction() as conn:
+            _create_schema(conn)
+        with transaction() as conn:
             _seed_database_if_empty(conn)
-            _run_migrations(conn)
-            logger.info("Banco de dados inicializado com sucesso")
+        _run_migrations()
+        with transaction() as conn:
+            conn.execute(f"PRAGMA user_version = {CODE_DB_VERSION}")
+        logger.info(f"Banco de dados inicializado com sucesso em {(time.perf_counter() - inicio) * 1000:.1f} ms")
     except Exception as e:
         logger.error(f"Erro ao inicializar banco de dados: {e}")
         raise
 
-def get_rotina_details(rotina_nome: str) -> Dict[str, List[Dict[str, str]]]:
+def _load_rotina_details(conn: sqlite3.Connection, rotina_nome: str) -> Dict[str, List[Dict[str, str]]]:
     rotina = {}
+    query = "SELECT e.nome_padrao, rc.periodo, rc.frequencia, rc.tipo FROM rotina_config rc JOIN rotinas r ON rc.rotina_id = r.id JOIN exames e ON rc.exame_id = e.id WHERE r.nome = ? ORDER BY rc.id"
+    for row in conn.execute(query, (rotina_nome,)):
+        # setdefault inicializa a chave com uma lista vazia se ela não existir
+        rotina.setdefault(row['nome_padrao'], []).append({
+            'Período': row['periodo'],
+            'Frequência': row['frequencia'],
+            'Tipo': row['tipo']
+        })
+    return rotina
+
+def get_rotina_details(rotina_nome: str) -> Mapping[str, Tuple[Mapping[str, str], ...]]:
     try:
         with get_db_connection() as conn:
-            query = "SELECT e.nome_padrao, rc.periodo, rc.frequencia, rc.tipo FROM rotina_config rc JOIN rotinas r ON rc.rotina_id = r.id JOIN exames e ON rc.exame_id = e.id WHERE r.nome = ?"
-            for row in conn.execute(query, (rotina_nome,)):
-                # setdefault inicializa a chave com uma lista vazia se ela não existir
-                rotina.setdefault(row['nome_padrao'], []).append({
-                    'Período': row['periodo'],
-                    'Frequência': row['frequencia'],
-                    'Tipo': row['tipo']
-                })
+            return _config_cache.get(('rotina', rotina_nome), _get_config_version(conn), lambda: _load_rotina_details(conn, rotina_nome))
     except Exception as e:
         logger.error(f"Erro ao buscar detalhes da rotina {rotina_nome}: {e}")
-    return rotina
+        return {}
 
-def save_rotina(rotina_nome: str, config_dict: Dict[str, List[Dict[str, str]]]) -> None:
+def save_rotina(rotina_nome: str, config_dict: Dict[str, List[Dict[str, str]]], partial: bool = False) -> None:
+    """Grava as regras de `config_dict`. Com partial=True só os exames presentes em `config_dict` são tocados;
+    caso contrário, regras de exames ausentes são removidas."""
     try:
-        with get_db_connection() as conn:
+        with transaction() as conn:
             r_row = conn.execute("SELECT id FROM rotinas WHERE nome = ?", (rotina_nome,)).fetchone()
             if not r_row:
                 raise ValueError(f"Rotina '{rotina_nome}' não encontrada")
             r_id = r_row['id']
-            conn.execute("DELETE FROM rotina_config WHERE rotina_id = ?", (r_id,))
+            exame_ids = _fetch_id_map(conn, 'exames', 'nome_padrao')
+            desejadas = {}
             for e_nome, rules_list in config_dict.items():
-                if not rules_list:
+                if e_nome not in exame_ids:
                     continue
-                e_row = conn.execute("SELECT id FROM exames WHERE nome_padrao = ?", (e_nome,)).fetchone()
-                if e_row:
-                    for rule in rules_list:
-                        if rule.get('Frequência') == 'Não Cobra':
-                            continue
-                        conn.execute("INSERT INTO rotina_config (rotina_id, exame_id, periodo, frequencia, tipo) VALUES (?, ?, ?, ?, ?)", (r_id, e_row['id'], rule['Período'], rule['Frequência'], rule['Tipo']))
-            conn.commit()
-            logger.info(f"Rotina '{rotina_nome}' salva com sucesso")
+                periodos = [rule['Período'] for rule in rules_list]
+                if len(set(periodos)) != len(periodos):
+                    raise ValueError(f"O exame '{e_nome}' tem mais de uma regra para o mesmo período")
+                for rule in rules_list:
+                    if rule.get('Frequência') != 'Não Cobra':
+                        desejadas[(exame_ids[e_nome], rule['Período'])] = (rule['Frequência'], rule['Tipo'])
+            atuais = {(row['exame_id'], row['periodo']): row for row in
+                      conn.execute("SELECT id, exame_id, periodo, frequencia, tipo FROM rotina_config WHERE rotina_id = ?", (r_id,))}
+            if partial:
+                enviados = {exame_ids[e_nome] for e_nome in config_dict if e_nome in exame_ids}
+                atuais = {chave: row for chave, row in atuais.items() if chave[0] in enviados}
+            removidas = [(row['id'],) for chave, row in atuais.items() if chave not in desejadas]
+            alteradas = [(freq, tipo, atuais[chave]['id']) for chave, (freq, tipo) in desejadas.items()
+                         if chave in atuais and (atuais[chave]['frequencia'], atuais[chave]['tipo']) != (freq, tipo)]
+            novas = [(r_id, e_id, periodo, freq, tipo) for (e_id, periodo), (freq, tipo) in desejadas.items() if (e_id, periodo) not in atuais]
+            conn.executemany("DELETE FROM rotina_config WHERE id = ?", removidas)
+            conn.executemany("UPDATE rotina_config SET frequencia = ?, tipo = ? WHERE id = ?", alteradas)
+            conn.executemany("INSERT INTO rotina_config (rotina_id, exame_id, periodo, frequencia, tipo) VALUES (?, ?, ?, ?, ?)", novas)
+            if removidas or alteradas or novas:
+                _bump_config_version(conn)
+            logger.info(f"Rotina '{rotina_nome}' salva com sucesso ({len(novas)} nova(s), {len(alteradas)} alterada(s), {len(removidas)} removida(s))")
     except Exception as e:
         logger.error(f"Erro ao salvar rotina {rotina_nome}: {e}")
         raise
 
-# ... O restante do arquivo (get_clinicas, save_exames, etc.) permanece inalterado ...
-
-def get_clinicas() -> List[str]:
+def get_clinicas() -> Tuple[str, ...]:
     try:
         with get_db_connection() as conn:
-            return [row['nome'] for row in conn.execute("SELECT nome FROM clinicas ORDER BY nome").fetchall()]
+            return _config_cache.get('clinicas', _get_config_version(conn),
+                                     lambda: [row['nome'] for row in conn.execute("SELECT nome FROM clinicas ORDER BY nome")])
     except Exception as e:
         logger.error(f"Erro ao buscar clínicas: {e}")
-        return []
+        return ()
 
 def save_clinicas(clinicas_list: List[str]) -> None:
     try:
-        with get_db_connection() as conn:
-            conn.execute("DELETE FROM clinicas")
-            if clinicas_list:
-                conn.executemany("INSERT OR IGNORE INTO clinicas (nome) VALUES (?)", [(n,) for n in clinicas_list])
-            conn.commit()
-            logger.info(f"Clínicas salvas: {len(clinicas_list)}")
+        with transaction() as conn:
+            atuais = _fetch_id_map(conn, 'clinicas', 'nome')
+            desejadas = set(clinicas_list)
+            removidas = [(c_id,) for nome, c_id in atuais.items() if nome not in desejadas]
+            novas = [(nome,) for nome in desejadas if nome not in atuais]
+            # Só as clínicas realmente removidas levam junto (ON DELETE CASCADE) suas associações com perfis.
+            conn.executemany("DELETE FROM clinicas WHERE id = ?", removidas)
+            conn.executemany("INSERT INTO clinicas (nome) VALUES (?)", novas)
+            if removidas or novas:
+                _bump_config_version(conn)
+            logger.info(f"Clínicas salvas: {len(clinicas_list)} ({len(novas)} nova(s), {len(removidas)} removida(s))")
     except Exception as e:
         logger.error(f"Erro ao salvar clínicas: {e}")
         raise
 
-def get_exames_with_aliases() -> Dict[str, Dict[str, List[str]]]:
+def _load_exames_with_aliases(conn: sqlite3.Connection) -> Dict[str, Dict[str, List[str]]]:
     exames = {}
+    query = "SELECT e.nome_padrao, a.alias FROM exames e LEFT JOIN exame_aliases a ON e.id = a.exame_id ORDER BY e.nome_padrao, a.alias"
+    for row in conn.execute(query):
+        if row['nome_padrao'] not in exames:
+            exames[row['nome_padrao']] = {'aliases': []}
+        if row['alias']:
+            exames[row['nome_padrao']]['aliases'].append(row['alias'])
+    return exames
+
+def get_exames_with_aliases() -> Mapping[str, Mapping[str, Tuple[str, ...]]]:
     try:
         with get_db_connection() as conn:
-            query = "SELECT e.nome_padrao, a.alias FROM exames e LEFT JOIN exame_aliases a ON e.id = a.exame_id ORDER BY e.nome_padrao, a.alias"
-            for row in conn.execute(query):
-                if row['nome_padrao'] not in exames:
-                    exames[row['nome_padrao']] = {'aliases': []}
-                if row['alias']:
-                    exames[row['nome_padrao']]['aliases'].append(row['alias'])
+            return _config_cache.get('exames', _get_config_version(conn), lambda: _load_exames_with_aliases(conn))
     except Exception as e:
         logger.error(f"Erro ao buscar exames: {e}")
-    return exames
+        return {}
 
-def save_exames_from_dict(exames_dict: Dict[str, Dict[str, List[str]]]) -> None:
+def get_exame_name_mapping() -> Mapping[str, str]:
+    """Mapa apelido/nome padrão -> nome padrão, usado para normalizar as colunas dos arquivos de exames."""
     try:
         with get_db_connection() as conn:
-            conn.execute("DELETE FROM exame_aliases")
-            conn.execute("DELETE FROM exames")
-            for nome, details in exames_dict.items():
-                cursor = conn.execute("INSERT INTO exames (nome_padrao) VALUES (?)", (nome,))
-                exame_id = cursor.lastrowid
-                if details.get('aliases'):
-                    conn.executemany("INSERT INTO exame_aliases (exame_id, alias) VALUES (?, ?)", [(exame_id, a) for a in details['aliases']])
-            conn.commit()
-            logger.info(f"Exames salvos: {len(exames_dict)}")
+            def load():
+                exames = _load_exames_with_aliases(conn)
+                return {a: n for n, d in exames.items() for a in d['aliases'] + [n]}
+            return _config_cache.get('exame_name_mapping', _get_config_version(conn), load)
+    except Exception as e:
+        logger.error(f"Erro ao montar mapa de apelidos de exames: {e}")
+        return {}
+
+def save_exames_from_dict(exames_dict: Dict[str, Dict[str, List[str]]]) -> None:
+    try:
+        with transaction() as conn:
+            atuais = _fetch_id_map(conn, 'exames', 'nome_padrao')
+            removidos = [(e_id,) for nome, e_id in atuais.items() if nome not in exames_dict]
+            novos = [(nome,) for nome in exames_dict if nome not in atuais]
+            # Remover um exame leva junto, por cascata, seus apelidos e regras de rotina; exames mantidos conservam o id.
+            conn.executemany("DELETE FROM exames WHERE id = ?", removidos)
+            conn.executemany("INSERT INTO exames (nome_padrao) VALUES (?)", novos)
+            exame_ids = _fetch_id_map(conn, 'exames', 'nome_padrao')
+            aliases_desejados = {(exame_ids[nome], alias) for nome, details in exames_dict.items() for alias in details.get('aliases', [])}
+            aliases_atuais = {(row['exame_id'], row['alias']): row['id'] for row in conn.execute("SELECT id, exame_id, alias FROM exame_aliases")}
+            aliases_removidos = [(a_id,) for chave, a_id in aliases_atuais.items() if chave not in aliases_desejados]
+            aliases_novos = [chave for chave in aliases_desejados if chave not in aliases_atuais]
+            conn.executemany("DELETE FROM exame_aliases WHERE id = ?", aliases_removidos)
+            conn.executemany("INSERT INTO exame_aliases (exame_id, alias) VALUES (?, ?)", aliases_novos)
+            if removidos or novos or aliases_removidos or aliases_novos:
+                _bump_config_version(conn)
+            logger.info(f"Exames salvos: {len(exames_dict)} ({len(novos)} novo(s), {len(removidos)} removido(s), "
+                        f"{len(aliases_novos)} apelido(s) novo(s), {len(aliases_removidos)} apelido(s) removido(s))")
     except Exception as e:
         logger.error(f"Erro ao salvar exames: {e}")
         raise
 
+def _load_usage_index(conn: sqlite3.Connection, query: str) -> Dict[str, List[str]]:
+    index = {}
+    for row in conn.execute(query):
+        index.setdefault(row['chave'], []).append(row['usado_por'])
+    return index
+
+def get_exame_usage_index() -> Mapping[str, Tuple[str, ...]]:
+    """Exame -> rotinas que o cobram (regras diferentes de 'Não Cobra'). Exames sem uso ficam de fora."""
+    query = ("SELECT e.nome_padrao AS chave, r.nome AS usado_por FROM rotina_config rc "
+             "JOIN exames e ON rc.exame_id = e.id JOIN rotinas r ON rc.rotina_id = r.id "
+             "WHERE rc.frequencia != 'Não Cobra' GROUP BY e.id, r.id ORDER BY e.nome_padrao, r.nome")
+    try:
+        with get_db_connection() as conn:
+            return _config_cache.get('exame_usage', _get_config_version(conn), lambda: _load_usage_index(conn, query))
+    except Exception as e:
+        logger.error(f"Erro ao montar índice de uso de exames: {e}")
+        return {}
+
+def get_rotina_usage_index() -> Mapping[str, Tuple[str, ...]]:
+    """Rotina -> perfis que a usam. Rotinas sem uso ficam de fora."""
+    query = ("SELECT r.nome AS chave, p.nome AS usado_por FROM perfis p JOIN rotinas r ON p.rotina_id = r.id "
+             "GROUP BY r.id, p.id ORDER BY r.nome, p.nome")
+    try:
+        with get_db_connection() as conn:
+            return _config_cache.get('rotina_usage', _get_config_version(conn), lambda: _load_usage_index(conn, query))
+    except Exception as e:
+        logger.error(f"Erro ao montar índice de uso de rotinas: {e}")
+        return {}
+
 def check_exame_usage(exame_nome: str) -> List[str]:
+    return list(get_exame_usage_index().get(exame_nome, ()))
+
+def check_rotina_usage(rotina_nome: str) -> List[str]:
+    return list(get_rotina_usage_index().get(rotina_nome, ()))
+
+def get_periodo_usage_index() -> Mapping[str, Tuple[str, ...]]:
+    """Período -> rotinas com regras nele. Períodos sem uso ficam de fora."""
+    query = ("SELECT rc.periodo AS chave, r.nome AS usado_por FROM rotina_config rc JOIN rotinas r ON rc.rotina_id = r.id "
+             "GROUP BY rc.periodo, r.id ORDER BY rc.periodo, r.nome")
     try:
         with get_db_connection() as conn:
-            query = "SELECT r.nome FROM rotina_config rc JOIN exames e ON rc.exame_id = e.id JOIN rotinas r ON rc.rotina_id = r.id WHERE e.nome_padrao = ? AND rc.frequencia != 'Não Cobra'"
-            return [row['nome'] for row in conn.execute(query, (exame_nome,)).fetchall()]
+            return _config_cache.get('periodo_usage', _get_config_version(conn), lambda: _load_usage_index(conn, query))
     except Exception as e:
-        logger.error(f"Erro ao verificar uso do exame '{exame_nome}': {e}")
-        return []
+        logger.error(f"Erro ao montar índice de uso de períodos: {e}")
+        return {}
+
+def get_periodos() -> Tuple[Periodo, ...]:
+    """Períodos cadastrados, do mais para o menos específico (a ordem de precedência das regras)."""
+    try:
+        with get_db_connection() as conn:
+            return _config_cache.get('periodos', _get_config_version(conn), lambda: sorted(
+                (Periodo(row['nome'], row['mes_inicio'], row['mes_fim'])
+                 for row in conn.execute("SELECT nome, mes_inicio, mes_fim FROM periodos")), key=especificidade))
+    except Exception as e:
+        logger.error(f"Erro ao buscar períodos: {e}")
+        return PERIODOS_PADRAO
 
-def get_rotina_names() -> List[str]:
+def save_periodos(periodos: List[Periodo]) -> None:
+    """Grava o cadastro completo de períodos. Períodos removidos que ainda tenham regras em alguma rotina
+    fazem a gravação falhar com ValueError."""
+    try:
+        with transaction() as conn:
+            atuais = {row['nome']: row for row in conn.execute("SELECT id, nome, mes_inicio, mes_fim FROM periodos")}
+            desejados = {p.nome: p for p in map(Periodo._make, periodos)}
+            removidos = [nome for nome in atuais if nome not in desejados]
+            em_uso = {row['periodo'] for row in conn.execute(
+                f"SELECT DISTINCT periodo FROM rotina_config WHERE periodo IN ({','.join('?' * len(removidos))})", removidos)}
+            if em_uso:
+                raise ValueError(f"Período(s) em uso por regras de rotinas: {', '.join(sorted(em_uso))}")
+            alterados = [(p.mes_inicio, p.mes_fim, atuais[nome]['id']) for nome, p in desejados.items()
+                         if nome in atuais and (atuais[nome]['mes_inicio'], atuais[nome]['mes_fim']) != (p.mes_inicio, p.mes_fim)]
+            novos = [p for nome, p in desejados.items() if nome not in atuais]
+            conn.executemany("DELETE FROM periodos WHERE nome = ?", [(nome,) for nome in removidos])
+            conn.executemany("UPDATE periodos SET mes_inicio = ?, mes_fim = ? WHERE id = ?", alterados)
+            conn.executemany("INSERT INTO periodos (nome, mes_inicio, mes_fim) VALUES (?, ?, ?)", novos)
+            if removidos or alterados or novos:
+                _bump_config_version(conn)
+            logger.info(f"Períodos salvos: {len(desejados)} ({len(novos)} novo(s), {len(alterados)} alterado(s), {len(removidos)} removido(s))")
+    except Exception as e:
+        logger.error(f"Erro ao salvar períodos: {e}")
+        raise
+
+def get_rotina_names() -> Tuple[str, ...]:
     try:
         with get_db_connection() as conn:
-            return [row['nome'] for row in conn.execute("SELECT nome FROM rotinas ORDER BY nome").fetchall()]
+            return _config_cache.get('rotina_names', _get_config_version(conn),
+                                     lambda: [row['nome'] for row in conn.execute("SELECT nome FROM rotinas ORDER BY nome")])
     except Exception as e:
         logger.error(f"Erro ao buscar nomes de rotinas: {e}")
-        return []
+        return ()
 
 def create_rotina(novo_nome: str, base_nome: str) -> None:
     try:
-        with get_db_connection() as conn:
+        with transaction() as conn:
             base_row = conn.execute("SELECT id FROM rotinas WHERE nome = ?", (base_nome,)).fetchone()
             if not base_row:
                 raise ValueError(f"Rotina base '{base_nome}' não encontrada")
             cursor = conn.execute("INSERT INTO rotinas (nome) VALUES (?)", (novo_nome,))
             nova_id = cursor.lastrowid
             conn.execute("INSERT INTO rotina_config (rotina_id, exame_id, periodo, frequencia, tipo) SELECT ?, exame_id, periodo, frequencia, tipo FROM rotina_config WHERE rotina_id = ?", (nova_id, base_row['id']))
-            conn.commit()
+            _bump_config_version(conn)
             logger.info(f"Rotina '{novo_nome}' criada com base em '{base_nome}'")
     except Exception as e:
         logger.error(f"Erro ao criar rotina {novo_nome}: {e}")
@@ -316,30 +670,38 @@ def create_rotina(novo_nome: str, base_nome: str) -> None:
 
 def delete_rotina(nome_rotina: str) -> None:
     try:
-        with get_db_connection() as conn:
+        with transaction() as conn:
             conn.execute("DELETE FROM rotinas WHERE nome = ?", (nome_rotina,))
-            conn.commit()
+            _bump_config_version(conn)
             logger.info(f"Rotina '{nome_rotina}' deletada")
     except Exception as e:
         logger.error(f"Erro ao deletar rotina {nome_rotina}: {e}")
         raise
 
-def get_perfis() -> Dict[str, Dict]:
+def _load_perfis(conn: sqlite3.Connection) -> Dict[str, Dict]:
     perfis = {}
+    query = ("SELECT p.nome as p_nome, r.nome as r_nome, c.nome as c_nome FROM perfis p "
+             "LEFT JOIN rotinas r ON p.rotina_id = r.id "
+             "LEFT JOIN perfil_clinicas pc ON pc.perfil_id = p.id "
+             "LEFT JOIN clinicas c ON pc.clinica_id = c.id "
+             "ORDER BY p.nome, c.nome")
+    for row in conn.execute(query):
+        perfil = perfis.setdefault(row['p_nome'], {'rotina': row['r_nome'], 'clinicas': []})
+        if row['c_nome'] is not None:
+            perfil['clinicas'].append(row['c_nome'])
+    return perfis
+
+def get_perfis() -> Mapping[str, Mapping]:
     try:
         with get_db_connection() as conn:
-            query = "SELECT p.nome as p_nome, r.nome as r_nome FROM perfis p LEFT JOIN rotinas r ON p.rotina_id = r.id"
-            for p_row in conn.execute(query):
-                perfis[p_row['p_nome']] = {'rotina': p_row['r_nome'], 'clinicas': []}
-                clinicas_query = "SELECT c.nome FROM perfil_clinicas pc JOIN clinicas c ON pc.clinica_id = c.id JOIN perfis p ON pc.perfil_id = p.id WHERE p.nome = ? ORDER BY c.nome"
-                perfis[p_row['p_nome']]['clinicas'] = [c_row['nome'] for c_row in conn.execute(clinicas_query, (p_row['p_nome'],))]
+            return _config_cache.get('perfis', _get_config_version(conn), lambda: _load_perfis(conn))
     except Exception as e:
         logger.error(f"Erro ao buscar perfis: {e}")
-    return perfis
+        return {}
 
 def save_perfil(nome_original: Optional[str], nome_novo: str, nome_rotina: str, clinicas: List[str]) -> None:
     try:
-        with get_db_connection() as conn:
+        with transaction() as conn:
             r_row = conn.execute("SELECT id FROM rotinas WHERE nome = ?", (nome_rotina,)).fetchone()
             r_id = r_row['id'] if r_row else None
             p_row = conn.execute("SELECT id FROM perfis WHERE nome = ?", (nome_original or nome_novo,)).fetchone()
@@ -354,7 +716,7 @@ def save_perfil(nome_original: Optional[str], nome_novo: str, nome_rotina: str,
                 placeholders = ','.join(['?'] * len(clinicas))
                 c_ids = [r['id'] for r in conn.execute(f"SELECT id FROM clinicas WHERE nome IN ({placeholders})", clinicas)]
                 conn.executemany("INSERT INTO perfil_clinicas (perfil_id, clinica_id) VALUES (?, ?)", [(p_id, c_id) for c_id in c_ids])
-            conn.commit()
+            _bump_config_version(conn)
             logger.info(f"Perfil '{nome_novo}' salvo com sucesso")
     except Exception as e:
         logger.error(f"Erro ao salvar perfil {nome_novo}: {e}")
@@ -362,25 +724,64 @@ def save_perfil(nome_original: Optional[str], nome_novo: str, nome_rotina: str,
 
 def delete_perfil(nome_perfil: str) -> None:
     try:
-        with get_db_connection() as conn:
+        with transaction() as conn:
             conn.execute("DELETE FROM perfis WHERE nome = ?", (nome_perfil,))
-            conn.commit()
+            _bump_config_version(conn)
             logger.info(f"Perfil '{nome_perfil}' deletado")
     except Exception as e:
         logger.error(f"Erro ao deletar perfil {nome_perfil}: {e}")
         raise
 
-def add_override(cns: str, exam: str, period: str, user: str = "default") -> None:
+def get_patient_merges() -> Mapping[str, str]:
+    """CNS duplicado -> CNS canônico, para o índice de pacientes da análise."""
     try:
         with get_db_connection() as conn:
-            try:
-                conn.execute("INSERT INTO manual_overrides (patient_cns, exam, analysis_period, marked_by) VALUES (?, ?, ?, ?)", (cns, exam, period, user))
-                conn.commit()
-                logger.info(f"Override adicionado: CNS={cns}, Exame={exam}, Período={period}")
-            except sqlite3.IntegrityError:
-                logger.warning(f"Override já existe: CNS={cns}, Exame={exam}, Período={period}")
-    except Exception as e:
-        logger.error(f"Erro ao adicionar override: {e}")
+            return _config_cache.get('patient_merges', _get_config_version(conn), lambda: {
+                row['cns']: row['canonical_cns'] for row in conn.execute("SELECT cns, canonical_cns FROM patient_merges ORDER BY cns")})
+    except Exception as e:
+        logger.error(f"Erro ao buscar fusões de pacientes: {e}")
+        return {}
+
+def save_patient_merge(cns: str, canonical_cns: str) -> None:
+    try:
+        with transaction() as conn:
+            conn.execute("INSERT INTO patient_merges (cns, canonical_cns) VALUES (?, ?) "
+                         "ON CONFLICT(cns) DO UPDATE SET canonical_cns = excluded.canonical_cns", (cns, canonical_cns))
+            _bump_config_version(conn)
+            logger.info(f"Paciente {cns} fundido em {canonical_cns}")
+    except Exception as e:
+        logger.error(f"Erro ao salvar fusão do paciente {cns}: {e}")
+        raise
+
+def remove_patient_merge(cns: str) -> None:
+    try:
+        with transaction() as conn:
+            conn.execute("DELETE FROM patient_merges WHERE cns = ?", (cns,))
+            _bump_config_version(conn)
+            logger.info(f"Fusão do paciente {cns} removida")
+    except Exception as e:
+        logger.error(f"Erro ao remover fusão do paciente {cns}: {e}")
+        raise
+
+def add_override(cns: str, exam: str, period: str, user: str = "default") -> None:
+    if add_overrides([(cns, exam, period)], user):
+        logger.info(f"Override adicionado: CNS={cns}, Exame={exam}, Período={period}")
+    else:
+        logger.warning(f"Override já existe: CNS={cns}, Exame={exam}, Período={period}")
+
+def add_overrides(entries: Iterable[Tuple[str, str, str]], user: str = "default") -> int:
+    rows = [(cns, exam, period, user) for cns, exam, period in entries]
+    if not rows:
+        return 0
+    try:
+        with transaction() as conn:
+            changes_before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO manual_overrides (patient_cns, exam, analysis_period, marked_by) VALUES (?, ?, ?, ?)", rows)
+            inserted = conn.total_changes - changes_before
+        logger.info(f"Overrides adicionados em lote: {inserted} de {len(rows)}")
+        return inserted
+    except Exception as e:
+        logger.error(f"Erro ao adicionar overrides em lote: {e}")
         raise
 
 def get_overrides_for_period(period: str) -> Set[Tuple[str, str]]:
@@ -392,48 +793,255 @@ def get_overrides_for_period(period: str) -> Set[Tuple[str, str]]:
         return set()
 
 def remove_override(cns: str, exam: str, period: str) -> None:
+    remove_overrides([(cns, exam, period)])
+    logger.info(f"Override removido: CNS={cns}, Exame={exam}, Período={period}")
+
+def remove_overrides(entries: Iterable[Tuple[str, str, str]]) -> int:
+    rows = list(entries)
+    if not rows:
+        return 0
     try:
-        with get_db_connection() as conn:
-            conn.execute("DELETE FROM manual_overrides WHERE patient_cns = ? AND exam = ? AND analysis_period = ?", (cns, exam, period))
-            conn.commit()
-            logger.info(f"Override removido: CNS={cns}, Exame={exam}, Período={period}")
+        with transaction() as conn:
+            changes_before = conn.total_changes
+            conn.executemany("DELETE FROM manual_overrides WHERE patient_cns = ? AND exam = ? AND analysis_period = ?", rows)
+            removed = conn.total_changes - changes_before
+        logger.info(f"Overrides removidos em lote: {removed} de {len(rows)}")
+        return removed
     except Exception as e:
-        logger.error(f"Erro ao remover override: {e}")
+        logger.error(f"Erro ao remover overrides em lote: {e}")
         raise
 
-def clear_old_overrides(months_to_keep: int = 12) -> int:
+def archive_old_overrides(months_to_keep: int = 12, batch_size: int = 500) -> int:
+    """Move para manual_overrides_archive, em lotes, os overrides mais antigos que `months_to_keep` meses."""
+    # O limite é calculado uma única vez do lado direito da comparação, então o filtro usa idx_manual_overrides_timestamp.
+    query_ids = "SELECT id FROM manual_overrides WHERE timestamp < datetime('now', ?) ORDER BY timestamp LIMIT ?"
+    modifier = f"-{int(months_to_keep)} months"
+    archived = 0
+    try:
+        while True:
+            with transaction() as conn:
+                ids = [row['id'] for row in conn.execute(query_ids, (modifier, batch_size))]
+                if not ids:
+                    break
+                placeholders = ','.join(['?'] * len(ids))
+                conn.execute(
+                    "INSERT INTO manual_overrides_archive (original_id, patient_cns, exam, analysis_period, marked_by, timestamp) "
+                    f"SELECT id, patient_cns, exam, analysis_period, marked_by, timestamp FROM manual_overrides WHERE id IN ({placeholders})",
+                    ids
+                )
+                conn.execute(f"DELETE FROM manual_overrides WHERE id IN ({placeholders})", ids)
+            archived += len(ids)
+        logger.info(f"Overrides antigos arquivados: {archived}")
+    except Exception as e:
+        logger.error(f"Erro ao arquivar overrides antigos: {e}")
+    return archived
+
+# Categorias gravadas em analysis_pending_exams e a chave correspondente no dicionário de resultados.
+_CATEGORIAS_DETALHE = {'obrigatorio': 'detalhes_obrigatorios', 'opcional': 'detalhes_opcionais', 'resolvido': 'detalhes_resolvidos'}
+
+def _insert_patient_results(conn: sqlite3.Connection, run_id: int, resultados: Dict[Tuple[str, str], Dict]) -> None:
+    conn.executemany(
+        "INSERT INTO analysis_patient_results (run_id, patient_nome, patient_cns, clinica, status, resumo, motivo_internacao) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(run_id, nome, cns, info.get('clinica'), info['status'], info.get('exames_faltantes'), info.get('motivo_internacao'))
+         for (nome, cns), info in resultados.items()]
+    )
+    cns_list = list({cns for _, cns in resultados})
+    if len(cns_list) <= 500:
+        placeholders = ','.join(['?'] * len(cns_list))
+        rows = conn.execute(f"SELECT id, patient_nome, patient_cns FROM analysis_patient_results WHERE run_id = ? AND patient_cns IN ({placeholders})",
+                            [run_id, *cns_list])
+    else:
+        rows = conn.execute("SELECT id, patient_nome, patient_cns FROM analysis_patient_results WHERE run_id = ?", (run_id,))
+    result_ids = {(row['patient_nome'], row['patient_cns']): row['id'] for row in rows}
+    conn.executemany(
+        "INSERT INTO analysis_pending_exams (result_id, categoria, exame, frequencia, ultimo_realizado, proxima_data) VALUES (?, ?, ?, ?, ?, ?)",
+        [(result_ids[patient], categoria, d['exame'], d.get('frequencia'), d.get('ultimo_realizado'), d.get('proxima_data'))
+         for patient, info in resultados.items()
+         for categoria, chave in _CATEGORIAS_DETALHE.items()
+         for d in info.get(chave, [])]
+    )
+
+def save_analysis_run(perfil: str, period: str, resultados: Dict[Tuple[str, str], Dict], num_ativos: int, total_pacientes: int) -> None:
+    try:
+        with transaction() as conn:
+            # Uma análise por perfil/período: a execução anterior é substituída (cascata nos detalhes).
+            conn.execute("DELETE FROM analysis_runs WHERE perfil = ? AND analysis_period = ?", (perfil, period))
+            cursor = conn.execute("INSERT INTO analysis_runs (perfil, analysis_period, total_pacientes, num_ativos) VALUES (?, ?, ?, ?)",
+                                  (perfil, period, total_pacientes, num_ativos))
+            if resultados:
+                _insert_patient_results(conn, cursor.lastrowid, resultados)
+        logger.info(f"Análise salva no histórico: perfil={perfil}, período={period}, pacientes={len(resultados)}")
+    except Exception as e:
+        logger.error(f"Erro ao salvar análise no histórico ({perfil}, {period}): {e}")
+        raise
+
+def update_analysis_results(perfil: str, period: str, resultados: Dict[Tuple[str, str], Dict]) -> None:
+    """Regrava no histórico apenas os pacientes informados (ex.: após marcar exames como OK)."""
+    if not resultados:
+        return
+    try:
+        with transaction() as conn:
+            run_row = conn.execute("SELECT id FROM analysis_runs WHERE perfil = ? AND analysis_period = ?", (perfil, period)).fetchone()
+            if not run_row:
+                return
+            conn.executemany("DELETE FROM analysis_patient_results WHERE run_id = ? AND patient_nome = ? AND patient_cns = ?",
+                             [(run_row['id'], nome, cns) for nome, cns in resultados])
+            _insert_patient_results(conn, run_row['id'], resultados)
+    except Exception as e:
+        logger.error(f"Erro ao atualizar histórico da análise ({perfil}, {period}): {e}")
+        raise
+
+def add_overrides_with_results(entries: Iterable[Tuple[str, str, str]], period: str,
+                               resultados_por_perfil: Mapping[str, Dict[Tuple[str, str], Dict]], user: str = "default") -> int:
+    """Registra os overrides e regrava no histórico de cada perfil os pacientes afetados, numa única transação."""
+    try:
+        with transaction():
+            inserted = add_overrides(entries, user)
+            for perfil, resultados in resultados_por_perfil.items():
+                update_analysis_results(perfil, period, resultados)
+        return inserted
+    except Exception as e:
+        logger.error(f"Erro ao registrar overrides do período {period}: {e}")
+        raise
+
+def get_analysis_run_info(perfil: str, period: str) -> Optional[Dict]:
     try:
         with get_db_connection() as conn:
-            cursor = conn.execute("DELETE FROM manual_overrides WHERE datetime(timestamp) < datetime('now', '-' || ? || ' months')", (months_to_keep,))
-            conn.commit()
-            deleted = cursor.rowcount
-            logger.info(f"Overrides antigos removidos: {deleted}")
-            return deleted
+            row = conn.execute("SELECT id, total_pacientes, num_ativos, datetime(created_at, 'localtime') AS created_at FROM analysis_runs WHERE perfil = ? AND analysis_period = ?",
+                               (perfil, period)).fetchone()
+            return dict(row) if row else None
     except Exception as e:
-        logger.error(f"Erro ao limpar overrides antigos: {e}")
-        return 0
+        logger.error(f"Erro ao consultar histórico ({perfil}, {period}): {e}")
+        return None
 
-def validate_database_integrity() -> bool:
+def get_analysis_run(perfil: str, period: str) -> Optional[Tuple[Dict[Tuple[str, str], Dict], int, int]]:
     try:
         with get_db_connection() as conn:
-            cursor = conn.execute("PRAGMA integrity_check")
+            run = conn.execute("SELECT id, total_pacientes, num_ativos FROM analysis_runs WHERE perfil = ? AND analysis_period = ?", (perfil, period)).fetchone()
+            if not run:
+                return None
+            resultados = {}
+            por_id = {}
+            for row in conn.execute("SELECT id, patient_nome, patient_cns, clinica, status, resumo, motivo_internacao FROM analysis_patient_results WHERE run_id = ?", (run['id'],)):
+                info = {'status': row['status'], 'exames_faltantes': row['resumo'], 'clinica': row['clinica'],
+                        'detalhes_obrigatorios': [], 'detalhes_opcionais': [], 'detalhes_resolvidos': []}
+                if row['motivo_internacao'] is not None:
+                    info['motivo_internacao'] = row['motivo_internacao']
+                resultados[(row['patient_nome'], row['patient_cns'])] = info
+                por_id[row['id']] = info
+            query = ("SELECT pe.result_id, pe.categoria, pe.exame, pe.frequencia, pe.ultimo_realizado, pe.proxima_data FROM analysis_pending_exams pe "
+                     "JOIN analysis_patient_results pr ON pe.result_id = pr.id WHERE pr.run_id = ?")
+            for row in conn.execute(query, (run['id'],)):
+                if row['categoria'] == 'resolvido':
+                    detalhe = {'exame': row['exame'], 'status': 'Resolvido manualmente'}
+                else:
+                    detalhe = {'exame': row['exame'], 'frequencia': row['frequencia'], 'ultimo_realizado': row['ultimo_realizado'], 'proxima_data': row['proxima_data']}
+                por_id[row['result_id']][_CATEGORIAS_DETALHE[row['categoria']]].append(detalhe)
+            return resultados, run['num_ativos'], run['total_pacientes']
+    except Exception as e:
+        logger.error(f"Erro ao carregar análise do histórico ({perfil}, {period}): {e}")
+        return None
+
+def get_pending_trend(perfil: str, year: int) -> List[Dict]:
+    """Totais por mês do ano (status dos pacientes e exames obrigatórios pendentes) a partir do histórico salvo."""
+    query = """
+        SELECT r.analysis_period AS periodo,
+               r.num_ativos AS ativos,
+               SUM(pr.status = 'Pendente') AS pendentes,
+               SUM(pr.status = 'Internado') AS internados,
+               SUM(pr.status = 'Pendência de Coleta') AS pendencia_coleta,
+               (SELECT COUNT(*) FROM analysis_pending_exams pe JOIN analysis_patient_results p2 ON pe.result_id = p2.id
+                 WHERE p2.run_id = r.id AND pe.categoria = 'obrigatorio') AS exames_obrigatorios_pendentes
+        FROM analysis_runs r
+        LEFT JOIN analysis_patient_results pr ON pr.run_id = r.id
+        WHERE r.perfil = ? AND r.analysis_period BETWEEN ? AND ?
+        GROUP BY r.id
+        ORDER BY r.analysis_period
+    """
+    try:
+        with get_db_connection() as conn:
+            return [dict(row) for row in conn.execute(query, (perfil, f"{year}-01", f"{year}-12"))]
+    except Exception as e:
+        logger.error(f"Erro ao consultar tendência de pendências ({perfil}, {year}): {e}")
+        return []
+
+def validate_database_integrity(full: bool = False) -> bool:
+    """Verifica o banco com quick_check (padrão) ou integrity_check completo quando `full` é True."""
+    check = "integrity_check" if full else "quick_check"
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.execute(f"PRAGMA {check}")
             result = cursor.fetchone()
             if result[0] != 'ok':
-                logger.error(f"Falha na verificação de integridade: {result[0]}")
+                logger.error(f"Falha na verificação de integridade ({check}): {result[0]}")
                 return False
-            required_tables = ['clinicas', 'exames', 'exame_aliases', 'rotinas', 'rotina_config', 'perfis', 'perfil_clinicas', 'manual_overrides', 'db_meta']
+            required_tables = ['clinicas', 'exames', 'exame_aliases', 'rotinas', 'rotina_config', 'perfis', 'perfil_clinicas', 'manual_overrides', 'manual_overrides_archive', 'db_meta', 'schema_migrations', 'analysis_runs', 'analysis_patient_results', 'analysis_pending_exams']
             cursor = conn.execute("SELECT name FROM sqlite_master WHERE type='table'")
             existing_tables = {row[0] for row in cursor.fetchall()}
             missing_tables = set(required_tables) - existing_tables
             if missing_tables:
                 logger.error(f"Tabelas ausentes: {missing_tables}")
                 return False
-            logger.info("Validação de integridade do banco: OK")
+            logger.info(f"Validação de integridade do banco ({check}): OK")
             return True
     except Exception as e:
         logger.error(f"Erro ao validar integridade do banco: {e}")
         return False
 
+def optimize_database(analyze: bool = False) -> None:
+    """Atualiza as estatísticas do planejador. `PRAGMA optimize` só reanalisa o que mudou; `analyze` força um ANALYZE completo."""
+    try:
+        with get_db_connection() as conn:
+            if analyze:
+                conn.execute("ANALYZE")
+            conn.execute("PRAGMA optimize")
+        logger.info(f"Otimização do banco concluída{' (ANALYZE completo)' if analyze else ''}.")
+    except Exception as e:
+        logger.error(f"Erro ao otimizar o banco: {e}")
+
+def has_planner_stats() -> bool:
+    try:
+        with get_db_connection() as conn:
+            return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is not None
+    except Exception as e:
+        logger.error(f"Erro ao verificar estatísticas do planejador: {e}")
+        return False
+
+def enable_incremental_vacuum() -> bool:
+    """Converte um banco criado sem auto_vacuum para o modo INCREMENTAL. Exige um VACUUM completo; chamar só com o app ocioso."""
+    try:
+        with get_db_connection() as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                return True
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            enabled = conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        logger.info(f"Conversão para auto_vacuum incremental: {'OK' if enabled else 'não aplicada'}")
+        return enabled
+    except Exception as e:
+        logger.error(f"Erro ao ativar o vacuum incremental: {e}")
+        return False
+
+def incremental_vacuum(max_pages: int = 0) -> int:
+    """Devolve ao sistema até `max_pages` páginas livres (0 = todas) e faz checkpoint do WAL. Retorna as páginas liberadas."""
+    try:
+        with get_db_connection() as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                return 0
+            free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if free_before == 0:
+                return 0
+            # executescript roda o pragma até o fim; com execute o módulo sqlite3 dá um único passo (uma página).
+            conn.executescript(f"PRAGMA incremental_vacuum({int(max_pages)});")
+            freed = free_before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+            # O arquivo só encolhe quando as páginas saem do WAL.
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        logger.info(f"Vacuum incremental: {freed} páginas liberadas")
+        return freed
+    except Exception as e:
+        logger.error(f"Erro no vacuum incremental: {e}")
+        return 0
+
 def get_database_stats() -> Dict[str, int]:
     stats = {}
     try:
@@ -444,6 +1052,22 @@ def get_database_stats() -> Dict[str, int]:
             stats['rotinas'] = conn.execute("SELECT COUNT(*) FROM rotinas").fetchone()[0]
             stats['perfis'] = conn.execute("SELECT COUNT(*) FROM perfis").fetchone()[0]
             stats['overrides'] = conn.execute("SELECT COUNT(*) FROM manual_overrides").fetchone()[0]
+            stats['overrides_arquivados'] = conn.execute("SELECT COUNT(*) FROM manual_overrides_archive").fetchone()[0]
+            stats['analises_salvas'] = conn.execute("SELECT COUNT(*) FROM analysis_runs").fetchone()[0]
     except Exception as e:
         logger.error(f"Erro ao obter estatísticas do banco: {e}")
-    return stats
\ No newline at end of file
+    return stats
+
+def get_database_page_stats() -> Dict[str, int]:
+    stats = {}
+    try:
+        with get_db_connection() as conn:
+            for pragma in ('page_size', 'page_count', 'freelist_count', 'auto_vacuum'):
+                stats[pragma] = conn.execute(f"PRAGMA {pragma}").fetchone()[0]
+        stats['tamanho_bytes'] = stats['page_size'] * stats['page_count']
+        stats['livre_bytes'] = stats['page_size'] * stats['freelist_count']
+        wal_file = Path(f"{DB_FILE}-wal")
+        stats['wal_bytes'] = wal_file.stat().st_size if wal_file.exists() else 0
+    except Exception as e:
+        logger.error(f"Erro ao obter estatísticas de páginas do banco: {e}")
+    return stats
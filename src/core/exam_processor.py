@@ -1,174 +1,359 @@
 import pandas as pd
+from collections import namedtuple
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
+from typing import Callable, Iterable, Mapping, Optional
 import logging
+from .cancellation import AnalysisCancelled, CancellationToken
+from .patient_index import PatientIndex
+from .rule_engine import FREQUENCIA_MESES, NAO_COBRA, PERIODOS_PADRAO, Periodo, aplicar_regras, regra_aplicavel
+
+# Tamanho padrão dos lotes entregues por iterar_resultados_em_lotes; a avaliação também é feita lote a lote,
+# com progresso e cancelamento verificados antes de cada um.
+RESULT_BATCH = 100
+
+ProgressCallback = Callable[[str, int], None]
+
+class _Progress:
+    """Converte o avanço de cada etapa (i de n) em percentual global e checa o cancelamento a cada lote."""
+
+    def __init__(self, callback: Optional[ProgressCallback], cancel_token: Optional[CancellationToken]):
+        self.callback = callback
+        self.cancel_token = cancel_token
+
+    def stage(self, nome: str, inicio: int, fim: int, total: int = 0):
+        self.nome, self.inicio, self.fim, self.total = nome, inicio, fim, total
+        self.report(0)
+
+    def report(self, feitos: int):
+        if self.cancel_token is not None:
+            self.cancel_token.raise_if_cancelled()
+        if self.callback is not None:
+            fracao = feitos / self.total if self.total else 0
+            self.callback(self.nome, int(self.inicio + (self.fim - self.inicio) * fracao))
 
 def calcular_proxima_data(ultima_data, frequencia):
-    if pd.isna(ultima_data):
+    if pd.isna(ultima_data) or frequencia not in FREQUENCIA_MESES:
         return None
-    if frequencia == 'Mensal':
-        return ultima_data + relativedelta(months=1)
-    elif frequencia == 'Trimestral':
-        return ultima_data + relativedelta(months=3)
-    elif frequencia == 'Semestral':
-        return ultima_data + relativedelta(months=6)
-    elif frequencia == 'Anual':
-        return ultima_data + relativedelta(years=1)
-    return None
-
-def get_regra_aplicavel(regras_exame, meses_de_tratamento):
-    if not regras_exame:
-        return None
-    for regra in regras_exame:
-        periodo = regra.get('Período')
-        if periodo == 'Primeiro Ano' and meses_de_tratamento <= 12:
-            return regra
-        if periodo == 'Após Primeiro Ano' and meses_de_tratamento > 12:
-            return regra
-        if periodo == 'Primeiro Mês' and meses_de_tratamento == 1:
-            return regra
-        if periodo == 'Primeiro Trimestre' and meses_de_tratamento <= 3:
-            return regra
-    for regra in regras_exame:
-        if regra.get('Período') == 'Sempre':
-            return regra
-    return regras_exame[0]
-
-def processar_dados_exames(df_exames, data_referencia, rotina_exames, df_movimentacoes=None, df_internacoes=None, manual_overrides=None):
+    return ultima_data + relativedelta(months=FREQUENCIA_MESES[frequencia])
+
+def get_regra_aplicavel(regras_exame, meses_de_tratamento, periodos: Iterable[Periodo] = PERIODOS_PADRAO):
+    return regra_aplicavel(regras_exame, meses_de_tratamento, periodos)
+
+def montar_resumo(obrigatorios_pendentes, opcionais_pendentes, resolvidos_manualmente):
+    status_final = 'Pendente' if obrigatorios_pendentes else 'Em dia'
+    resumo = f"{len(obrigatorios_pendentes)} exame(s) obrigatório(s) pendente(s)."
+    if opcionais_pendentes: resumo += f" {len(opcionais_pendentes)} opcional(is) sugerido(s)."
+    if resolvidos_manualmente: resumo += f" {len(resolvidos_manualmente)} resolvido(s) manualmente."
+    if status_final == 'Em dia': resumo = "Nenhum exame pendente para este mês."
+    return status_final, resumo
+
+def aplicar_overrides(info, exames_resolvidos):
+    """Retorna uma cópia do resultado de um paciente com os exames informados marcados como resolvidos manualmente.
+
+    Permite refletir um override na tela sem reprocessar a análise inteira.
+    """
+    exames_resolvidos = set(exames_resolvidos)
+    if info.get('status') not in ('Pendente', 'Em dia') or not exames_resolvidos:
+        return info
+    obrigatorios = [d for d in info.get('detalhes_obrigatorios', []) if d['exame'] not in exames_resolvidos]
+    opcionais = [d for d in info.get('detalhes_opcionais', []) if d['exame'] not in exames_resolvidos]
+    ja_resolvidos = {d['exame'] for d in info.get('detalhes_resolvidos', [])}
+    pendentes = {d['exame'] for d in info.get('detalhes_obrigatorios', []) + info.get('detalhes_opcionais', [])}
+    resolvidos = list(info.get('detalhes_resolvidos', [])) + [
+        {'exame': exame, 'status': 'Resolvido manualmente'}
+        for exame in sorted(exames_resolvidos & pendentes) if exame not in ja_resolvidos
+    ]
+    status_final, resumo = montar_resumo(obrigatorios, opcionais, resolvidos)
+    return {**info, 'status': status_final, 'exames_faltantes': resumo, 'detalhes_obrigatorios': obrigatorios,
+            'detalhes_opcionais': opcionais, 'detalhes_resolvidos': resolvidos}
+
+def processar_dados_exames(df_exames, data_referencia, rotina_exames, df_movimentacoes=None, df_internacoes=None, manual_overrides=None,
+                           progress_callback: Optional[ProgressCallback] = None, cancel_token: Optional[CancellationToken] = None,
+                           periodos: Iterable[Periodo] = PERIODOS_PADRAO, fusoes_cns: Optional[Mapping[str, str]] = None,
+                           clinicas: Optional[Iterable[str]] = None):
+    """Avalia as pendências de exames de cada paciente ativo no mês de `data_referencia`.
+
+    `progress_callback(etapa, percentual)` é chamado entre as etapas e a cada lote de RESULT_BATCH pacientes;
+    nesses mesmos pontos `cancel_token` é verificado e, se cancelado, AnalysisCancelled é levantada.
+    `periodos` define as faixas de meses dos períodos usados nas regras da rotina (ver rule_engine) e
+    `fusoes_cns` os CNS duplicados conhecidos (ver patient_index). Com `clinicas`, só entram os pacientes cuja
+    clínica atual (a do exame mais recente) está na lista, como em processar_perfis; o histórico conta em todas.
+    """
+    resultados, num_ativos = {}, 0
+    for lote, num_ativos, _ in iterar_resultados_em_lotes(df_exames, data_referencia, rotina_exames, df_movimentacoes, df_internacoes,
+                                                          manual_overrides, progress_callback, cancel_token,
+                                                          periodos=periodos, fusoes_cns=fusoes_cns, clinicas=clinicas):
+        resultados.update(lote)
+    return resultados, num_ativos
+
+def iterar_resultados_em_lotes(df_exames, data_referencia, rotina_exames, df_movimentacoes=None, df_internacoes=None, manual_overrides=None,
+                               progress_callback: Optional[ProgressCallback] = None, cancel_token: Optional[CancellationToken] = None,
+                               batch_size: int = RESULT_BATCH, periodos: Iterable[Periodo] = PERIODOS_PADRAO,
+                               fusoes_cns: Optional[Mapping[str, str]] = None, clinicas: Optional[Iterable[str]] = None):
+    """Versão em lotes de processar_dados_exames: gera (resultados_do_lote, num_ativos, total_pacientes) a cada `batch_size` pacientes.
+
+    Os totais já são conhecidos no primeiro lote. Sem pacientes ativos, gera um único lote vazio.
+    """
+    if manual_overrides is None:
+        manual_overrides = set()
+    progress = _Progress(progress_callback, cancel_token)
+    progress.stage("Preparando dados", 0, 20)
+    indice = preparar_dados(df_exames, df_movimentacoes, df_internacoes, fusoes_cns)
+    progress.stage("Identificando pacientes ativos", 20, 40)
+    ativos = identificar_pacientes_ativos(indice, df_exames, df_movimentacoes, data_referencia)
+    total_pacientes = len(indice)
+    if clinicas:
+        membros = _membros_por_clinica(df_exames, _clinica_atual(df_exames, len(indice)), list(clinicas))
+        ativos = ativos[ativos.index.isin(list(membros))]
+        total_pacientes = len(membros)
+    num_ativos = len(ativos)
+
+    progress.stage("Avaliando exames", 40, 100, num_ativos)
+    historico = _resumir_historico(df_exames, df_internacoes, data_referencia)
+    overrides = set(manual_overrides)
+    for inicio in range(0, num_ativos, batch_size):
+        progress.report(inicio)
+        bloco = ativos.iloc[inicio:inicio + batch_size]
+        avaliacoes = _avaliar_pacientes(bloco, indice, historico, data_referencia, rotina_exames, periodos, overrides)
+        yield ({indice.chave_resultado(pid): resultado for pid, resultado in zip(bloco.index, avaliacoes)},
+               num_ativos, total_pacientes)
+    progress.report(progress.total)
+    if not num_ativos:
+        yield {}, num_ativos, total_pacientes
+
+def processar_perfis(df_exames, data_referencia, perfis: Mapping[str, Mapping], rotinas: Mapping[str, Mapping], df_movimentacoes=None,
+                     df_internacoes=None, manual_overrides=None, progress_callback: Optional[ProgressCallback] = None,
+                     cancel_token: Optional[CancellationToken] = None, periodos: Iterable[Periodo] = PERIODOS_PADRAO,
+                     fusoes_cns: Optional[Mapping[str, str]] = None):
+    """Análise de vários perfis sobre um único conjunto de dados: {perfil: (resultados, num_ativos, total_pacientes)}.
+
+    `perfis` segue o formato de database_manager.get_perfis ({'rotina': nome, 'clinicas': [...]}) e `rotinas`
+    traz os detalhes de cada rotina usada. O preparo e a identificação dos ativos rodam uma vez; cada paciente
+    é avaliado uma vez por rotina distinta e o resultado é distribuído aos perfis que incluem a sua clínica atual
+    (perfil sem clínicas recebe todos). O histórico do paciente conta em todas as clínicas.
+    """
     if manual_overrides is None:
         manual_overrides = set()
-    df_exames['CNS'] = df_exames['CNS'].astype(str).str.strip().str.zfill(15)
+    progress = _Progress(progress_callback, cancel_token)
+    progress.stage("Preparando dados", 0, 15)
+    indice = preparar_dados(df_exames, df_movimentacoes, df_internacoes, fusoes_cns)
+    progress.stage("Identificando pacientes ativos", 15, 25)
+    ativos = identificar_pacientes_ativos(indice, df_exames, df_movimentacoes, data_referencia)
+
+    # O paciente pertence aos perfis que incluem a sua clínica atual (a do exame mais recente).
+    clinica_atual = _clinica_atual(df_exames, len(indice))
+    membros = {perfil: _membros_por_clinica(df_exames, clinica_atual, dados.get('clinicas') or [])
+               for perfil, dados in perfis.items()}
+    por_rotina = {}
+    for perfil, dados in perfis.items():
+        por_rotina.setdefault(dados.get('rotina'), set()).update(membros[perfil])
+
+    total_avaliar = sum(int(ativos.index.isin(list(pids)).sum()) for pids in por_rotina.values())
+    progress.stage("Avaliando exames", 25, 100, total_avaliar)
+    historico = _resumir_historico(df_exames, df_internacoes, data_referencia)
+    overrides = set(manual_overrides)
+    avaliacoes, feitos = {}, 0
+    for rotina, pids in por_rotina.items():
+        selecionados = ativos[ativos.index.isin(list(pids))]
+        avaliacoes[rotina] = {}
+        for inicio in range(0, len(selecionados), RESULT_BATCH):
+            progress.report(feitos)
+            bloco = selecionados.iloc[inicio:inicio + RESULT_BATCH]
+            resultados = _avaliar_pacientes(bloco, indice, historico, data_referencia, rotinas.get(rotina) or {}, periodos, overrides)
+            avaliacoes[rotina].update(zip(bloco.index, resultados))
+            feitos += len(bloco)
+    progress.report(feitos)
+    logging.info(f"Análise de {len(perfis)} perfil(is): {len(ativos)} paciente(s) ativo(s) avaliado(s) em {len(por_rotina)} rotina(s).")
+
+    saida = {}
+    for perfil, dados in perfis.items():
+        avaliados = avaliacoes[dados.get('rotina')]
+        resultados = {indice.chave_resultado(pid): avaliados[pid] for pid in ativos.index if pid in membros[perfil]}
+        saida[perfil] = (resultados, len(resultados), len(membros[perfil]))
+    return saida
+
+def resumo_por_clinica(resultados_por_perfil: Mapping[str, tuple]):
+    """Linhas (perfil, clínica) com os totais por status, mais uma linha 'Rede' com os pacientes distintos de todos os perfis."""
+    linhas, rede = [], {}
+    for perfil, (resultados, _, _) in sorted(resultados_por_perfil.items()):
+        por_clinica = {}
+        for chave, info in resultados.items():
+            por_clinica.setdefault(info.get('clinica') or "", []).append(info)
+            rede[chave] = info
+        linhas += [dict(_contar_status(infos), perfil=perfil, clinica=clinica) for clinica, infos in sorted(por_clinica.items())]
+    linhas.append(dict(_contar_status(list(rede.values())), perfil="Rede", clinica="Todas"))
+    return linhas
+
+def _contar_status(infos):
+    status = [info.get('status') for info in infos]
+    return {'ativos': len(infos), 'em_dia': status.count('Em dia'), 'pendentes': status.count('Pendente'),
+            'internados': status.count('Internado'), 'pendencia_coleta': status.count('Pendência de Coleta'),
+            'exames_obrigatorios_pendentes': sum(len(info.get('detalhes_obrigatorios', [])) for info in infos)}
+
+MOV_SAIDA = ['Óbito', 'Transferência de centro', 'Alta ambulatorial', 'Transplante']
+COLUNA_INICIO_CICLO = 'Data início prog. dial. clínica'
+
+def preparar_dados(df_exames, df_movimentacoes=None, df_internacoes=None, fusoes_cns: Optional[Mapping[str, str]] = None) -> PatientIndex:
+    """Converte as datas, descarta linhas inválidas e anota em cada DataFrame (in place) o id do paciente ('pid')."""
     df_exames['Data'] = pd.to_datetime(df_exames['Data'], dayfirst=True, errors='coerce')
-    df_exames.dropna(subset=['Nome', 'CNS', 'Data'], inplace=True)
+    df_exames.dropna(subset=['Nome', 'Data'], inplace=True)
+    indice = PatientIndex.build(df_exames, fusoes_cns)
+    df_exames['pid'] = indice.ids
 
     # Prepara DF de movimentações
     if df_movimentacoes is not None and not df_movimentacoes.empty:
-        df_movimentacoes['CNS'] = df_movimentacoes['CNS'].astype(str).str.strip().str.zfill(15)
         df_movimentacoes['Data'] = pd.to_datetime(df_movimentacoes['Data'], dayfirst=True, errors='coerce')
-        df_movimentacoes.dropna(subset=['Data', 'Nome', 'CNS'], inplace=True)
-    
+        df_movimentacoes.dropna(subset=['Data'], inplace=True)
+        df_movimentacoes['pid'] = indice.lookup(df_movimentacoes)
+
     # Prepara DF de internações
     if df_internacoes is not None and not df_internacoes.empty:
-        df_internacoes['Nome'] = df_internacoes['Nome'].astype(str).str.strip()
         df_internacoes['Data Internação'] = pd.to_datetime(df_internacoes['Data Internação'], dayfirst=True, errors='coerce')
         df_internacoes['Data Alta'] = pd.to_datetime(df_internacoes['Data Alta'], dayfirst=True, errors='coerce')
         df_internacoes.dropna(subset=['Nome', 'Data Internação'], inplace=True)
+        df_internacoes['pid'] = indice.lookup(df_internacoes)
+    return indice
+
+def exames_cobrados(rotina_exames):
+    """Exames cobrados pela rotina (primeira regra diferente de 'Não Cobra'), dos de maior intervalo para os de menor."""
+    cobrados = [exame for exame, regras_exame in rotina_exames.items()
+                if regras_exame and regras_exame[0].get('Frequência') != NAO_COBRA]
+    cobrados.sort(key=lambda exame: -FREQUENCIA_MESES.get(rotina_exames[exame][0].get('Frequência'), 0))
+    return cobrados
+
+def identificar_pacientes_ativos(indice, df_exames, df_movimentacoes, data_referencia):
+    """DataFrame indexado pelo id dos pacientes ativos (ordenados por nome), com inicio_ciclo e clinica.
+
+    Sai quem tem como última movimentação até a data de referência uma das MOV_SAIDA.
+    """
+    pids = pd.RangeIndex(len(indice), name='pid')
+    ativos = pd.Series(True, index=pids)
+    if df_movimentacoes is not None and not df_movimentacoes.empty:
+        ultimas = (df_movimentacoes[(df_movimentacoes['pid'] >= 0) & (df_movimentacoes['Data'] <= data_referencia)]
+                   .sort_values(by='Data', kind='stable').drop_duplicates('pid', keep='last'))
+        ativos[ultimas.loc[ultimas['Movimentação'].isin(MOV_SAIDA), 'pid'].to_numpy()] = False
+
+    inicio = pd.Series(pd.NaT, index=pids, dtype='datetime64[ns]')
+    if COLUNA_INICIO_CICLO in df_exames.columns:
+        datas_inicio = pd.to_datetime(df_exames[COLUNA_INICIO_CICLO], dayfirst=True, errors='coerce')
+        inicio = datas_inicio.groupby(df_exames['pid']).min().reindex(pids)
+    sem_inicio = inicio.isna() & ativos
+    if sem_inicio.any():
+        logging.warning(f"Não foi encontrada '{COLUNA_INICIO_CICLO}' para {int(sem_inicio.sum())} paciente(s). "
+                        "Usando a data do exame mais antigo como fallback.")
+        inicio = inicio.fillna(df_exames.groupby('pid')['Data'].min().reindex(pids))
+
+    resultado = pd.DataFrame({'inicio_ciclo': inicio, 'clinica': _clinica_atual(df_exames, len(indice))})[ativos]
+    ordem = sorted(resultado.index, key=indice.chave_resultado)
+    return resultado.loc[ordem]
+
+def _clinica_atual(df_exames, num_pacientes):
+    """Clínica do exame mais recente de cada paciente (indexada pelo id); None para quem não tem."""
+    clinica = pd.Series(None, index=pd.RangeIndex(num_pacientes, name='pid'), dtype=object)
+    if 'Clinica' in df_exames.columns:
+        com_clinica = df_exames.dropna(subset=['Clinica']).sort_values(by='Data', kind='stable').drop_duplicates('pid', keep='last')
+        clinica[com_clinica['pid'].to_numpy()] = com_clinica['Clinica'].astype(str).to_numpy()
+    return clinica
+
+def _membros_por_clinica(df_exames, clinica_atual, clinicas):
+    """Ids dos pacientes cuja clínica atual está em `clinicas`; sem clínicas (ou sem a coluna), todos."""
+    if clinicas and 'Clinica' in df_exames.columns:
+        return set(clinica_atual.index[clinica_atual.isin(clinicas)])
+    return set(clinica_atual.index)
 
-    pacientes_ativos = {}
-    MOV_SAIDA = ['Óbito', 'Transferência de centro', 'Alta ambulatorial', 'Transplante']
-    paciente_identifier = ['Nome', 'CNS']
-    unique_patients_exames = df_exames.groupby(paciente_identifier).groups.keys()
-
-    for patient_tuple in unique_patients_exames:
-        nome_paciente, cns_paciente = patient_tuple
-        
-        is_active = True
-        if df_movimentacoes is not None and not df_movimentacoes.empty:
-            movs_paciente = df_movimentacoes[(df_movimentacoes['CNS'] == cns_paciente)].copy()
-            movs_paciente = movs_paciente[movs_paciente['Data'] <= data_referencia].sort_values(by='Data', ascending=False)
-            if not movs_paciente.empty and movs_paciente.iloc[0]['Movimentação'] in MOV_SAIDA:
-                is_active = False
-        
-        if not is_active:
-            continue
-
-        start_date = None
-        patient_df_slice = df_exames[df_exames['CNS'] == cns_paciente]
-        start_date_col = 'Data início prog. dial. clínica'
-        if start_date_col in patient_df_slice.columns:
-            possible_dates = pd.to_datetime(patient_df_slice[start_date_col], dayfirst=True, errors='coerce').dropna()
-            if not possible_dates.empty:
-                start_date = possible_dates.min()
-        
-        if start_date is None:
-            logging.warning(f"Não foi encontrada 'Data início prog. dial. clínica' para {nome_paciente}. Usando a data do exame mais antigo como fallback.")
-            start_date = patient_df_slice['Data'].min()
-
-        pacientes_ativos[patient_tuple] = {'status': 'Ativo', 'inicio_ciclo': start_date}
-
-    resultados = {}
-    exames_ordenados_com_regras = []
-    for exame, regras in rotina_exames.items():
-        if regras and regras[0].get('Frequência') != 'Não Cobra':
-            exames_ordenados_com_regras.append((exame, regras))
-    exames_ordenados = sorted(exames_ordenados_com_regras, key=lambda item: ['Anual', 'Semestral', 'Trimestral', 'Mensal'].index(item[1][0]['Frequência']))
-
-    for paciente_tuple, info in pacientes_ativos.items():
-        nome_paciente, cns_paciente = paciente_tuple
-        inicio_ciclo = info['inicio_ciclo']
-        df_paciente = df_exames[(df_exames['CNS'] == cns_paciente) & (df_exames['Data'] <= data_referencia)].copy()
-        
-        if df_internacoes is not None and not df_internacoes.empty:
-            internacoes_paciente = df_internacoes[df_internacoes['Nome'] == nome_paciente].sort_values(by='Data Internação', ascending=False)
-            if not internacoes_paciente.empty:
-                ultima_internacao = internacoes_paciente.iloc[0]
-                data_internacao = ultima_internacao['Data Internação']
-                data_alta = ultima_internacao['Data Alta']
-                if data_internacao <= data_referencia and (pd.isna(data_alta) or data_alta >= data_referencia):
-                    resultados[paciente_tuple] = {
-                        'status': 'Internado',
-                        'exames_faltantes': f"Internado desde {data_internacao.strftime('%d/%m/%Y')}",
-                        'motivo_internacao': ultima_internacao.get('Tipo', 'Não especificado'),
-                        'detalhes_obrigatorios': [], 'detalhes_opcionais': [], 'detalhes_resolvidos': []
-                    }
-                    continue
-
-        meses_de_tratamento = (data_referencia.year - inicio_ciclo.year) * 12 + (data_referencia.month - inicio_ciclo.month) + 1
-        
-        exames_feitos_no_mes = df_paciente[(df_paciente['Data'].dt.year == data_referencia.year) & (df_paciente['Data'].dt.month == data_referencia.month)]
-        
-        exames_mensais_obrigatorios_rotina = []
-        for ex, regras in rotina_exames.items():
-            regra_aplicavel = get_regra_aplicavel(regras, meses_de_tratamento)
-            if regra_aplicavel and regra_aplicavel.get('Frequência') == 'Mensal' and regra_aplicavel.get('Tipo') == 'Obrigatório':
-                exames_mensais_obrigatorios_rotina.append(ex)
-        
-        teve_mensais_obrigatorios_no_mes = not exames_feitos_no_mes[exames_feitos_no_mes['Exame'].isin(exames_mensais_obrigatorios_rotina)].empty
-
-        if not teve_mensais_obrigatorios_no_mes:
-            resultados[paciente_tuple] = {
+def meses_de_tratamento(inicio_ciclo, data_referencia):
+    """Mês do tratamento em que cai `data_referencia` (o mês de início é o 1), para uma Series de datas de início."""
+    return (data_referencia.year - inicio_ciclo.dt.year) * 12 + (data_referencia.month - inicio_ciclo.dt.month) + 1
+
+def _internacoes_vigentes(df_internacoes, data_referencia):
+    """Última internação de cada paciente (por id) que ainda está em aberto na data de referência."""
+    if df_internacoes is None or df_internacoes.empty:
+        return {}
+    ultimas = (df_internacoes[df_internacoes['pid'] >= 0]
+               .sort_values(by='Data Internação', ascending=False, kind='stable').drop_duplicates('pid'))
+    vigentes = ultimas[(ultimas['Data Internação'] <= data_referencia)
+                       & (ultimas['Data Alta'].isna() | (ultimas['Data Alta'] >= data_referencia))]
+    return {row['pid']: row for _, row in vigentes.iterrows()}
+
+# Histórico agregado uma vez por análise e consultado por cada lote de pacientes.
+_HistoricoExames = namedtuple("_HistoricoExames", ["feitos_no_mes", "ultimos", "internados"])
+
+def _resumir_historico(df_exames, df_internacoes, data_referencia) -> _HistoricoExames:
+    historico = df_exames.loc[df_exames['Data'] <= data_referencia, ['pid', 'Exame', 'Data']]
+    no_mes = (historico['Data'].dt.year == data_referencia.year) & (historico['Data'].dt.month == data_referencia.month)
+    feitos_no_mes = historico.loc[no_mes, ['pid', 'Exame']].drop_duplicates().assign(feito_no_mes=True)
+    ultimos = historico.groupby(['pid', 'Exame'], sort=False)['Data'].max().rename('ultimo').reset_index()
+    return _HistoricoExames(feitos_no_mes, ultimos, _internacoes_vigentes(df_internacoes, data_referencia))
+
+def _avaliar_pacientes(ativos, indice, historico: _HistoricoExames, data_referencia, rotina_exames, periodos, overrides):
+    """Resultado de cada paciente de `ativos` (um lote), na ordem de `ativos`.
+
+    As regras são resolvidas para todos os pacientes x exames do lote de uma vez (rule_engine.aplicar_regras)
+    e cruzadas com o histórico de exames agregado por (paciente, exame); só a montagem dos dicts é por paciente.
+    """
+    meses = meses_de_tratamento(ativos['inicio_ciclo'], data_referencia)
+    feitos_no_mes = historico.feitos_no_mes[historico.feitos_no_mes['pid'].isin(ativos.index)]
+    ultimos = historico.ultimos[historico.ultimos['pid'].isin(ativos.index)]
+
+    regras = aplicar_regras(meses, rotina_exames, periodos)
+    regras['paciente'] = regras['paciente'].astype('int64')
+    regras = regras.merge(feitos_no_mes, left_on=['paciente', 'exame'], right_on=['pid', 'Exame'], how='left').drop(columns=['pid', 'Exame'])
+    regras['feito_no_mes'] = regras['feito_no_mes'].fillna(False).astype(bool)
+
+    mensais = regras[(regras['frequencia'] == 'Mensal') & (regras['tipo'] == 'Obrigatório') & regras['feito_no_mes']]
+    com_coleta = set(mensais['paciente'])
+
+    ordem_exame = {exame: i for i, exame in enumerate(exames_cobrados(rotina_exames))}
+
+    devidos = regras[regras['exame'].isin(ordem_exame) & regras['devida'] & ~regras['feito_no_mes']
+                     & regras['paciente'].isin(com_coleta)].copy()
+    devidos['ordem_exame'] = devidos['exame'].map(ordem_exame)
+    devidos = devidos.sort_values(['paciente', 'ordem_exame'], kind='stable')
+    devidos['resolvido'] = [(indice.chave(pid), exame) in overrides for pid, exame in zip(devidos['paciente'], devidos['exame'])]
+    devidos = devidos.merge(ultimos, left_on=['paciente', 'exame'], right_on=['pid', 'Exame'], how='left', sort=False)
+    devidos['proxima'] = pd.NaT
+    for intervalo in devidos['intervalo'].dropna().unique():
+        mascara = devidos['intervalo'] == intervalo
+        devidos.loc[mascara, 'proxima'] = devidos.loc[mascara, 'ultimo'] + pd.DateOffset(months=int(intervalo))
+    devidos['proxima'] = pd.to_datetime(devidos['proxima'])
+    pendentes = ~devidos['resolvido'] & (devidos['ultimo'].isna() | (devidos['proxima'] <= data_referencia))
+    devidos['ultimo_txt'] = devidos['ultimo'].dt.strftime('%d/%m/%Y').fillna('Nunca realizado')
+    devidos['proxima_txt'] = devidos['proxima'].dt.strftime('%d/%m/%Y').fillna('Pendente')
+
+    obrigatorios, opcionais, resolvidos = {}, {}, {}
+    for row in devidos[devidos['resolvido']].itertuples(index=False):
+        resolvidos.setdefault(row.paciente, []).append({'exame': row.exame, 'status': 'Resolvido manualmente'})
+    for row in devidos[pendentes].itertuples(index=False):
+        detalhe = {'exame': row.exame, 'frequencia': f"{row.frequencia} ({row.periodo})",
+                   'ultimo_realizado': row.ultimo_txt, 'proxima_data': row.proxima_txt}
+        (obrigatorios if row.tipo == 'Obrigatório' else opcionais).setdefault(row.paciente, []).append(detalhe)
+
+    internados = historico.internados
+    resultados = []
+    for pid, clinica in zip(ativos.index, ativos['clinica']):
+        internacao = internados.get(pid)
+        if internacao is not None:
+            resultados.append({
+                'status': 'Internado',
+                'exames_faltantes': f"Internado desde {internacao['Data Internação'].strftime('%d/%m/%Y')}",
+                'motivo_internacao': internacao.get('Tipo', 'Não especificado'),
+                'clinica': clinica,
+                'detalhes_obrigatorios': [], 'detalhes_opcionais': [], 'detalhes_resolvidos': []
+            })
+        elif pid not in com_coleta:
+            resultados.append({
                 'status': 'Pendência de Coleta',
                 'exames_faltantes': 'Nenhum exame mensal obrigatório encontrado no mês de referência.',
+                'clinica': clinica,
                 'detalhes_obrigatorios': [], 'detalhes_opcionais': [], 'detalhes_resolvidos': []
-            }
-            continue
-
-        mes_do_ciclo = meses_de_tratamento
-        freqs_devidas_teoricas = set()
-        if mes_do_ciclo % 12 == 1: freqs_devidas_teoricas.update(['Anual', 'Semestral', 'Trimestral', 'Mensal'])
-        elif mes_do_ciclo % 6 == 1: freqs_devidas_teoricas.update(['Semestral', 'Trimestral', 'Mensal'])
-        elif mes_do_ciclo % 3 == 1: freqs_devidas_teoricas.update(['Trimestral', 'Mensal'])
-        else: freqs_devidas_teoricas.add('Mensal')
-        
-        obrigatorios_pendentes = []
-        opcionais_pendentes = []
-        resolvidos_manualmente = []
-        for exame, regras in exames_ordenados:
-            regra_aplicavel = get_regra_aplicavel(regras, meses_de_tratamento)
-            if not regra_aplicavel or regra_aplicavel.get('Frequência') == 'Não Cobra':
-                continue
-            frequencia = regra_aplicavel['Frequência']
-            tipo = regra_aplicavel['Tipo']
-            if frequencia not in freqs_devidas_teoricas: continue
-            if not exames_feitos_no_mes[exames_feitos_no_mes['Exame'] == exame].empty: continue
-            if (cns_paciente, exame) in manual_overrides:
-                resolvidos_manualmente.append({'exame': exame, 'status': 'Resolvido manualmente'})
-                continue
-            ultimo_exame_registro = df_paciente[df_paciente['Exame'] == exame].sort_values(by='Data', ascending=False)
-            ultimo_realizado_data = pd.NaT
-            if not ultimo_exame_registro.empty:
-                ultimo_realizado_data = ultimo_exame_registro['Data'].iloc[0]
-            proxima_data_devida = calcular_proxima_data(ultimo_realizado_data, frequencia)
-            if pd.isna(ultimo_realizado_data) or (proxima_data_devida and proxima_data_devida <= data_referencia):
-                detalhe_pendencia = {'exame': exame, 'frequencia': f"{frequencia} ({regra_aplicavel['Período']})", 'ultimo_realizado': 'Nunca realizado' if pd.isna(ultimo_realizado_data) else ultimo_realizado_data.strftime('%d/%m/%Y'), 'proxima_data': 'Pendente' if pd.isna(proxima_data_devida) else proxima_data_devida.strftime('%d/%m/%Y')}
-                if tipo == 'Obrigatório':
-                    obrigatorios_pendentes.append(detalhe_pendencia)
-                else:
-                    opcionais_pendentes.append(detalhe_pendencia)
-        status_final = 'Pendente' if obrigatorios_pendentes else 'Em dia'
-        resumo = f"{len(obrigatorios_pendentes)} exame(s) obrigatório(s) pendente(s)."
-        if opcionais_pendentes: resumo += f" {len(opcionais_pendentes)} opcional(is) sugerido(s)."
-        if resolvidos_manualmente: resumo += f" {len(resolvidos_manualmente)} resolvido(s) manualmente."
-        if status_final == 'Em dia': resumo = "Nenhum exame pendente para este mês."
-        resultados[paciente_tuple] = {'status': status_final, 'exames_faltantes': resumo, 'detalhes_obrigatorios': obrigatorios_pendentes, 'detalhes_opcionais': opcionais_pendentes, 'detalhes_resolvidos': resolvidos_manualmente}
-    return resultados, len(pacientes_ativos)
\ No newline at end of file
+            })
+        else:
+            obrigatorios_pendentes = obrigatorios.get(pid, [])
+            opcionais_pendentes = opcionais.get(pid, [])
+            resolvidos_manualmente = resolvidos.get(pid, [])
+            status_final, resumo = montar_resumo(obrigatorios_pendentes, opcionais_pendentes, resolvidos_manualmente)
+            resultados.append({'status': status_final, 'exames_faltantes': resumo, 'clinica': clinica,
+                               'detalhes_obrigatorios': obrigatorios_pendentes, 'detalhes_opcionais': opcionais_pendentes,
+                               'detalhes_resolvidos': resolvidos_manualmente})
+    return resultados
@@ -0,0 +1,110 @@
+import logging
+import threading
+import time
+from typing import Dict, Optional
+from . import database_manager as db
+
+logger = logging.getLogger(__name__)
+
+# Intervalos em segundos.
+INITIAL_DELAY = 120
+CYCLE_INTERVAL = 30 * 60
+QUICK_CHECK_INTERVAL = 24 * 60 * 60
+IDLE_THRESHOLD = 60
+# Abaixo disso não compensa mexer no arquivo.
+MIN_FREE_PAGES = 256
+VACUUM_PAGES_PER_CYCLE = 2048
+
+class MaintenanceService:
+    """Executa a manutenção do banco numa thread em segundo plano.
+
+    A cada ciclo roda `PRAGMA optimize` (ANALYZE completo na primeira vez), um quick_check por dia e,
+    se o app estiver sem escrever há algum tempo, o vacuum incremental. A verificação completa
+    (integrity_check) só roda quando pedida em request_full_check (opção --full-db-check na linha de comando).
+    """
+
+    def __init__(self, cycle_interval: float = CYCLE_INTERVAL, initial_delay: float = INITIAL_DELAY):
+        self.cycle_interval = cycle_interval
+        self.initial_delay = initial_delay
+        self.last_report: Dict[str, object] = {}
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._full_check_requested = threading.Event()
+        self._last_quick_check: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="db-maintenance", daemon=True)
+        self._thread.start()
+        logger.info("Serviço de manutenção do banco iniciado.")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._thread = None
+        logger.info("Serviço de manutenção do banco encerrado.")
+
+    def request_full_check(self) -> None:
+        """Agenda um integrity_check completo para o próximo ciclo, que é antecipado."""
+        self._full_check_requested.set()
+        self._wake.set()
+
+    def run_now(self) -> None:
+        self._wake.set()
+
+    def _wait(self, seconds: float) -> bool:
+        self._wake.wait(seconds)
+        self._wake.clear()
+        return not self._stop.is_set()
+
+    def _run(self) -> None:
+        try:
+            if not self._wait(self.initial_delay):
+                return
+            while True:
+                try:
+                    self.run_cycle()
+                except Exception as e:
+                    logger.error(f"Erro no ciclo de manutenção do banco: {e}")
+                if not self._wait(self.cycle_interval):
+                    return
+        finally:
+            db.close_thread_connection()
+
+    def run_cycle(self) -> Dict[str, object]:
+        inicio = time.perf_counter()
+        report: Dict[str, object] = {}
+        # Medido antes das escritas do próprio ciclo.
+        idle = db.seconds_since_last_write() >= IDLE_THRESHOLD
+        db.optimize_database(analyze=not db.has_planner_stats())
+
+        now = time.monotonic()
+        if self._full_check_requested.is_set():
+            self._full_check_requested.clear()
+            report['integridade'] = db.validate_database_integrity(full=True)
+            report['verificacao'] = 'integrity_check'
+            self._last_quick_check = now
+        elif self._last_quick_check is None or now - self._last_quick_check >= QUICK_CHECK_INTERVAL:
+            report['integridade'] = db.validate_database_integrity()
+            report['verificacao'] = 'quick_check'
+            self._last_quick_check = now
+
+        if idle:
+            page_stats = db.get_database_page_stats()
+            if page_stats.get('auto_vacuum') != 2 and not self._stop.is_set():
+                db.enable_incremental_vacuum()
+            elif page_stats.get('freelist_count', 0) >= MIN_FREE_PAGES:
+                report['paginas_liberadas'] = db.incremental_vacuum(VACUUM_PAGES_PER_CYCLE)
+
+        report.update(db.get_database_stats())
+        report.update(db.get_database_page_stats())
+        report['duracao_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+        self.last_report = report
+        logger.info(f"Manutenção do banco concluída: {report}")
+        return report
@@ -0,0 +1,135 @@
+import logging
+from typing import Dict, List, Mapping, Optional, Tuple
+import numpy as np
+import pandas as pd
+from .search_index import NAME_KEY_PREFIX, normalize_text
+
+logger = logging.getLogger(__name__)
+
+CNS_DIGITS = 15
+# Pacientes sem CNS têm como identidade o nome normalizado com este prefixo (mesma chave de search_index.patient_key).
+_CHAVE_NOME = NAME_KEY_PREFIX
+SEM_PACIENTE = -1
+
+def normalizar_cns(serie: pd.Series) -> pd.Series:
+    """Só os dígitos do CNS, completados com zeros à esquerda; valores sem dígitos viram NA."""
+    digitos = serie.astype('string').str.replace(r'\D', '', regex=True)
+    return digitos.where(digitos.str.len() > 0).str.zfill(CNS_DIGITS)
+
+def normalizar_nomes(serie: pd.Series) -> pd.Series:
+    """normalize_text aplicado uma vez por grafia distinta (os arquivos repetem o nome em cada linha)."""
+    codigos, grafias = pd.factorize(serie.astype('string').fillna(''))
+    normalizados = np.array([normalize_text(g) for g in grafias], dtype=object)
+    return pd.Series(normalizados[codigos] if len(grafias) else [], index=serie.index, dtype=object)
+
+def resolver_fusoes(fusoes: Optional[Mapping[str, str]]) -> Dict[str, str]:
+    """CNS duplicado -> CNS canônico, seguindo cadeias (a -> b -> c vira a -> c) e ignorando ciclos."""
+    if not fusoes:
+        return {}
+    normalizados = {}
+    for origem, destino in fusoes.items():
+        origem, destino = normalizar_cns(pd.Series([origem, destino])).tolist()
+        if isinstance(origem, str) and isinstance(destino, str) and origem != destino:
+            normalizados[origem] = destino
+    resolvidos = {}
+    for origem in normalizados:
+        atual, vistos = origem, {origem}
+        while atual in normalizados:
+            atual = normalizados[atual]
+            if atual in vistos:
+                logger.warning(f"Fusão de CNS em ciclo ignorada a partir de {origem}.")
+                break
+            vistos.add(atual)
+        else:
+            resolvidos[origem] = atual
+    return resolvidos
+
+class PatientIndex:
+    """Identidade dos pacientes de um conjunto de dados, resolvida uma vez e usada por todas as junções.
+
+    Cada paciente recebe um id inteiro compacto (0..n-1). A identidade é o CNS normalizado, já com as
+    fusões de duplicados conhecidos aplicadas; grafias diferentes do nome com o mesmo CNS são o mesmo
+    paciente. Linhas sem CNS usam o nome sem acentos/caixa: se ele pertence a um único paciente com
+    CNS, a linha vai para ele; caso contrário, forma um paciente só com o nome.
+    """
+
+    def __init__(self, chaves: List[str], nomes: List[str], ids_linhas: np.ndarray, nomes_normalizados: Dict[str, int],
+                 fusoes: Dict[str, str]):
+        self._chaves = chaves
+        self.nomes = nomes
+        self.ids = ids_linhas
+        self._por_cns = {chave: pid for pid, chave in enumerate(chaves) if not chave.startswith(_CHAVE_NOME)}
+        self._por_nome = nomes_normalizados
+        self._fusoes = fusoes
+
+    def __len__(self):
+        return len(self._chaves)
+
+    def cns(self, pid: int) -> str:
+        chave = self._chaves[pid]
+        return "" if chave.startswith(_CHAVE_NOME) else chave
+
+    def chave(self, pid: int) -> str:
+        """Chave estável do paciente (CNS ou 'nome:' + nome normalizado), usada nos overrides."""
+        return self._chaves[pid]
+
+    def chave_resultado(self, pid: int) -> Tuple[str, str]:
+        """Chave (nome, cns) usada nos resultados da análise, no histórico e nos overrides."""
+        return self.nomes[pid], self.cns(pid)
+
+    @classmethod
+    def build(cls, df: pd.DataFrame, fusoes: Optional[Mapping[str, str]] = None, data_col: str = 'Data') -> 'PatientIndex':
+        """Monta o índice a partir das colunas Nome e CNS de `df`; `ids` fica alinhado às linhas de `df`.
+
+        O nome exibido de cada paciente é a grafia da linha mais recente em `data_col`.
+        """
+        cns = normalizar_cns(df['CNS']) if 'CNS' in df.columns else pd.Series(pd.NA, index=df.index, dtype='string')
+        fusoes = resolver_fusoes(fusoes)
+        if fusoes:
+            cns = cns.replace(fusoes)
+        nomes_norm = normalizar_nomes(df['Nome'])
+        chave = cns.astype(object)
+        sem_cns = chave.isna()
+        if sem_cns.any():
+            pares = pd.DataFrame({'nome': nomes_norm[~sem_cns], 'cns': chave[~sem_cns]}).drop_duplicates()
+            contagem = pares['nome'].value_counts()
+            unicos = pares[pares['nome'].isin(contagem.index[contagem == 1])].set_index('nome')['cns']
+            por_nome = nomes_norm[sem_cns].map(unicos)
+            chave[sem_cns] = por_nome.fillna(_CHAVE_NOME + nomes_norm[sem_cns])
+        ids, chaves = pd.factorize(chave)
+        ordem = pd.DataFrame({'pid': ids, 'data': df[data_col].to_numpy() if data_col in df.columns else 0,
+                              'nome': df['Nome'].astype(str).str.strip().to_numpy()})
+        recentes = ordem.sort_values('data', kind='stable').drop_duplicates('pid', keep='last').set_index('pid')['nome']
+        nomes = recentes.reindex(range(len(chaves))).tolist()
+        # Nome normalizado -> paciente; nomes compartilhados por mais de um paciente ficam ambíguos (SEM_PACIENTE).
+        por_nome = pd.DataFrame({'nome': nomes_norm.to_numpy(), 'pid': ids}).drop_duplicates()
+        ambiguos = por_nome['nome'].duplicated(keep=False)
+        nomes_normalizados = dict(zip(por_nome.loc[~ambiguos, 'nome'], por_nome.loc[~ambiguos, 'pid']))
+        nomes_normalizados.update((nome, SEM_PACIENTE) for nome in por_nome.loc[ambiguos, 'nome'])
+        indice = cls(list(chaves), nomes, ids, nomes_normalizados, fusoes)
+        variantes = len(ordem[['pid', 'nome']].drop_duplicates()) - len(indice)
+        suspeitos = por_nome.loc[ambiguos, 'nome'].nunique()
+        logger.info(f"Índice de pacientes: {len(indice)} paciente(s) em {len(df)} linha(s); {variantes} grafia(s) alternativa(s) "
+                    f"unificada(s), {len(fusoes)} fusão(ões) de CNS aplicada(s)")
+        if suspeitos:
+            logger.warning(f"{suspeitos} nome(s) aparecem com CNS diferentes; possíveis duplicados a fundir.")
+        return indice
+
+    def lookup(self, df: pd.DataFrame) -> np.ndarray:
+        """Id do paciente de cada linha de `df`; SEM_PACIENTE se não houver.
+
+        Linhas com CNS só casam pelo CNS (um CNS desconhecido não é atribuído a um homônimo); o nome é
+        usado apenas nas linhas sem CNS ou quando `df` não tem a coluna.
+        """
+        ids = pd.Series(SEM_PACIENTE, index=df.index, dtype='int64')
+        faltantes = pd.Series(True, index=df.index)
+        if 'CNS' in df.columns:
+            cns = normalizar_cns(df['CNS'])
+            if self._fusoes:
+                cns = cns.replace(self._fusoes)
+            ids = cns.map(self._por_cns).fillna(SEM_PACIENTE).astype('int64')
+            faltantes = cns.isna()
+        if 'Nome' in df.columns:
+            if faltantes.any():
+                ids[faltantes] = normalizar_nomes(df.loc[faltantes, 'Nome']).map(self._por_nome).fillna(SEM_PACIENTE).astype('int64')
+        return ids.to_numpy()
@@ -0,0 +1,152 @@
+import csv
+import logging
+import re
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from .cancellation import CancellationToken
+
+logger = logging.getLogger(__name__)
+
+EXPORT_COLUMNS = ["Clínica", "Paciente", "CNS", "Status", "Exame", "Tipo", "Frequência", "Último Realizado", "Próxima Data", "Situação"]
+FORMAT_CSV = "csv"
+FORMAT_XLSX = "xlsx"
+# A cada quantos pacientes a exportação informa o progresso e verifica o cancelamento.
+EXPORT_PROGRESS_BATCH = 200
+SEM_CLINICA = "Sem clínica"
+
+def xlsx_available() -> bool:
+    try:
+        import openpyxl  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def iter_export_rows(nome: str, cns: str, info: dict) -> Iterator[list]:
+    """Linhas de um paciente: uma por exame pendente ou resolvido; sem exames, uma linha com o resumo."""
+    base = [info.get('clinica') or "", nome, cns, info.get('status', "")]
+    detalhes = [(d, "Obrigatório") for d in info.get('detalhes_obrigatorios', [])]
+    detalhes += [(d, "Opcional") for d in info.get('detalhes_opcionais', [])]
+    if not detalhes and not info.get('detalhes_resolvidos'):
+        yield base + ["", "", "", "", "", info.get('exames_faltantes', "")]
+        return
+    for detalhe, tipo in detalhes:
+        yield base + [detalhe['exame'], tipo, detalhe.get('frequencia', ""), detalhe.get('ultimo_realizado', ""),
+                      detalhe.get('proxima_data', ""), "Pendente"]
+    for detalhe in info.get('detalhes_resolvidos', []):
+        yield base + [detalhe['exame'], "", "", "", "", detalhe.get('status', "Resolvido manualmente")]
+
+class _CsvSink:
+    def __init__(self, path: Path, columns: List[str] = EXPORT_COLUMNS, sheet: str = "Resultados"):
+        self._file = open(path, "w", newline="", encoding="utf-8-sig")
+        # Mesmo formato dos arquivos de entrada (';'), que o Excel abre direto.
+        self._writer = csv.writer(self._file, delimiter=";")
+        self._writer.writerow(columns)
+
+    def write(self, row: list) -> None:
+        self._writer.writerow(row)
+
+    def close(self) -> None:
+        self._file.close()
+
+class _XlsxSink:
+    def __init__(self, path: Path, columns: List[str] = EXPORT_COLUMNS, sheet: str = "Resultados"):
+        from openpyxl import Workbook
+        self._path = path
+        # write_only: as linhas vão para o arquivo temporário do openpyxl em vez de ficarem em memória.
+        self._workbook = Workbook(write_only=True)
+        self._sheet = self._workbook.create_sheet(sheet)
+        self._sheet.append(columns)
+
+    def write(self, row: list) -> None:
+        self._sheet.append(row)
+
+    def close(self) -> None:
+        self._workbook.save(self._path)
+
+_SINKS = {FORMAT_CSV: _CsvSink, FORMAT_XLSX: _XlsxSink}
+
+def _clinic_path(path: Path, clinica: str, usados: Set[str]) -> Path:
+    """<nome>_<clínica>.<ext>; clínicas cujos nomes viram o mesmo arquivo ganham _2, _3... em vez de sobrescrevê-lo."""
+    slug = re.sub(r"[^\w-]+", "_", clinica, flags=re.UNICODE).strip("_") or "clinica"
+    destino, n = path.with_name(f"{path.stem}_{slug}{path.suffix}"), 1
+    # Comparação sem caixa: no Windows "CNN" e "cnn" são o mesmo arquivo.
+    while destino.name.lower() in usados:
+        n += 1
+        destino = path.with_name(f"{path.stem}_{slug}_{n}{path.suffix}")
+    usados.add(destino.name.lower())
+    return destino
+
+def export_results(items: Iterable[Tuple[Tuple[str, str], dict]], path: Path, fmt: str, split_by_clinic: bool = False,
+                   total: Optional[int] = None, progress_callback: Optional[Callable[[int], None]] = None,
+                   cancel_token: Optional[CancellationToken] = None) -> List[Path]:
+    """Grava `items` ((nome, cns), info) em `path`, linha a linha, e devolve os arquivos criados.
+
+    Com split_by_clinic, uma única passada distribui as linhas em um arquivo por clínica
+    (<nome>_<clínica>.<ext>). Se `cancel_token` for cancelado, os arquivos parciais são apagados e
+    AnalysisCancelled é levantada.
+    """
+    if fmt not in _SINKS:
+        raise ValueError(f"Formato de exportação desconhecido: {fmt}")
+    sinks: Dict[Optional[str], object] = {}
+    criados: List[Path] = []
+    usados: Set[str] = set()
+
+    def sink_for(clinica):
+        chave = (clinica or SEM_CLINICA) if split_by_clinic else None
+        sink = sinks.get(chave)
+        if sink is None:
+            destino = _clinic_path(path, chave, usados) if split_by_clinic else path
+            sink = sinks[chave] = _SINKS[fmt](destino)
+            criados.append(destino)
+        return sink
+
+    try:
+        for feitos, ((nome, cns), info) in enumerate(items, 1):
+            sink = sink_for(info.get('clinica'))
+            for row in iter_export_rows(nome, cns, info):
+                sink.write(row)
+            if feitos % EXPORT_PROGRESS_BATCH == 0:
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+                if progress_callback is not None and total:
+                    progress_callback(min(99, feitos * 100 // total))
+        if not sinks:
+            sink_for(None)
+    except BaseException:
+        _close_sinks(sinks.values(), criados, discard=True)
+        raise
+    _close_sinks(sinks.values(), criados, discard=False)
+    if progress_callback is not None:
+        progress_callback(100)
+    logger.info(f"Exportação concluída: {len(criados)} arquivo(s) em {path.parent}")
+    return criados
+
+def export_table(rows: Iterable[list], path: Path, fmt: str, columns: List[str], sheet: str) -> Path:
+    """Grava uma tabela simples (cabeçalho `columns` + `rows`) em `path`; usada pela agenda de coletas."""
+    if fmt not in _SINKS:
+        raise ValueError(f"Formato de exportação desconhecido: {fmt}")
+    sink = _SINKS[fmt](path, columns, sheet)
+    try:
+        for row in rows:
+            sink.write(row)
+    except BaseException:
+        _close_sinks([sink], [path], discard=True)
+        raise
+    _close_sinks([sink], [path], discard=False)
+    logger.info(f"Tabela exportada para {path}")
+    return path
+
+def _close_sinks(sinks, criados: List[Path], discard: bool) -> None:
+    """Fecha os arquivos; se `discard` ou se algum falhar ao fechar, apaga todos os criados."""
+    erro = None
+    for sink in sinks:
+        try:
+            sink.close()
+        except Exception as e:
+            logger.error(f"Erro ao fechar arquivo de exportação: {e}")
+            erro = erro or e
+    if discard or erro is not None:
+        for destino in criados:
+            destino.unlink(missing_ok=True)
+    if erro is not None and not discard:
+        raise erro
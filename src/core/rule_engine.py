@@ -0,0 +1,99 @@
+from collections import namedtuple
+from typing import Iterable, Mapping, Optional, Sequence
+
+# Período de uma regra: faixa de meses de tratamento [mes_inicio, mes_fim]; None deixa o limite aberto.
+Periodo = namedtuple("Periodo", ["nome", "mes_inicio", "mes_fim"])
+
+# Períodos de fábrica, gravados no banco na criação/migração; clínicas podem cadastrar outros.
+PERIODOS_PADRAO = (
+    Periodo("Sempre", None, None),
+    Periodo("Primeiro Mês", 1, 1),
+    Periodo("Primeiro Trimestre", None, 3),
+    Periodo("Primeiro Ano", None, 12),
+    Periodo("Após Primeiro Ano", 13, None),
+)
+# Intervalo em meses de cada frequência: a regra é devida nos meses de ciclo 1, 1 + n, 1 + 2n...
+FREQUENCIA_MESES = {'Mensal': 1, 'Trimestral': 3, 'Semestral': 6, 'Anual': 12}
+NAO_COBRA = 'Não Cobra'
+# Limites usados no lugar de None nas comparações vetorizadas.
+_SEM_LIMITE = 10 ** 6
+
+def periodo_contem(periodo: Periodo, meses: int) -> bool:
+    return ((periodo.mes_inicio is None or meses >= periodo.mes_inicio)
+            and (periodo.mes_fim is None or meses <= periodo.mes_fim))
+
+def especificidade(periodo: Periodo) -> tuple:
+    """Chave de precedência entre períodos que contêm o mesmo mês: menor vence.
+
+    Faixas com fim vêm antes das abertas e, entre elas, as mais estreitas primeiro; 'Sempre' (aberto
+    dos dois lados) só vale quando nenhum outro período contém o mês.
+    """
+    inicio, fim = periodo.mes_inicio, periodo.mes_fim
+    largura = fim - (inicio if inicio is not None else 1) if fim is not None else _SEM_LIMITE
+    return (fim is None, inicio is None, largura)
+
+def frequencia_devida(frequencia: str, meses: int) -> bool:
+    intervalo = FREQUENCIA_MESES.get(frequencia)
+    return intervalo is not None and (meses - 1) % intervalo == 0
+
+def regra_aplicavel(regras_exame: Sequence[Mapping], meses: int, periodos: Iterable[Periodo] = PERIODOS_PADRAO) -> Optional[Mapping]:
+    """Regra do exame que vale no mês `meses` do tratamento; sem período que o contenha, vale a primeira regra."""
+    if not regras_exame:
+        return None
+    por_nome = {p.nome: p for p in periodos}
+    candidatas = [(especificidade(por_nome[r.get('Período')]), ordem, r) for ordem, r in enumerate(regras_exame)
+                  if r.get('Período') in por_nome and periodo_contem(por_nome[r.get('Período')], meses)]
+    if not candidatas:
+        return regras_exame[0]
+    return min(candidatas, key=lambda item: item[:2])[2]
+
+def compilar_regras(rotina_exames: Mapping[str, Sequence[Mapping]], periodos: Iterable[Periodo] = PERIODOS_PADRAO):
+    """Tabela com uma linha por regra da rotina: faixa de meses, precedência e a regra em si.
+
+    Regras com período desconhecido ficam com uma faixa vazia, que nunca casa.
+    """
+    # pandas só é carregado quando uma análise roda (o banco importa este módulo na abertura).
+    import pandas as pd
+    periodos = list(periodos)
+    por_nome = {p.nome: p for p in periodos}
+    chaves = sorted({especificidade(p) for p in periodos})
+    rank = {p.nome: chaves.index(especificidade(p)) for p in periodos}
+    linhas = []
+    for exame, regras in rotina_exames.items():
+        for ordem, regra in enumerate(regras):
+            periodo = por_nome.get(regra.get('Período'))
+            if periodo is None:
+                inicio, fim, precedencia = _SEM_LIMITE, -_SEM_LIMITE, len(chaves)
+            else:
+                inicio = periodo.mes_inicio if periodo.mes_inicio is not None else -_SEM_LIMITE
+                fim = periodo.mes_fim if periodo.mes_fim is not None else _SEM_LIMITE
+                precedencia = rank[periodo.nome]
+            linhas.append((exame, ordem, inicio, fim, precedencia, regra.get('Frequência'), regra.get('Tipo'), regra.get('Período')))
+    return pd.DataFrame(linhas, columns=['exame', 'ordem', 'mes_inicio', 'mes_fim', 'precedencia', 'frequencia', 'tipo', 'periodo'])
+
+def aplicar_regras(meses, rotina_exames: Mapping[str, Sequence[Mapping]], periodos: Iterable[Periodo] = PERIODOS_PADRAO):
+    """Resolve, numa única passada, a regra de cada exame da rotina para cada paciente.
+
+    `meses` é uma Series (um valor por paciente, indexada pelo paciente) com o mês de tratamento na data
+    de referência. Devolve um DataFrame com uma linha por paciente x exame: paciente (o índice de
+    `meses`), exame, frequencia, tipo, periodo, intervalo (meses entre coletas; NaN para 'Não Cobra') e
+    devida (se a frequência cai no mês do ciclo).
+    """
+    import pandas as pd
+    regras = compilar_regras(rotina_exames, periodos)
+    colunas = ['paciente', 'exame', 'frequencia', 'tipo', 'periodo', 'intervalo', 'devida']
+    if regras.empty or meses.empty:
+        return pd.DataFrame(columns=colunas)
+    # A resolução depende só do mês de tratamento: resolve para os meses distintos e depois espalha pelos pacientes.
+    valores = pd.DataFrame({'meses': pd.unique(meses.to_numpy())})
+    cruz = valores.merge(regras, how='cross')
+    casam = (cruz['meses'] >= cruz['mes_inicio']) & (cruz['meses'] <= cruz['mes_fim'])
+    # A primeira regra entra como candidata de menor precedência, para exames sem período que contenha o mês.
+    fallback = cruz[cruz['ordem'] == 0].assign(precedencia=_SEM_LIMITE)
+    candidatas = pd.concat([cruz[casam], fallback], ignore_index=True)
+    resolvidas = (candidatas.sort_values(['meses', 'exame', 'precedencia', 'ordem'], kind='stable')
+                  .drop_duplicates(['meses', 'exame'])[['meses', 'exame', 'frequencia', 'tipo', 'periodo']])
+    resolvidas['intervalo'] = resolvidas['frequencia'].map(FREQUENCIA_MESES)
+    resolvidas['devida'] = ((resolvidas['meses'] - 1) % resolvidas['intervalo']).eq(0)
+    pacientes = pd.DataFrame({'paciente': meses.index, 'meses': meses.to_numpy()})
+    return pacientes.merge(resolvidas, on='meses')[colunas]
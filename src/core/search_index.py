@@ -0,0 +1,109 @@
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Set
+
+NGRAM_SIZE = 3
+# Prefixo da chave de pacientes sem CNS, identificados pelo nome normalizado.
+NAME_KEY_PREFIX = "nome:"
+
+def normalize_text(text: str) -> str:
+    """Minúsculas, sem acentos e com espaços colapsados: 'José  da Conceição' -> 'jose da conceicao'."""
+    decomposed = unicodedata.normalize('NFKD', str(text))
+    sem_acentos = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(sem_acentos.lower().split())
+
+def patient_key(nome: str, cns: str) -> str:
+    """Chave estável do paciente para overrides e estado da tela: o CNS ou, sem ele, 'nome:' + nome normalizado."""
+    return str(cns) if cns else NAME_KEY_PREFIX + normalize_text(nome)
+
+def _ngrams(text: str) -> Set[str]:
+    return {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+class PatientSearchIndex:
+    """Índice de busca dos resultados de uma análise, montado uma vez quando os resultados chegam.
+
+    Guarda, por linha, o nome normalizado com um índice invertido de trigramas, o CNS e os baldes de
+    linhas por status e por clínica. Buscas por nome com 3+ caracteres intersectam as listas de trigramas
+    e só confirmam a substring nos candidatos; buscas curtas ou só com dígitos (CNS) varrem os textos.
+    """
+
+    def __init__(self):
+        self._texts: Dict[int, str] = {}
+        self._cns: Dict[int, str] = {}
+        self._grams: Dict[str, Set[int]] = {}
+        self._status: Dict[int, str] = {}
+        self._clinica: Dict[int, Optional[str]] = {}
+        self.status_buckets: Dict[str, Set[int]] = {}
+        self.clinic_buckets: Dict[Optional[str], Set[int]] = {}
+
+    def __len__(self):
+        return len(self._texts)
+
+    def add(self, row: int, nome: str, cns: str, status: str, clinica: Optional[str]) -> None:
+        text = normalize_text(nome)
+        self._texts[row] = text
+        self._cns[row] = str(cns)
+        grams = self._grams
+        for gram in _ngrams(text):
+            postings = grams.get(gram)
+            if postings is None:
+                grams[gram] = {row}
+            else:
+                postings.add(row)
+        self._status[row] = status
+        self.status_buckets.setdefault(status, set()).add(row)
+        self._clinica[row] = clinica
+        self.clinic_buckets.setdefault(clinica, set()).add(row)
+
+    def update_status(self, row: int, status: str) -> None:
+        anterior = self._status.get(row)
+        if anterior == status:
+            return
+        if anterior is not None:
+            self.status_buckets[anterior].discard(row)
+        self._status[row] = status
+        self.status_buckets.setdefault(status, set()).add(row)
+
+    def search(self, query: str) -> Set[int]:
+        termo = normalize_text(query)
+        if not termo:
+            return set(self._texts)
+        if termo.isdigit():
+            return {row for row, cns in self._cns.items() if termo in cns}
+        if len(termo) < NGRAM_SIZE:
+            return {row for row, text in self._texts.items() if termo in text}
+        postings: List[Set[int]] = []
+        for gram in _ngrams(termo):
+            rows = self._grams.get(gram)
+            if not rows:
+                return set()
+            postings.append(rows)
+        postings.sort(key=len)
+        candidatos = set(postings[0]).intersection(*postings[1:])
+        return {row for row in candidatos if termo in self._texts[row]}
+
+    def matches(self, row: int, query: str = "", status: Optional[str] = None, clinica: Optional[str] = None) -> bool:
+        """Confere uma única linha contra os mesmos critérios de filter(), sem montar conjuntos."""
+        if status is not None and self._status.get(row) != status:
+            return False
+        if clinica is not None and self._clinica.get(row) != clinica:
+            return False
+        termo = normalize_text(query)
+        if not termo:
+            return row in self._texts
+        if termo.isdigit():
+            return termo in self._cns.get(row, '')
+        return termo in self._texts.get(row, '')
+
+    def filter(self, query: str = "", status: Optional[str] = None, clinica: Optional[str] = None) -> Set[int]:
+        """Linhas que atendem à busca e, se informados, ao status e à clínica."""
+        baldes: List[Iterable[int]] = []
+        if status is not None:
+            baldes.append(self.status_buckets.get(status, set()))
+        if clinica is not None:
+            baldes.append(self.clinic_buckets.get(clinica, set()))
+        if query.strip():
+            baldes.append(self.search(query))
+        if not baldes:
+            return set(self._texts)
+        baldes.sort(key=len)
+        return set(baldes[0]).intersection(*baldes[1:])
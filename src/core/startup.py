@@ -0,0 +1,69 @@
+import importlib
+import logging
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Módulos pesados que a abertura do app não importa; são carregados em segundo plano depois da janela.
+HEAVY_MODULES = ("pandas", "dateutil.relativedelta", "src.core.exam_processor")
+# Raiz do projeto: o interpretador do relatório importa main e src a partir dela, de onde quer que o app seja aberto.
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+# O que a abertura importa de fato: main.py e a view exibida primeiro.
+STARTUP_MODULES = ("main", "src.views.analysis_view")
+
+def warm_up_imports(modules: Iterable[str] = HEAVY_MODULES) -> threading.Thread:
+    """Importa `modules` numa thread daemon, para que a primeira análise não pague o custo na thread da GUI."""
+    def run():
+        inicio = time.perf_counter()
+        for name in modules:
+            try:
+                importlib.import_module(name)
+            except Exception as e:
+                logger.error(f"Erro ao pré-carregar o módulo {name}: {e}")
+        logger.info(f"Pré-carregamento de módulos concluído em {(time.perf_counter() - inicio) * 1000:.0f} ms")
+    thread = threading.Thread(target=run, name="import-warmup", daemon=True)
+    thread.start()
+    return thread
+
+def _parse_importtime(stderr: str) -> List[Tuple[int, int, str]]:
+    linhas = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+            linhas.append((int(self_us), int(cumulative_us), name.rstrip()))
+        except ValueError:
+            continue
+    return linhas
+
+def import_time_report(modules: Iterable[str] = STARTUP_MODULES, top: int = 30) -> str:
+    """Relatório no estilo `python -X importtime` dos imports feitos na abertura, ordenado pelo tempo acumulado.
+
+    Roda um interpretador separado (imports já feitos neste processo não seriam medidos), então não
+    está disponível no executável empacotado.
+    """
+    if getattr(sys, 'frozen', False):
+        return "Relatório de imports indisponível no executável empacotado."
+    codigo = "; ".join(f"import {name}" for name in modules)
+    inicio = time.perf_counter()
+    resultado = subprocess.run([sys.executable, "-X", "importtime", "-c", codigo], capture_output=True, text=True, cwd=PROJECT_ROOT)
+    total_ms = (time.perf_counter() - inicio) * 1000
+    if resultado.returncode != 0:
+        return f"Falha ao medir os imports:\n{resultado.stderr[-2000:]}"
+    linhas = _parse_importtime(resultado.stderr)
+    linhas.sort(key=lambda item: item[1], reverse=True)
+    saida = [f"Imports da abertura ({', '.join(modules)}): {len(linhas)} módulos, processo medido em {total_ms:.0f} ms",
+             f"{'acumulado (ms)':>15} {'próprio (ms)':>13}  módulo"]
+    for self_us, cumulative_us, name in linhas[:top]:
+        saida.append(f"{cumulative_us / 1000:>15.1f} {self_us / 1000:>13.1f}  {name}")
+    carregados = {name.strip() for _, _, name in linhas}
+    pesados = [name for name in HEAVY_MODULES if name in carregados]
+    if pesados:
+        saida.append(f"ATENÇÃO: módulos que deveriam ser adiados foram importados na abertura: {', '.join(pesados)}")
+    return "\n".join(saida)
@@ -1,4 +1,11 @@
+import hashlib
+import logging
+import re
 from collections import namedtuple
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
 
 ColorPalette = namedtuple(
     "ColorPalette",
@@ -11,6 +18,7 @@ ColorPalette = namedtuple(
         "surface_variant",
         "text_primary",
         "text_secondary",
+        "text_disabled",
         "success",
         "warning",
         "error",
@@ -28,15 +36,55 @@ def get_light_theme() -> ColorPalette:
         surface_variant="#EAEAEA",
         text_primary="#1C1C1E",
         text_secondary="#606266",
+        text_disabled="#BDBDBD",
         success="#28A745",
         warning="#FD7E14",
         error="#DC3545",
         border="#DCDFE6",
     )
 
+def get_dark_theme() -> ColorPalette:
+    return ColorPalette(
+        primary="#8E3B5A",
+        primary_variant="#A64D6F",
+        secondary="#7A5C5B",
+        background="#121214",
+        surface="#1E1E21",
+        surface_variant="#2A2A2E",
+        text_primary="#E6E6E9",
+        text_secondary="#A0A3AB",
+        text_disabled="#5C5E66",
+        success="#3FB950",
+        warning="#F0883E",
+        error="#F85149",
+        border="#3A3A40",
+    )
+
+THEMES = {"light": get_light_theme, "dark": get_dark_theme}
+
+_PLACEHOLDER = re.compile(r"@([A-Za-z_]+)")
+
 def apply_theme_to_stylesheet(qss_template: str, theme: ColorPalette) -> str:
-    styled_qss = qss_template
-    for color_name, color_value in theme._asdict().items():
-        placeholder = f"@{color_name}"
-        styled_qss = styled_qss.replace(placeholder, color_value)
-    return styled_qss
\ No newline at end of file
+    # Uma passada só, casando o nome inteiro: '@surface_variant' não é confundido com '@surface'.
+    cores = theme._asdict()
+    return _PLACEHOLDER.sub(lambda m: cores.get(m.group(1), m.group(0)), qss_template)
+
+def compile_stylesheet(template_path: Path, theme: ColorPalette, cache_dir: Optional[Path] = None) -> str:
+    """Folha de estilos de `template_path` com as cores de `theme`, guardada em `cache_dir`.
+
+    O arquivo compilado é identificado por um hash da paleta e da data/tamanho do template, então
+    uma edição no style.qss ou na paleta gera um arquivo novo em vez de reaproveitar o antigo.
+    """
+    stat = template_path.stat()
+    chave = hashlib.sha1(repr((tuple(theme), stat.st_mtime_ns, stat.st_size)).encode("utf-8")).hexdigest()[:16]
+    cache_file = cache_dir / f"style-{chave}.qss" if cache_dir is not None else None
+    if cache_file is not None and cache_file.exists():
+        return cache_file.read_text(encoding="utf-8")
+    qss = apply_theme_to_stylesheet(template_path.read_text(encoding="utf-8"), theme)
+    if cache_file is not None:
+        try:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            cache_file.write_text(qss, encoding="utf-8")
+        except OSError as e:
+            logger.warning(f"Não foi possível gravar o cache da folha de estilos em {cache_file}: {e}")
+    return qss
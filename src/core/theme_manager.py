@@ -0,0 +1,79 @@
+import logging
+from pathlib import Path
+from typing import Dict, Optional
+from PySide6.QtCore import QObject, QSettings, Signal
+from PySide6.QtWidgets import QApplication
+from .theme import THEMES, ColorPalette, compile_stylesheet
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THEME = "light"
+SETTINGS_KEY = "aparencia/tema"
+
+class _ThemeManager(QObject):
+    """Tema atual da aplicação. Singleton, como o NotificationService.
+
+    As folhas de estilo compiladas ficam em memória por tema (e em disco via compile_stylesheet), então
+    trocar de tema em tempo de execução só aplica uma folha já pronta. Quem desenha com a paleta
+    (delegates) acompanha a troca pelo sinal theme_changed.
+    """
+    _instance = None
+    theme_changed = Signal(object)
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = _ThemeManager()
+        return cls._instance
+
+    def __init__(self):
+        super().__init__()
+        self._template_path: Optional[Path] = None
+        self._cache_dir: Optional[Path] = None
+        self._sheets: Dict[str, str] = {}
+        self.name = DEFAULT_THEME
+
+    def configure(self, template_path: Path, cache_dir: Optional[Path] = None) -> None:
+        self._template_path = template_path
+        self._cache_dir = cache_dir
+        self._sheets.clear()
+
+    @property
+    def palette(self) -> ColorPalette:
+        return THEMES[self.name]()
+
+    def saved_theme(self) -> str:
+        name = QSettings().value(SETTINGS_KEY, DEFAULT_THEME)
+        return name if name in THEMES else DEFAULT_THEME
+
+    def stylesheet(self, name: str) -> str:
+        sheet = self._sheets.get(name)
+        if sheet is not None:
+            return sheet
+        if self._template_path is None or not self._template_path.exists():
+            logger.warning(f"Folha de estilos não encontrada em: {self._template_path}. Usando estilo padrão.")
+            return ""
+        try:
+            sheet = compile_stylesheet(self._template_path, THEMES[name](), self._cache_dir)
+        except OSError as e:
+            logger.error(f"Não foi possível ler a folha de estilos {self._template_path}: {e}")
+            return ""
+        self._sheets[name] = sheet
+        return sheet
+
+    def apply(self, name: str, persist: bool = True) -> None:
+        if name not in THEMES:
+            raise ValueError(f"Tema desconhecido: {name}")
+        sheet = self.stylesheet(name)
+        app = QApplication.instance()
+        if app is not None and (sheet or app.styleSheet()):
+            app.setStyleSheet(sheet)
+        changed = name != self.name
+        self.name = name
+        if persist:
+            QSettings().setValue(SETTINGS_KEY, name)
+        if changed:
+            self.theme_changed.emit(self.palette)
+
+# Interface pública para o tema
+ThemeManager = _ThemeManager.get_instance()
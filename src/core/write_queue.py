@@ -0,0 +1,147 @@
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, List, Optional
+from PySide6.QtCore import QObject, Signal
+from . import database_manager as db
+from .notification_service import NotificationService
+
+logger = logging.getLogger(__name__)
+
+# Janela em que escritas que chegam juntas (cliques seguidos, salvamentos em sequência) entram no mesmo commit.
+COALESCE_WINDOW = 0.05
+MAX_BATCH = 64
+
+class _WriteOp:
+    __slots__ = ('func', 'args', 'kwargs', 'on_success', 'on_error', 'success_message', 'error_message')
+
+    def __init__(self, func, args, kwargs, on_success, on_error, success_message, error_message):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.on_success = on_success
+        self.on_error = on_error
+        self.success_message = success_message
+        self.error_message = error_message
+
+class _WriteQueue(QObject):
+    """Fila única de escritas no banco, consumida por uma thread dedicada. Singleton, como o NotificationService.
+
+    Operações que chegam em rajada são gravadas numa única transação; cada uma roda no seu próprio
+    SAVEPOINT, então a falha de uma não desfaz as outras. Os callbacks e as notificações de sucesso/erro
+    são entregues na thread da interface.
+    """
+    _instance = None
+
+    # Sinais internos emitidos pela thread de escrita; a conexão enfileirada os entrega na thread da GUI.
+    _op_succeeded = Signal(object, object)
+    _op_failed = Signal(object, object)
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = _WriteQueue()
+        return cls._instance
+
+    def __init__(self):
+        super().__init__()
+        self._queue: "queue.Queue[Optional[_WriteOp]]" = queue.Queue()
+        self._pending = 0
+        self._pending_lock = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._op_succeeded.connect(self._dispatch_success)
+        self._op_failed.connect(self._dispatch_error)
+
+    def submit(self, func: Callable, *args, on_success: Optional[Callable[[Any], None]] = None,
+               on_error: Optional[Callable[[Exception], None]] = None, success_message: Optional[str] = None,
+               error_message: Optional[str] = None, **kwargs) -> None:
+        """Enfileira `func(*args, **kwargs)` para execução na thread de escrita."""
+        self._ensure_started()
+        with self._pending_lock:
+            self._pending += 1
+        self._queue.put(_WriteOp(func, args, kwargs, on_success, on_error, success_message, error_message))
+
+    def wait_until_idle(self, timeout: Optional[float] = None) -> bool:
+        """Bloqueia até a fila esvaziar. Usado antes de leituras que precisam enxergar as últimas escritas."""
+        with self._pending_lock:
+            return self._pending_lock.wait_for(lambda: self._pending == 0, timeout)
+
+    def shutdown(self, timeout: float = 10.0) -> None:
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def _collect_batch(self, first: _WriteOp) -> List[Optional[_WriteOp]]:
+        batch = [first]
+        deadline = time.monotonic() + COALESCE_WINDOW
+        while len(batch) < MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            try:
+                op = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(op)
+            if op is None:
+                break
+        return batch
+
+    def _run(self) -> None:
+        try:
+            while True:
+                first = self._queue.get()
+                if first is None:
+                    return
+                batch = self._collect_batch(first)
+                stop = batch[-1] is None
+                ops = [op for op in batch if op is not None]
+                self._execute_batch(ops)
+                with self._pending_lock:
+                    self._pending -= len(ops)
+                    self._pending_lock.notify_all()
+                if stop:
+                    return
+        finally:
+            db.close_thread_connection()
+
+    def _execute_batch(self, ops: List[_WriteOp]) -> None:
+        outcomes = []
+        try:
+            with db.transaction():
+                for op in ops:
+                    try:
+                        with db.transaction():
+                            outcomes.append((op, True, op.func(*op.args, **op.kwargs)))
+                    except Exception as e:
+                        logger.error(f"Erro na escrita em segundo plano ({getattr(op.func, '__name__', op.func)}): {e}")
+                        outcomes.append((op, False, e))
+        except Exception as e:
+            # Falha no BEGIN/COMMIT: nada do lote foi gravado.
+            logger.error(f"Erro ao gravar lote de {len(ops)} escrita(s): {e}")
+            outcomes = [(op, False, e) for op in ops]
+        if len(ops) > 1:
+            logger.debug(f"Lote de {len(ops)} escritas gravado em uma transação.")
+        for op, ok, value in outcomes:
+            (self._op_succeeded if ok else self._op_failed).emit(op, value)
+
+    def _dispatch_success(self, op: _WriteOp, result: Any) -> None:
+        if op.success_message:
+            NotificationService.show(op.success_message)
+        if op.on_success is not None:
+            op.on_success(result)
+
+    def _dispatch_error(self, op: _WriteOp, error: Exception) -> None:
+        NotificationService.show(f"{op.error_message or 'Não foi possível gravar as alterações'}: {error}", 'error')
+        if op.on_error is not None:
+            op.on_error(error)
+
+# Interface pública para a fila
+WriteQueue = _WriteQueue.get_instance()
@@ -1,26 +1,27 @@
 import sys
+import logging
+import time
+from importlib import import_module
 from pathlib import Path
-from PySide6.QtCore import QSize, Qt
+from PySide6.QtCore import QSettings, QSize, Qt
 from PySide6.QtGui import QIcon, QPixmap
 from PySide6.QtWidgets import (
     QApplication,
+    QCheckBox,
     QFrame,
     QHBoxLayout,
     QLabel,
     QMainWindow,
     QListWidget,
     QListWidgetItem,
+    QPushButton,
     QVBoxLayout,
     QWidget,
 )
 from src.core.notification_service import NotificationService
+from src.core.theme_manager import ThemeManager
 from src.views.components.notification_banner import NotificationBanner
 from src.views.components.animated_stacked_widget import AnimatedStackedWidget
-from src.views.analysis_view import AnalysisView
-from src.views.rotinas_view import RotinasView
-from src.views.exames_view import ExamesView
-from src.views.clinicas_view import ClinicasView
-from src.views.perfis_view import PerfisView
 
 def resource_path(relative_path: str) -> Path:
     try:
@@ -31,6 +32,24 @@ def resource_path(relative_path: str) -> Path:
 
 ICONS_DIR = resource_path("src/resources/images")
 
+# Views do menu lateral: (texto, ícone, módulo, classe). O módulo só é importado e a view só é criada
+# na primeira vez que o item é selecionado.
+VIEW_REGISTRY = [
+    ("Análise", "analysis_icon.svg", "src.views.analysis_view", "AnalysisView"),
+    ("Rotinas", "rotinas_icon.svg", "src.views.rotinas_view", "RotinasView"),
+    ("Exames", "exames_icon.svg", "src.views.exames_view", "ExamesView"),
+    ("Clínicas", "clinicas_icon.svg", "src.views.clinicas_view", "ClinicasView"),
+    ("Perfis", "perfis_icon.svg", "src.views.perfis_view", "PerfisView"),
+]
+
+# Sinais entre views: (view de origem, sinal, view de destino, slot). Conectados quando as duas existem;
+# uma view criada depois já carrega os dados atuais, então não perde nada.
+VIEW_CONNECTIONS = [
+    ("Exames", "exames_changed", "Rotinas", "refresh_data"),
+]
+
+REDUCE_MOTION_KEY = "aparencia/reduzir_movimento"
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -38,6 +57,7 @@ class MainWindow(QMainWindow):
         self.setMinimumSize(1200, 768)
         self.setWindowIcon(QIcon(str(ICONS_DIR / "app_icon.png")))
         self.stacked_widget = AnimatedStackedWidget()
+        self.stacked_widget.reduce_motion = QSettings().value(REDUCE_MOTION_KEY, False, type=bool)
         self.view_map = {}
         self._setup_ui()
         self._setup_notifications()
@@ -66,16 +86,23 @@ class MainWindow(QMainWindow):
 
     def _create_content_area(self):
         self.stacked_widget.setObjectName("contentArea")
-        self.view_map = {
-            "Análise": AnalysisView(),
-            "Rotinas": RotinasView(),
-            "Exames": ExamesView(),
-            "Clínicas": ClinicasView(),
-            "Perfis": PerfisView(),
-        }
-        for view in self.view_map.values():
-            self.stacked_widget.addWidget(view)
-        self.view_map["Exames"].exames_changed.connect(self.view_map["Rotinas"].refresh_data)
+        self.view_factories = {text: (module, class_name) for text, _, module, class_name in VIEW_REGISTRY}
+
+    def get_view(self, name: str) -> QWidget:
+        """Devolve a view `name`, criando-a (e ligando seus sinais com as views já existentes) no primeiro acesso."""
+        view = self.view_map.get(name)
+        if view is not None:
+            return view
+        inicio = time.perf_counter()
+        module_name, class_name = self.view_factories[name]
+        view = getattr(import_module(module_name), class_name)()
+        self.view_map[name] = view
+        self.stacked_widget.addWidget(view)
+        for origem, sinal, destino, slot in VIEW_CONNECTIONS:
+            if name in (origem, destino) and origem in self.view_map and destino in self.view_map:
+                getattr(self.view_map[origem], sinal).connect(getattr(self.view_map[destino], slot))
+        logging.info(f"View '{name}' criada em {(time.perf_counter() - inicio) * 1000:.0f} ms")
+        return view
 
     def _create_nav_panel(self) -> QFrame:
         nav_panel = QFrame()
@@ -98,29 +125,44 @@ class MainWindow(QMainWindow):
         self.nav_list = QListWidget()
         self.nav_list.setObjectName("navlist")
         self.nav_list.setIconSize(QSize(22, 22))
-        nav_items_data = [
-            {"text": "Análise", "icon": "analysis_icon.svg", "view": self.view_map["Análise"]},
-            {"text": "Rotinas", "icon": "rotinas_icon.svg", "view": self.view_map["Rotinas"]},
-            {"text": "Exames", "icon": "exames_icon.svg", "view": self.view_map["Exames"]},
-            {"text": "Clínicas", "icon": "clinicas_icon.svg", "view": self.view_map["Clínicas"]},
-            {"text": "Perfis", "icon": "perfis_icon.svg", "view": self.view_map["Perfis"]},
-        ]
-        for item_data in nav_items_data:
-            icon_path = ICONS_DIR / item_data["icon"]
+        for text, icon_name, _, _ in VIEW_REGISTRY:
+            icon_path = ICONS_DIR / icon_name
             icon = QIcon(str(icon_path)) if icon_path.exists() else QIcon()
-            list_item = QListWidgetItem(icon, item_data["text"])
-            list_item.setData(Qt.ItemDataRole.UserRole, item_data["view"])
+            list_item = QListWidgetItem(icon, text)
+            list_item.setData(Qt.ItemDataRole.UserRole, text)
             self.nav_list.addItem(list_item)
         self.nav_list.currentItemChanged.connect(self.on_nav_item_changed)
         nav_layout.addWidget(self.nav_list)
         nav_layout.addStretch()
+        self.theme_btn = QPushButton("Tema Escuro")
+        self.theme_btn.setObjectName("themeButton")
+        self.theme_btn.setCheckable(True)
+        self.theme_btn.setChecked(ThemeManager.name == "dark")
+        self.theme_btn.toggled.connect(self.on_theme_toggled)
+        self.reduce_motion_check = QCheckBox("Reduzir animações")
+        self.reduce_motion_check.setChecked(self.stacked_widget.reduce_motion)
+        self.reduce_motion_check.toggled.connect(self.on_reduce_motion_toggled)
+        theme_layout = QVBoxLayout()
+        theme_layout.setContentsMargins(20, 0, 20, 0)
+        theme_layout.addWidget(self.reduce_motion_check)
+        theme_layout.addWidget(self.theme_btn)
+        nav_layout.addLayout(theme_layout)
         self.nav_list.setCurrentRow(0)
         return nav_panel
 
+    def on_theme_toggled(self, dark: bool):
+        inicio = time.perf_counter()
+        ThemeManager.apply("dark" if dark else "light")
+        logging.info(f"Tema '{ThemeManager.name}' aplicado em {(time.perf_counter() - inicio) * 1000:.0f} ms")
+
+    def on_reduce_motion_toggled(self, checked: bool):
+        self.stacked_widget.reduce_motion = checked
+        QSettings().setValue(REDUCE_MOTION_KEY, checked)
+
     def on_nav_item_changed(self, current_item: QListWidgetItem, previous_item: QListWidgetItem):
         if current_item:
-            view_widget = current_item.data(Qt.ItemDataRole.UserRole)
-            if view_widget:
-                index = self.stacked_widget.indexOf(view_widget)
+            view_name = current_item.data(Qt.ItemDataRole.UserRole)
+            if view_name:
+                index = self.stacked_widget.indexOf(self.get_view(view_name))
                 if index != -1:
                     self.stacked_widget.setCurrentIndex(index)
\ No newline at end of file
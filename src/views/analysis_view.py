@@ -1,125 +1,485 @@
 import logging
-import pandas as pd
 from datetime import datetime
-from dateutil.relativedelta import relativedelta
 from functools import partial
 from pathlib import Path
-from PySide6.QtCore import Qt, QThread, QObject, Signal
+from PySide6.QtCore import Qt, QThread, QObject, Signal, QTimer
 from PySide6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QGridLayout, QLabel, QPushButton,
-    QComboBox, QFileDialog, QScrollArea, QFrame, QLineEdit,
-    QMessageBox
+    QComboBox, QFileDialog, QListView, QAbstractItemView, QFrame, QLineEdit,
+    QMessageBox, QDialog, QDialogButtonBox, QTableWidget, QTableWidgetItem, QHeaderView, QProgressBar, QCheckBox, QSpinBox,
+    QListWidget, QListWidgetItem
 )
 from src.core import database_manager as db
-from src.core import exam_processor
+from src.core import result_exporter
+from src.core.cancellation import AnalysisCancelled, CancellationToken
+from src.core.notification_service import NotificationService
+from src.core.search_index import patient_key
+from src.core.theme_manager import ThemeManager
+from src.core.write_queue import WriteQueue
 from src.views.components.loading_overlay import LoadingOverlay
+from src.views.delegates import PatientCardDelegate
+from src.views.result_models import PatientResultsModel, PatientResultsFilterProxy
+
+SEARCH_DEBOUNCE_MS = 250
+# Quanto o worker espera a fila de escrita esvaziar antes de ler overrides e configuração.
+WRITE_QUEUE_DRAIN_TIMEOUT_S = 30
+
+def _load_analysis_inputs(period, rotina_nomes):
+    """Overrides do período, períodos, fusões de CNS e detalhes das rotinas, lidos na thread do worker.
+
+    Overrides e configuração salvos há pouco podem ainda estar na fila de escrita: a leitura só acontece
+    depois que ela esvazia, e a análise falha (em vez de usar dados antigos) se isso não ocorrer a tempo.
+    """
+    if not WriteQueue.wait_until_idle(timeout=WRITE_QUEUE_DRAIN_TIMEOUT_S):
+        raise TimeoutError("as gravações pendentes no banco não terminaram a tempo; tente novamente")
+    rotinas = {nome: db.get_rotina_details(nome) for nome in rotina_nomes if nome}
+    return db.get_overrides_for_period(period), db.get_periodos(), db.get_patient_merges(), rotinas
 
 class Worker(QObject):
-    finished = Signal(object, int, int, object)
+    batch_ready = Signal(object, int, int)
+    finished = Signal(int, int)
     error = Signal(str)
-    def __init__(self, df_exames, data_ref, rotina, df_mov, df_internacoes, overrides):
+    progress = Signal(str, int)
+    cancelled = Signal()
+    def __init__(self, df_exames, data_ref, rotina_nome, clinicas, df_mov, df_internacoes, period):
         super().__init__()
         self.df_exames = df_exames
         self.data_ref = data_ref
-        self.rotina = rotina
+        self.rotina_nome = rotina_nome
+        self.clinicas = clinicas
         self.df_mov = df_mov
         self.df_internacoes = df_internacoes
-        self.overrides = overrides
+        self.period = period
+        self.cancel_token = CancellationToken()
+    def cancel(self):
+        # Chamado da thread da GUI; o processamento para no próximo ponto de verificação.
+        self.cancel_token.cancel()
     def run(self):
         try:
-            total_pacientes = self.df_exames.groupby(['Nome', 'CNS']).ngroups
-            resultados, num_ativos = exam_processor.processar_dados_exames(
-                self.df_exames, self.data_ref, self.rotina, self.df_mov, self.df_internacoes, self.overrides
-            )
-            self.finished.emit(resultados, num_ativos, total_pacientes, None)
+            # Import adiado: o pandas só é carregado quando uma análise roda (ou pelo pré-carregamento em main.py).
+            from src.core import exam_processor
+            overrides, periodos, fusoes_cns, rotinas = _load_analysis_inputs(self.period, [self.rotina_nome])
+            num_ativos, total_pacientes = 0, 0
+            # Cada lote vai para a tela assim que fica pronto; os resultados completos ficam só na view.
+            for lote, num_ativos, total_pacientes in exam_processor.iterar_resultados_em_lotes(
+                self.df_exames, self.data_ref, rotinas.get(self.rotina_nome, {}), self.df_mov, self.df_internacoes, overrides,
+                progress_callback=self.progress.emit, cancel_token=self.cancel_token, periodos=periodos,
+                fusoes_cns=fusoes_cns, clinicas=self.clinicas
+            ):
+                self.batch_ready.emit(lote, num_ativos, total_pacientes)
+            self.finished.emit(num_ativos, total_pacientes)
+        except AnalysisCancelled:
+            logging.info("Análise cancelada.")
+            self.cancelled.emit()
         except Exception as e:
             logging.error("Erro detalhado no worker:", exc_info=True)
             self.error.emit(f"Erro no processamento: {e}")
+        finally:
+            db.close_thread_connection()
+
+class AllProfilesWorker(QObject):
+    finished = Signal(object)
+    error = Signal(str)
+    progress = Signal(str, int)
+    cancelled = Signal()
+    def __init__(self, df_exames, data_ref, perfis, df_mov, df_internacoes, period):
+        super().__init__()
+        self.df_exames = df_exames
+        self.data_ref = data_ref
+        self.perfis = perfis
+        self.df_mov = df_mov
+        self.df_internacoes = df_internacoes
+        self.period = period
+        self.cancel_token = CancellationToken()
+    def cancel(self):
+        self.cancel_token.cancel()
+    def run(self):
+        try:
+            from src.core import exam_processor
+            # Cada rotina é carregada (e depois avaliada) uma vez, por mais perfis que a usem.
+            overrides, periodos, fusoes_cns, rotinas = _load_analysis_inputs(
+                self.period, {p.get('rotina') for p in self.perfis.values()})
+            saida = exam_processor.processar_perfis(
+                self.df_exames, self.data_ref, self.perfis, rotinas, self.df_mov, self.df_internacoes, overrides,
+                progress_callback=self.progress.emit, cancel_token=self.cancel_token, periodos=periodos, fusoes_cns=fusoes_cns
+            )
+            self.finished.emit(saida)
+        except AnalysisCancelled:
+            logging.info("Análise de todos os perfis cancelada.")
+            self.cancelled.emit()
+        except Exception as e:
+            logging.error("Erro detalhado na análise de todos os perfis:", exc_info=True)
+            self.error.emit(f"Erro no processamento: {e}")
+        finally:
+            db.close_thread_connection()
+
+class ExportWorker(QObject):
+    finished = Signal(object)
+    error = Signal(str)
+    progress = Signal(int)
+    cancelled = Signal()
+    def __init__(self, items, path, fmt, split_by_clinic):
+        super().__init__()
+        self.items = items
+        self.path = path
+        self.fmt = fmt
+        self.split_by_clinic = split_by_clinic
+        self.cancel_token = CancellationToken()
+    def cancel(self):
+        self.cancel_token.cancel()
+    def run(self):
+        try:
+            arquivos = result_exporter.export_results(self.items, self.path, self.fmt, self.split_by_clinic, total=len(self.items),
+                                                      progress_callback=self.progress.emit, cancel_token=self.cancel_token)
+            self.finished.emit(arquivos)
+        except AnalysisCancelled:
+            logging.info("Exportação cancelada.")
+            self.cancelled.emit()
+        except Exception as e:
+            logging.error("Erro detalhado na exportação:", exc_info=True)
+            self.error.emit(f"Erro na exportação: {e}")
+
+class PlannerWorker(QObject):
+    finished = Signal(object)
+    error = Signal(str)
+    cancelled = Signal()
+    def __init__(self, df_exames, data_ref, rotina, df_mov, periodos, fusoes_cns, meses_a_frente):
+        super().__init__()
+        # Cópias: o preparo anota os DataFrames in place e o diálogo recalcula com os mesmos dados.
+        self.df_exames = df_exames.copy()
+        self.df_mov = df_mov.copy() if df_mov is not None else None
+        self.data_ref = data_ref
+        self.rotina = rotina
+        self.periodos = periodos
+        self.fusoes_cns = fusoes_cns
+        self.meses_a_frente = meses_a_frente
+        self.cancel_token = CancellationToken()
+    def cancel(self):
+        self.cancel_token.cancel()
+    def run(self):
+        try:
+            from src.core import collection_planner
+            plano = collection_planner.planejar_coletas(self.df_exames, self.data_ref, self.rotina, self.meses_a_frente, self.df_mov,
+                                                        periodos=self.periodos, fusoes_cns=self.fusoes_cns, cancel_token=self.cancel_token)
+            self.finished.emit(plano)
+        except AnalysisCancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            logging.error("Erro detalhado no planejamento de coletas:", exc_info=True)
+            self.error.emit(f"Erro no planejamento: {e}")
+
+class CollectionPlanDialog(QDialog):
+    """Coletas previstas nos próximos meses: totais por exame x mês e agenda por paciente para exportar."""
+    ALL_CLINICS = "Todas as clínicas"
+
+    def __init__(self, perfil, df_exames, data_ref, rotina, df_mov, periodos, fusoes_cns, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(f"Planejamento de Coletas - {perfil}")
+        self.resize(900, 560)
+        self._inputs = (df_exames, data_ref, rotina, df_mov, periodos, fusoes_cns)
+        self.perfil = perfil
+        self.plano = None
+        self.thread, self.worker = None, None
+        layout = QVBoxLayout(self)
+        controls_layout = QHBoxLayout()
+        self.months_spin = QSpinBox(minimum=1, maximum=24, value=6)
+        self.clinic_combo = QComboBox()
+        self.calc_btn = QPushButton("Calcular")
+        self.export_btn = QPushButton("Exportar Agenda")
+        self.export_btn.setEnabled(False)
+        controls_layout.addWidget(QLabel("<b>Meses à frente:</b>"))
+        controls_layout.addWidget(self.months_spin)
+        controls_layout.addWidget(QLabel("<b>Clínica:</b>"))
+        controls_layout.addWidget(self.clinic_combo, 1)
+        controls_layout.addWidget(self.calc_btn)
+        controls_layout.addWidget(self.export_btn)
+        self.status_label = QLabel("")
+        self.table = QTableWidget(0, 0)
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table.verticalHeader().setVisible(False)
+        layout.addLayout(controls_layout)
+        layout.addWidget(self.status_label)
+        layout.addWidget(self.table, 1)
+        self.calc_btn.clicked.connect(self._calculate)
+        self.export_btn.clicked.connect(self._export_agenda)
+        self.clinic_combo.currentTextChanged.connect(self._show_totals)
+        self._calculate()
+
+    def _calculate(self):
+        if self.worker is not None:
+            return
+        self.calc_btn.setEnabled(False)
+        self.export_btn.setEnabled(False)
+        self.status_label.setText("Calculando...")
+        thread = QThread()
+        worker = PlannerWorker(*self._inputs, self.months_spin.value())
+        worker.moveToThread(thread)
+        thread.started.connect(worker.run)
+        worker.finished.connect(self._on_plan_ready)
+        worker.error.connect(self._on_plan_error)
+        for signal in (worker.finished, worker.error, worker.cancelled):
+            signal.connect(thread.quit)
+        thread.finished.connect(worker.deleteLater)
+        thread.finished.connect(self._on_thread_finished)
+        thread.finished.connect(thread.deleteLater)
+        self.thread, self.worker = thread, worker
+        thread.start()
+
+    def _on_thread_finished(self):
+        self.thread, self.worker = None, None
+        self.calc_btn.setEnabled(True)
+
+    def _on_plan_ready(self, plano):
+        self.plano = plano
+        clinicas = sorted(plano.agenda['Clínica'].unique())
+        atual = self.clinic_combo.currentText()
+        self.clinic_combo.blockSignals(True)
+        self.clinic_combo.clear()
+        self.clinic_combo.addItems([self.ALL_CLINICS] + clinicas)
+        self.clinic_combo.setCurrentText(atual if atual in clinicas else self.ALL_CLINICS)
+        self.clinic_combo.blockSignals(False)
+        self.export_btn.setEnabled(not plano.agenda.empty)
+        self._show_totals()
+
+    def _on_plan_error(self, error_msg):
+        self.status_label.setText("")
+        QMessageBox.critical(self, "Erro no Planejamento", error_msg)
+
+    def _show_totals(self):
+        if self.plano is None:
+            return
+        totais, agenda, meses = self.plano.totais, self.plano.agenda, self.plano.meses
+        clinica = self.clinic_combo.currentText()
+        if clinica and clinica != self.ALL_CLINICS:
+            totais, agenda = totais[totais['Clínica'] == clinica], agenda[agenda['Clínica'] == clinica]
+        tabela = (totais.pivot_table(index=['Exame', 'Tipo'], columns='Mês', values='Quantidade', aggfunc='sum', fill_value=0)
+                  .reindex(columns=meses, fill_value=0))
+        headers = ["Exame", "Tipo"] + [datetime.strptime(m, '%Y-%m').strftime('%b/%Y') for m in meses] + ["Total"]
+        self.table.clear()
+        self.table.setColumnCount(len(headers))
+        self.table.setHorizontalHeaderLabels(headers)
+        self.table.setRowCount(len(tabela) + 1 if len(tabela) else 0)
+        for r, ((exame, tipo), valores) in enumerate(tabela.iterrows()):
+            for c, texto in enumerate([exame, tipo] + [str(int(v)) for v in valores] + [str(int(valores.sum()))]):
+                self.table.setItem(r, c, QTableWidgetItem(texto))
+        if len(tabela):
+            soma = tabela.sum()
+            for c, texto in enumerate(["Total", ""] + [str(int(v)) for v in soma] + [str(int(soma.sum()))]):
+                self.table.setItem(len(tabela), c, QTableWidgetItem(texto))
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.ResizeToContents)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        pacientes = agenda['CNS'].where(agenda['CNS'] != "", agenda['Paciente']).nunique()
+        self.status_label.setText(f"{len(agenda)} coleta(s) prevista(s) para {pacientes} paciente(s) em {len(meses)} mês(es).")
+
+    def _export_agenda(self):
+        from src.core import collection_planner
+        agenda = self.plano.agenda
+        clinica = self.clinic_combo.currentText()
+        if clinica and clinica != self.ALL_CLINICS:
+            agenda = agenda[agenda['Clínica'] == clinica]
+        filtros = "Planilha CSV (*.csv)"
+        if result_exporter.xlsx_available():
+            filtros += ";;Planilha Excel (*.xlsx)"
+        sugestao = f"agenda_coletas_{self.perfil}_{self.plano.meses[0]}_{self.plano.meses[-1]}.csv"
+        filepath, filtro = QFileDialog.getSaveFileName(self, "Exportar Agenda", sugestao, filtros)
+        if not filepath:
+            return
+        path = Path(filepath)
+        fmt = result_exporter.FORMAT_XLSX if "xlsx" in filtro or path.suffix.lower() == ".xlsx" else result_exporter.FORMAT_CSV
+        path = path.with_suffix(f".{fmt}")
+        try:
+            result_exporter.export_table(agenda.itertuples(index=False, name=None), path, fmt,
+                                         collection_planner.AGENDA_COLUMNS, "Agenda")
+        except Exception as e:
+            logging.error("Erro detalhado na exportação da agenda:", exc_info=True)
+            QMessageBox.critical(self, "Erro de Exportação", f"Erro na exportação: {e}")
+            return
+        NotificationService.show(f"Agenda exportada para {path}.")
+
+    def closeEvent(self, event):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.thread.quit()
+            self.thread.wait()
+        super().closeEvent(event)
+
+class TrendDialog(QDialog):
+    COLUMNS = [("Período", 'periodo'), ("Ativos", 'ativos'), ("Pendentes", 'pendentes'), ("Internados", 'internados'),
+               ("Pend. Coleta", 'pendencia_coleta'), ("Exames Obrig. Pendentes", 'exames_obrigatorios_pendentes')]
 
-class CollapsibleSection(QWidget):
-    def __init__(self, title="", parent=None):
+    def __init__(self, perfil, ano, rows, parent=None):
         super().__init__(parent)
-        self.toggle_button = QPushButton(title)
-        self.toggle_button.setCheckable(True)
-        self.content_area = QFrame()
-        self.content_layout = QVBoxLayout(self.content_area)
-        self.content_layout.setContentsMargins(10, 5, 5, 5)
-        self.content_layout.setSpacing(8)
-        self.main_layout = QVBoxLayout(self)
-        self.main_layout.setSpacing(5)
-        self.main_layout.setContentsMargins(0, 0, 0, 0)
-        self.main_layout.addWidget(self.toggle_button)
-        self.main_layout.addWidget(self.content_area)
-        self.toggle_button.toggled.connect(self.toggle)
-        self.toggle(False)
-    def toggle(self, checked):
-        self.content_area.setVisible(checked)
-        icon = "▼" if checked else "►"
-        base_text = self.toggle_button.text().strip('►▼ ')
-        self.toggle_button.setText(f"{icon} {base_text}")
-    def add_widget(self, widget):
-        self.content_layout.addWidget(widget)
-
-class PatientResultWidget(QFrame):
-    request_refresh = Signal()
-    def __init__(self, patient_tuple, info, analysis_period, parent=None):
+        self.setWindowTitle(f"Tendência de Pendências - {perfil} ({ano})")
+        self.resize(720, 420)
+        layout = QVBoxLayout(self)
+        table = QTableWidget(len(rows), len(self.COLUMNS))
+        table.setHorizontalHeaderLabels([title for title, _ in self.COLUMNS])
+        table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        table.verticalHeader().setVisible(False)
+        for r, row in enumerate(rows):
+            for c, (_, key) in enumerate(self.COLUMNS):
+                table.setItem(r, c, QTableWidgetItem(str(row.get(key) or 0)))
+        if not rows:
+            layout.addWidget(QLabel("Nenhuma análise salva para este perfil no ano selecionado."))
+        layout.addWidget(table)
+
+class NetworkSummaryDialog(QDialog):
+    """Resumo da análise de todos os perfis: uma linha por perfil/clínica e o total da rede (pacientes distintos)."""
+    COLUMNS = [("Perfil", 'perfil'), ("Clínica", 'clinica'), ("Ativos", 'ativos'), ("Em Dia", 'em_dia'), ("Pendentes", 'pendentes'),
+               ("Internados", 'internados'), ("Pend. Coleta", 'pendencia_coleta'), ("Exames Obrig. Pendentes", 'exames_obrigatorios_pendentes')]
+    profile_selected = Signal(str)
+
+    def __init__(self, periodo, rows, perfis, parent=None):
         super().__init__(parent)
-        self.patient_cns = patient_tuple[1]
-        self.analysis_period = analysis_period
-        status = info.get('status', 'N/A')
-        self.setObjectName(f"PatientCard-{status.replace(' ', '-').replace('?', '')}")
-        main_layout = QVBoxLayout(self)
-        main_layout.setContentsMargins(0, 0, 0, 0)
-        main_layout.setSpacing(0)
-        header_frame = QFrame(objectName="CardHeader")
-        header_layout = QHBoxLayout(header_frame)
-        status_map = {'Em dia': '✔', 'Pendente': '⚠️', 'Pendência de Coleta': '❓', 'Internado': '🏥'}
-        icon_label = QLabel(status_map.get(status, '●'), objectName="CardIcon")
-        nome, cns = patient_tuple
-        patient_name_label = QLabel(f'{nome}<br><span style="font-size: 9pt; font-weight: 500;">CNS: {cns}</span>')
-        status_label = QLabel(status.upper(), objectName="PatientStatusLabel")
-        header_layout.addWidget(icon_label)
-        header_layout.addWidget(patient_name_label, 1)
-        header_layout.addWidget(status_label)
-        body_frame = QFrame(objectName="CardBody")
-        body_layout = QVBoxLayout(body_frame)
-        body_layout.setSpacing(10)
-        if summary_text := info.get('exames_faltantes', ''):
-            body_layout.addWidget(QLabel(summary_text, objectName="SummaryLabel"))
-        if motivo_internacao := info.get('motivo_internacao'):
-            body_layout.addWidget(QLabel(f"<b>Motivo da Internação:</b> {motivo_internacao}"))
-        if obrigatorios := info.get('detalhes_obrigatorios', []):
-            section = CollapsibleSection(f"Exames Obrigatórios Pendentes ({len(obrigatorios)})")
-            for exame in obrigatorios:
-                exame_layout = QHBoxLayout()
-                label = QLabel(f"<b>{exame['exame']}</b> (Freq: {exame['frequencia']})<br><small>Último: {exame['ultimo_realizado']} | Próximo: {exame['proxima_data']}</small>")
-                # CORREÇÃO AQUI
-                ok_button = QPushButton("OK", objectName="okButton")
-                ok_button.setFixedSize(45, 26)
-                ok_button.clicked.connect(partial(self.mark_as_ok, exame['exame']))
-                exame_layout.addWidget(label, 1)
-                exame_layout.addWidget(ok_button)
-                container = QWidget()
-                container.setLayout(exame_layout)
-                section.add_widget(container)
-            body_layout.addWidget(section)
-        if resolvidos := info.get('detalhes_resolvidos', []):
-            section = CollapsibleSection(f"Exames Resolvidos Manualmente ({len(resolvidos)})")
-            for item in resolvidos:
-                section.add_widget(QLabel(f"• <b>{item['exame']}</b>: {item['status']}"))
-            body_layout.addWidget(section)
-        main_layout.addWidget(header_frame)
-        main_layout.addWidget(body_frame)
-    def mark_as_ok(self, exame_nome):
-        db.add_override(self.patient_cns, exame_nome, self.analysis_period)
-        self.request_refresh.emit()
+        self.setWindowTitle(f"Resumo da Rede - {periodo}")
+        self.resize(860, 460)
+        layout = QVBoxLayout(self)
+        layout.addWidget(QLabel("Clique duas vezes em uma linha para abrir os resultados do perfil."))
+        self.table = QTableWidget(len(rows), len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels([title for title, _ in self.COLUMNS])
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        for r, row in enumerate(rows):
+            for c, (_, key) in enumerate(self.COLUMNS):
+                self.table.setItem(r, c, QTableWidgetItem(str(row.get(key) if row.get(key) is not None else "")))
+        layout.addWidget(self.table)
+        self._perfis = set(perfis)
+        self.table.cellDoubleClicked.connect(self._on_row_activated)
+
+    def _on_row_activated(self, row, _column):
+        perfil = self.table.item(row, 0).text()
+        if perfil in self._perfis:
+            self.profile_selected.emit(perfil)
+            self.accept()
+
+class ProfileSelectionDialog(QDialog):
+    """Escolha dos perfis incluídos na análise de todos os perfis."""
+
+    def __init__(self, perfis, selecionados, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Analisar Perfis")
+        self.resize(360, 420)
+        layout = QVBoxLayout(self)
+        layout.addWidget(QLabel("Marque os perfis a analisar. Cada rotina é avaliada uma vez, mesmo que vários perfis a usem."))
+        self.list = QListWidget()
+        for perfil in perfis:
+            item = QListWidgetItem(perfil)
+            item.setFlags(item.flags() | Qt.ItemFlag.ItemIsUserCheckable)
+            item.setCheckState(Qt.CheckState.Checked if perfil in selecionados else Qt.CheckState.Unchecked)
+            self.list.addItem(item)
+        layout.addWidget(self.list)
+        toggle_layout = QHBoxLayout()
+        all_btn = QPushButton("Marcar Todos")
+        none_btn = QPushButton("Desmarcar Todos")
+        toggle_layout.addWidget(all_btn)
+        toggle_layout.addWidget(none_btn)
+        toggle_layout.addStretch()
+        layout.addLayout(toggle_layout)
+        button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
+        layout.addWidget(button_box)
+        all_btn.clicked.connect(lambda: self._set_all(Qt.CheckState.Checked))
+        none_btn.clicked.connect(lambda: self._set_all(Qt.CheckState.Unchecked))
+        button_box.accepted.connect(self._validate_and_accept)
+        button_box.rejected.connect(self.reject)
+
+    def _set_all(self, state):
+        for row in range(self.list.count()):
+            self.list.item(row).setCheckState(state)
+
+    def selected_profiles(self):
+        return [self.list.item(row).text() for row in range(self.list.count())
+                if self.list.item(row).checkState() == Qt.CheckState.Checked]
+
+    def _validate_and_accept(self):
+        if not self.selected_profiles():
+            QMessageBox.warning(self, "Analisar Perfis", "Marque ao menos um perfil.")
+            return
+        self.accept()
+
+class PatientMergesDialog(QDialog):
+    """Fusões de pacientes duplicados: os exames do CNS duplicado passam a contar para o CNS canônico."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Pacientes Duplicados")
+        self.resize(560, 380)
+        layout = QVBoxLayout(self)
+        layout.addWidget(QLabel("Grafias diferentes do nome com o mesmo CNS já são unificadas na análise. "
+                                "Cadastre aqui o mesmo paciente registrado com CNS diferentes."))
+        self.table = QTableWidget(0, 2)
+        self.table.setHorizontalHeaderLabels(["CNS duplicado", "CNS canônico"])
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        form_layout = QHBoxLayout()
+        self.cns_input = QLineEdit(placeholderText="CNS duplicado")
+        self.canonical_input = QLineEdit(placeholderText="CNS canônico")
+        add_btn = QPushButton("Fundir")
+        remove_btn = QPushButton("Desfazer Selecionada", objectName="removeButton")
+        form_layout.addWidget(self.cns_input)
+        form_layout.addWidget(self.canonical_input)
+        form_layout.addWidget(add_btn)
+        layout.addWidget(self.table)
+        layout.addLayout(form_layout)
+        layout.addWidget(remove_btn, alignment=Qt.AlignmentFlag.AlignRight)
+        add_btn.clicked.connect(self._add_merge)
+        remove_btn.clicked.connect(self._remove_merge)
+        self._load_merges()
+
+    def _load_merges(self):
+        merges = db.get_patient_merges()
+        self.table.setRowCount(len(merges))
+        for row, (cns, canonical) in enumerate(merges.items()):
+            self.table.setItem(row, 0, QTableWidgetItem(cns))
+            self.table.setItem(row, 1, QTableWidgetItem(canonical))
+
+    @staticmethod
+    def _normalize_cns(text):
+        # Mesma normalização do índice de pacientes (só dígitos, 15 posições), sem carregar o pandas.
+        digits = ''.join(c for c in text if c.isdigit())
+        return digits.zfill(15) if digits else ""
+
+    def _add_merge(self):
+        cns, canonical = self._normalize_cns(self.cns_input.text()), self._normalize_cns(self.canonical_input.text())
+        if not cns or not canonical or cns == canonical:
+            QMessageBox.warning(self, "Atenção", "Informe dois CNS diferentes.")
+            return
+        self.cns_input.clear()
+        self.canonical_input.clear()
+        WriteQueue.submit(db.save_patient_merge, cns, canonical,
+                          on_success=lambda _: self._load_merges(),
+                          success_message="Pacientes fundidos; a próxima análise já os considera como um só.",
+                          error_message="Não foi possível salvar a fusão")
+
+    def _remove_merge(self):
+        row = self.table.currentRow()
+        if row < 0:
+            return
+        WriteQueue.submit(db.remove_patient_merge, self.table.item(row, 0).text(),
+                          on_success=lambda _: self._load_merges(),
+                          error_message="Não foi possível desfazer a fusão")
 
 class AnalysisView(QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.df_exames, self.df_mov, self.df_internacoes = None, pd.DataFrame(), pd.DataFrame()
+        self.df_exames, self.df_mov, self.df_internacoes = None, None, None
         self.analysis_results = None
+        self.analysis_profile = None
+        self.analysis_period = None
+        self.analysis_counts = (0, 0)
         self.thread, self.worker = None, None
+        # Resultados da última análise de todos os perfis, para abrir um perfil a partir do resumo.
+        self.all_profiles_results = {}
+        # Perfis marcados na última análise de todos os perfis (vazio = todos).
+        self._all_profiles_selection = set()
+        self.export_thread, self.export_worker = None, None
+        # Verdadeiro enquanto os lotes da análise atual ainda estão chegando.
+        self._streaming = False
+        # Threads de análises canceladas continuam referenciadas até terminarem de fato.
+        self._running_threads = set()
         self.metric_labels = {}
         main_layout = QVBoxLayout(self)
         main_layout.setContentsMargins(20, 20, 20, 20)
@@ -153,9 +513,31 @@ class AnalysisView(QWidget):
         top_controls_layout.addWidget(self.month_combo, 0, 3)
         top_controls_layout.addWidget(self.year_combo, 0, 4)
         top_controls_layout.addWidget(self.analyze_btn, 0, 5)
+        self.analyze_all_btn = QPushButton("Analisar Todos os Perfis")
+        self.analyze_all_btn.setFixedHeight(40)
+        top_controls_layout.addWidget(self.analyze_all_btn, 0, 6)
+        self.history_label = QLabel("", objectName="HistoryLabel")
+        self.history_btn = QPushButton("Abrir Análise Salva")
+        self.history_btn.setEnabled(False)
+        self.trend_btn = QPushButton("Tendência Anual")
+        self.merges_btn = QPushButton("Pacientes Duplicados")
+        self.planner_btn = QPushButton("Planejar Coletas")
+        top_controls_layout.addWidget(self.history_label, 1, 0, 1, 2)
+        top_controls_layout.addWidget(self.planner_btn, 1, 2)
+        top_controls_layout.addWidget(self.merges_btn, 1, 3)
+        top_controls_layout.addWidget(self.history_btn, 1, 4)
+        top_controls_layout.addWidget(self.trend_btn, 1, 5)
         header_layout.addLayout(top_controls_layout)
         header_layout.addWidget(self._create_upload_panel())
         self.analyze_btn.clicked.connect(self._start_analysis)
+        self.analyze_all_btn.clicked.connect(self._start_all_profiles_analysis)
+        self.history_btn.clicked.connect(self._load_saved_analysis)
+        self.trend_btn.clicked.connect(self._show_trend)
+        self.merges_btn.clicked.connect(lambda: PatientMergesDialog(self).exec())
+        self.planner_btn.clicked.connect(self._show_collection_plan)
+        self.profile_combo.currentTextChanged.connect(self._refresh_history_state)
+        self.month_combo.currentIndexChanged.connect(self._refresh_history_state)
+        self.year_combo.currentIndexChanged.connect(self._refresh_history_state)
         return header_frame
 
     def _create_upload_panel(self):
@@ -204,30 +586,122 @@ class AnalysisView(QWidget):
         self.search_input = QLineEdit(placeholderText="Buscar por Nome ou CNS...")
         self.status_filter_combo = QComboBox()
         self.status_filter_combo.addItems(["Todos", "Em dia", "Pendente", "Pendência de Coleta", "Internado"])
+        self.clinic_filter_combo = QComboBox()
+        self.clinic_filter_combo.addItem("Todas as Clínicas")
         filters_layout.addWidget(QLabel("<b>Filtros:</b>"))
         filters_layout.addWidget(self.search_input, 1)
         filters_layout.addWidget(self.status_filter_combo)
+        filters_layout.addWidget(self.clinic_filter_combo)
         results_layout.addLayout(filters_layout)
-        self.scroll_area = QScrollArea()
-        self.scroll_area.setWidgetResizable(True)
-        self.results_content = QWidget()
-        self.results_layout = QVBoxLayout(self.results_content)
-        self.results_layout.setAlignment(Qt.AlignmentFlag.AlignTop)
-        self.scroll_area.setWidget(self.results_content)
-        results_layout.addWidget(self.scroll_area, 1)
+        bulk_layout = QHBoxLayout()
+        self.bulk_exam_combo = QComboBox()
+        self.bulk_exam_combo.setMinimumWidth(220)
+        self.bulk_ok_btn = QPushButton("Marcar como OK para todos", objectName="okButton")
+        self.bulk_ok_btn.setEnabled(False)
+        bulk_layout.addWidget(QLabel("<b>Ação em lote (pacientes filtrados):</b>"))
+        bulk_layout.addWidget(self.bulk_exam_combo)
+        bulk_layout.addWidget(self.bulk_ok_btn)
+        bulk_layout.addStretch()
+        self.split_clinic_check = QCheckBox("Um arquivo por clínica")
+        self.export_btn = QPushButton("Exportar Resultados")
+        self.export_btn.setEnabled(False)
+        bulk_layout.addWidget(self.split_clinic_check)
+        bulk_layout.addWidget(self.export_btn)
+        results_layout.addLayout(bulk_layout)
+        self.results_model = PatientResultsModel(self)
+        self.results_proxy = PatientResultsFilterProxy(self)
+        self.results_proxy.setSourceModel(self.results_model)
+        self.results_delegate = PatientCardDelegate(parent=self)
+        self.results_view = QListView(objectName="ResultsList")
+        self.results_view.setModel(self.results_proxy)
+        self.results_view.setItemDelegate(self.results_delegate)
+        self.results_view.setVerticalScrollMode(QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.results_view.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
+        self.results_view.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        # Alturas variam por card; o layout em lotes evita medir todas as linhas de uma vez.
+        self.results_view.setLayoutMode(QListView.LayoutMode.Batched)
+        self.results_view.setBatchSize(200)
+        self.results_view.setResizeMode(QListView.ResizeMode.Adjust)
+        self.empty_results_label = QLabel("Nenhum paciente encontrado com os filtros atuais.")
+        self.empty_results_label.setVisible(False)
+        # Progresso compacto mostrado enquanto os lotes de uma análise em andamento chegam à lista.
+        self.stream_panel = QFrame()
+        stream_layout = QHBoxLayout(self.stream_panel)
+        stream_layout.setContentsMargins(0, 0, 0, 0)
+        self.stream_label = QLabel()
+        self.stream_progress = QProgressBar()
+        self.stream_progress.setRange(0, 100)
+        self.stream_cancel_btn = QPushButton("Cancelar")
+        stream_layout.addWidget(self.stream_label)
+        stream_layout.addWidget(self.stream_progress, 1)
+        stream_layout.addWidget(self.stream_cancel_btn)
+        self.stream_panel.setVisible(False)
+        results_layout.addWidget(self.stream_panel)
+        results_layout.addWidget(self.empty_results_label)
+        results_layout.addWidget(self.results_view, 1)
+        self.results_delegate.override_requested.connect(self._mark_exam_ok)
+        ThemeManager.theme_changed.connect(self._on_theme_changed)
+        # Expandir uma seção ou marcar um exame muda a altura do card.
+        self.results_proxy.dataChanged.connect(lambda top_left, *_: self.results_delegate.sizeHintChanged.emit(top_left))
         self.loading_overlay = LoadingOverlay(results_frame)
-        self.search_input.textChanged.connect(self._filter_results)
+        self.loading_overlay.cancel_requested.connect(self._on_cancel_requested)
+        self.stream_cancel_btn.clicked.connect(self._on_cancel_requested)
+        # A busca só roda depois de uma pausa na digitação.
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(self._filter_results)
+        self.search_input.textChanged.connect(self.search_timer.start)
         self.status_filter_combo.currentTextChanged.connect(self._filter_results)
+        self.clinic_filter_combo.currentTextChanged.connect(self._filter_results)
+        self.bulk_ok_btn.clicked.connect(self._mark_all_pending_ok)
+        self.export_btn.clicked.connect(self._on_export_clicked)
         return results_frame
 
+    def _on_theme_changed(self, palette):
+        self.results_delegate.set_palette(palette)
+        self.results_view.viewport().update()
+
     def _load_profiles(self):
         self.profiles = db.get_perfis()
         self.profile_combo.clear()
         self.profile_combo.addItems(sorted(self.profiles.keys()))
+        self._refresh_history_state()
+
+    def _selected_period(self):
+        mes, ano = self.month_combo.currentIndex() + 1, int(self.year_combo.currentText())
+        return mes, ano, f"{ano}-{mes:02d}"
+
+    def _refresh_history_state(self):
+        perfil = self.profile_combo.currentText()
+        _, _, period = self._selected_period()
+        info = db.get_analysis_run_info(perfil, period) if perfil else None
+        self.history_btn.setEnabled(info is not None)
+        self.history_label.setText(f"Análise salva em {info['created_at']} ({info['num_ativos']} ativos)" if info else "Nenhuma análise salva para este perfil/período.")
+
+    def _load_saved_analysis(self):
+        perfil = self.profile_combo.currentText()
+        _, _, period = self._selected_period()
+        saved = db.get_analysis_run(perfil, period)
+        if saved is None:
+            QMessageBox.information(self, "Histórico", "Nenhuma análise salva para este perfil/período.")
+            self._refresh_history_state()
+            return
+        resultados, num_ativos, total_pacientes = saved
+        self._cancel_running_analysis()
+        self.all_profiles_results = {}
+        self.analysis_profile, self.analysis_period = perfil, period
+        self._show_results(resultados, num_ativos, total_pacientes)
+
+    def _show_trend(self):
+        perfil = self.profile_combo.currentText()
+        _, ano, _ = self._selected_period()
+        TrendDialog(perfil, ano, db.get_pending_trend(perfil, ano), self).exec()
 
     def _handle_file_dialog(self, file_type):
         filepath, _ = QFileDialog.getOpenFileName(self, "Selecionar Arquivo CSV", "", "CSV Files (*.csv)")
         if not filepath: return
+        import pandas as pd
         try: df = pd.read_csv(filepath, sep=';', encoding='utf-8-sig', dtype={'CNS': str})
         except Exception:
             try: df = pd.read_csv(filepath, sep=';', encoding='latin-1', dtype={'CNS': str})
@@ -239,64 +713,267 @@ class AnalysisView(QWidget):
         label_map[file_type].setText(Path(filepath).name)
         label_map[file_type].setStyleSheet("font-style: normal;")
 
+    def _reference_date(self):
+        mes, ano, _ = self._selected_period()
+        # Import adiado, como o do pandas: o dateutil não é necessário para abrir a janela.
+        from dateutil.relativedelta import relativedelta
+        return datetime(ano, mes, 1) + relativedelta(months=1, days=-1)
+
+    def _build_analysis_frame(self, clinicas_perfil=None):
+        """Exames do arquivo carregado em formato longo (uma linha por exame), com os nomes já mapeados e,
+        se informadas, restritos às clínicas do perfil."""
+        df_analise = self.df_exames.copy()
+        if 'Clinica' in df_analise.columns and clinicas_perfil:
+            df_analise = df_analise[df_analise['Clinica'].isin(clinicas_perfil)]
+        df_analise.rename(columns={'Data exame': 'Data'}, inplace=True)
+        id_vars = [c for c in ['Nome', 'CNS', 'Data', 'Clinica'] if c in df_analise.columns]
+        df_analise = df_analise.melt(id_vars=id_vars, var_name='Exame', value_name='Resultado').dropna(subset=['Resultado'])
+        df_analise = df_analise[df_analise['Resultado'].astype(str).str.strip() != '']
+        exames_mapeados = db.get_exames_with_aliases()
+        name_mapping = db.get_exame_name_mapping()
+        df_analise['Exame'] = df_analise['Exame'].replace(dict(name_mapping))
+        return df_analise[df_analise['Exame'].isin(list(exames_mapeados.keys()))]
+
+    def _show_collection_plan(self):
+        if self.df_exames is None:
+            QMessageBox.warning(self, "Atenção", "Por favor, carregue um arquivo de exames.")
+            return
+        selected_profile = self.profile_combo.currentText()
+        profile_data = self.profiles.get(selected_profile, {})
+        rotina_nome = profile_data.get('rotina')
+        rotina_usada = db.get_rotina_details(rotina_nome) if rotina_nome else {}
+        df_analise = self._build_analysis_frame(profile_data.get('clinicas', []))
+        if df_analise.empty or not rotina_usada:
+            QMessageBox.information(self, "Planejamento de Coletas", "Nenhum dado de exame relevante ou rotina para o perfil.")
+            return
+        CollectionPlanDialog(selected_profile, df_analise, self._reference_date(), rotina_usada, self.df_mov,
+                             db.get_periodos(), db.get_patient_merges(), self).exec()
+
     def _start_analysis(self):
         if self.df_exames is None:
             QMessageBox.warning(self, "Atenção", "Por favor, carregue um arquivo de exames.")
             return
+        # Uma execução por vez: se ainda houver uma em andamento, ela é cancelada e seus sinais passam a ser ignorados.
+        self._cancel_running_analysis()
         self.analyze_btn.setEnabled(False)
+        self.analyze_all_btn.setEnabled(False)
+        self.loading_overlay.reset()
         self.loading_overlay.setVisible(True)
-        self._reset_metrics()
-        self._clear_results_layout()
+        self._clear_results()
+        self.all_profiles_results = {}
         selected_profile = self.profile_combo.currentText()
         profile_data = self.profiles.get(selected_profile, {})
         rotina_nome = profile_data.get('rotina')
-        rotina_usada = db.get_rotina_details(rotina_nome) if rotina_nome else {}
         clinicas_perfil = profile_data.get('clinicas', [])
-        mes, ano = self.month_combo.currentIndex() + 1, int(self.year_combo.currentText())
-        data_referencia = datetime(ano, mes, 1) + relativedelta(months=1, days=-1)
-        analysis_period_str = f"{ano}-{mes:02d}"
-        df_analise = self.df_exames.copy()
-        if 'Clinica' in df_analise.columns and clinicas_perfil:
-            df_analise = df_analise[df_analise['Clinica'].isin(clinicas_perfil)]
-        df_analise.rename(columns={'Data exame': 'Data'}, inplace=True)
-        id_vars = [c for c in ['Nome', 'CNS', 'Data', 'Clinica'] if c in df_analise.columns]
-        df_analise = df_analise.melt(id_vars=id_vars, var_name='Exame', value_name='Resultado').dropna(subset=['Resultado'])
-        df_analise = df_analise[df_analise['Resultado'].astype(str).str.strip() != '']
-        exames_mapeados = db.get_exames_with_aliases()
-        name_mapping = {a: n for n, d in exames_mapeados.items() for a in d.get('aliases', []) + [n]}
-        df_analise['Exame'] = df_analise['Exame'].replace(name_mapping)
-        df_analise = df_analise[df_analise['Exame'].isin(exames_mapeados.keys())]
+        _, _, analysis_period_str = self._selected_period()
+        data_referencia = self._reference_date()
+        self.analysis_profile = selected_profile
+        self.analysis_period = analysis_period_str
+        # Mesma regra da análise de todos os perfis: o histórico vem de todas as clínicas e o perfil fica com os
+        # pacientes cuja clínica atual é uma das suas (ver exam_processor.processar_perfis).
+        df_analise = self._build_analysis_frame()
+        if df_analise.empty:
+            QMessageBox.information(self, "Análise Concluída", "Nenhum dado de exame relevante foi encontrado.")
+            self._reset_ui_state()
+            return
+        thread = QThread()
+        worker = Worker(df_analise, data_referencia, rotina_nome, clinicas_perfil, self.df_mov, self.df_internacoes, analysis_period_str)
+        worker.batch_ready.connect(self._on_analysis_batch)
+        worker.finished.connect(self._on_analysis_finished)
+        self._streaming = True
+        self._start_worker(thread, worker)
+
+    def _start_all_profiles_analysis(self):
+        if self.df_exames is None:
+            QMessageBox.warning(self, "Atenção", "Por favor, carregue um arquivo de exames.")
+            return
+        if not self.profiles:
+            QMessageBox.information(self, "Análise de Todos os Perfis", "Nenhum perfil cadastrado.")
+            return
+        dialog = ProfileSelectionDialog(list(self.profiles), (self._all_profiles_selection & set(self.profiles)) or set(self.profiles), self)
+        if dialog.exec() != QDialog.DialogCode.Accepted:
+            return
+        selecionados = dialog.selected_profiles()
+        self._all_profiles_selection = set(selecionados)
+        self._cancel_running_analysis()
+        self.analyze_btn.setEnabled(False)
+        self.analyze_all_btn.setEnabled(False)
+        self.loading_overlay.reset()
+        self.loading_overlay.setVisible(True)
+        self._clear_results()
+        self.all_profiles_results = {}
+        perfis = {perfil: self.profiles[perfil] for perfil in selecionados}
+        _, _, analysis_period_str = self._selected_period()
+        atual = self.profile_combo.currentText()
+        self.analysis_profile = atual if atual in perfis else selecionados[0]
+        self.analysis_period = analysis_period_str
+        df_analise = self._build_analysis_frame()
         if df_analise.empty:
             QMessageBox.information(self, "Análise Concluída", "Nenhum dado de exame relevante foi encontrado.")
             self._reset_ui_state()
             return
-        manual_overrides = db.get_overrides_for_period(analysis_period_str)
-        self.thread = QThread()
-        self.worker = Worker(df_analise, data_referencia, rotina_usada, self.df_mov, self.df_internacoes, manual_overrides)
-        self.worker.moveToThread(self.thread)
-        self.thread.started.connect(self.worker.run)
-        self.worker.finished.connect(self._on_analysis_finished)
-        self.worker.error.connect(self._on_analysis_error)
-        self.worker.finished.connect(self.thread.quit)
-        self.worker.finished.connect(self.worker.deleteLater)
-        self.thread.finished.connect(self.thread.deleteLater)
-        self.thread.start()
-
-    def _on_analysis_finished(self, resultados, num_ativos, total_pacientes, _):
+        thread = QThread()
+        worker = AllProfilesWorker(df_analise, self._reference_date(), perfis, self.df_mov, self.df_internacoes, analysis_period_str)
+        worker.finished.connect(self._on_all_profiles_finished)
+        self._start_worker(thread, worker)
+
+    def _start_worker(self, thread, worker):
+        worker.moveToThread(thread)
+        thread.started.connect(worker.run)
+        worker.error.connect(self._on_analysis_error)
+        worker.progress.connect(self._on_analysis_progress)
+        worker.cancelled.connect(self._on_analysis_cancelled)
+        for signal in (worker.finished, worker.error, worker.cancelled):
+            signal.connect(thread.quit)
+        thread.finished.connect(worker.deleteLater)
+        thread.finished.connect(self._on_thread_finished)
+        thread.finished.connect(thread.deleteLater)
+        self.thread, self.worker = thread, worker
+        self._running_threads.add(thread)
+        thread.start()
+
+    def _on_all_profiles_finished(self, saida):
+        if not self._is_current_worker():
+            return
+        from src.core import exam_processor
+        self.all_profiles_results = saida
+        for perfil, (resultados, num_ativos, total_pacientes) in saida.items():
+            WriteQueue.submit(db.save_analysis_run, perfil, self.analysis_period, dict(resultados), num_ativos, total_pacientes,
+                              on_success=lambda _: self._refresh_history_state(),
+                              error_message=f"Não foi possível salvar a análise do perfil {perfil} no histórico")
+        self.loading_overlay.setVisible(False)
+        self._reset_ui_state()
+        self._show_profile_results(self.analysis_profile)
+        dialog = NetworkSummaryDialog(self.analysis_period, exam_processor.resumo_por_clinica(saida), saida.keys(), self)
+        dialog.profile_selected.connect(self._show_profile_results)
+        dialog.exec()
+
+    def _show_profile_results(self, perfil):
+        if perfil not in self.all_profiles_results:
+            return
+        self.profile_combo.setCurrentText(perfil)
+        self.analysis_profile = perfil
+        self._show_results(dict(self.all_profiles_results[perfil][0]), *self.all_profiles_results[perfil][1:])
+
+    def _is_current_worker(self):
+        # Sinais de uma execução substituída chegam depois; só a execução atual mexe na tela.
+        return self.worker is not None and self.sender() is self.worker
+
+    def _on_thread_finished(self):
+        thread = self.sender()
+        self._running_threads.discard(thread)
+        if thread is self.thread:
+            self.thread, self.worker = None, None
+
+    def _on_analysis_progress(self, stage, percent):
+        if not self._is_current_worker():
+            return
+        self.loading_overlay.set_progress(stage, percent)
+        self.stream_label.setText(stage)
+        self.stream_progress.setValue(percent)
+
+    def _cancel_running_analysis(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker = None
+        self._streaming = False
+        self.stream_panel.setVisible(False)
+
+    def _on_cancel_requested(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.stream_cancel_btn.setEnabled(False)
+
+    def _on_analysis_cancelled(self):
+        if not self._is_current_worker():
+            return
+        self._streaming = False
+        self.loading_overlay.setVisible(False)
+        self.stream_panel.setVisible(False)
+        # Resultados parciais não são salvos nem ficam na tela.
+        self._clear_results()
+        self._reset_ui_state()
+        NotificationService.show("Análise cancelada.", "info")
+
+    def _clear_results(self):
+        self.analysis_results = None
+        self._reset_metrics()
+        self.results_model.set_results(())
+        self.results_model.clear_expanded()
+        self.results_proxy.set_filter()
+        self.bulk_exam_combo.clear()
+        self.bulk_ok_btn.setEnabled(False)
+        self.empty_results_label.setVisible(False)
+        self._update_export_state()
+
+    def _on_analysis_batch(self, lote, num_ativos, total_pacientes):
+        if not self._is_current_worker():
+            return
+        if self.analysis_results is None:
+            # Primeiro lote: a lista passa a ocupar o painel e o progresso vai para a barra compacta.
+            self.analysis_results = {}
+            self.loading_overlay.setVisible(False)
+            self.stream_cancel_btn.setEnabled(True)
+            self.stream_panel.setVisible(True)
+        self.analysis_results.update(lote)
+        self.analysis_counts = (num_ativos, total_pacientes)
+        clinicas_antes = len(self.results_model.search_index.clinic_buckets)
+        self.results_model.append_results(lote.items())
+        if len(self.results_model.search_index.clinic_buckets) != clinicas_antes:
+            self._populate_clinic_filter()
+        self._update_metrics()
+        self.empty_results_label.setVisible(self.results_proxy.rowCount() == 0)
+
+    def _on_analysis_finished(self, num_ativos, total_pacientes):
+        if not self._is_current_worker():
+            return
+        self._streaming = False
+        self.stream_panel.setVisible(False)
+        resultados = self.analysis_results or {}
+        WriteQueue.submit(db.save_analysis_run, self.analysis_profile, self.analysis_period, dict(resultados), num_ativos, total_pacientes,
+                          on_success=lambda _: self._refresh_history_state(),
+                          error_message="Não foi possível salvar a análise no histórico")
+        # Reordena a lista (os lotes chegam na ordem de processamento) e libera a ação em lote.
+        self._show_results(resultados, num_ativos, total_pacientes)
+
+    def _show_results(self, resultados, num_ativos, total_pacientes):
         self.loading_overlay.setVisible(False)
         self.analysis_results = resultados
-        stats = { 'Pendentes': sum(1 for r in resultados.values() if r['status'] == 'Pendente'),
-                  'Internados': sum(1 for r in resultados.values() if r['status'] == 'Internado'),
-                  'Pend. Coleta': sum(1 for r in resultados.values() if r['status'] == 'Pendência de Coleta')}
-        stats['Em Dia'] = num_ativos - sum(stats.values())
+        self.analysis_counts = (num_ativos, total_pacientes)
+        self.results_model.set_results(resultados.items())
+        self._update_metrics()
+        self._populate_clinic_filter()
+        self._reset_ui_state()
+        self._filter_results()
+
+    def _update_metrics(self):
+        buckets = self.results_model.search_index.status_buckets
+        num_ativos, total_pacientes = self.analysis_counts
+        stats = { 'Em Dia': len(buckets.get('Em dia', ())),
+                  'Pendentes': len(buckets.get('Pendente', ())),
+                  'Internados': len(buckets.get('Internado', ())),
+                  'Pend. Coleta': len(buckets.get('Pendência de Coleta', ()))}
         stats.update({'Total': total_pacientes, 'Ativos': num_ativos})
         for key, label in self.metric_labels.items():
             label.setText(str(stats.get(key, 0)))
-        self._reset_ui_state()
-        self._filter_results()
+
+    def _populate_clinic_filter(self):
+        self.clinic_filter_combo.blockSignals(True)
+        current = self.clinic_filter_combo.currentText()
+        clinicas = sorted(c for c in self.results_model.search_index.clinic_buckets if c)
+        self.clinic_filter_combo.clear()
+        self.clinic_filter_combo.addItems(["Todas as Clínicas", *clinicas])
+        if current in clinicas:
+            self.clinic_filter_combo.setCurrentText(current)
+        self.clinic_filter_combo.blockSignals(False)
 
     def _on_analysis_error(self, error_msg):
+        if not self._is_current_worker():
+            return
+        self._streaming = False
         self.loading_overlay.setVisible(False)
+        self.stream_panel.setVisible(False)
+        self._clear_results()
         self._reset_ui_state()
         QMessageBox.critical(self, "Erro de Análise", error_msg)
     
@@ -305,52 +982,177 @@ class AnalysisView(QWidget):
 
     def _reset_ui_state(self):
         self.analyze_btn.setEnabled(True)
+        self.analyze_all_btn.setEnabled(True)
         self.analyze_btn.setText("Analisar Exames")
 
+    def _filtered_results(self):
+        """Pacientes visíveis na lista, na ordem exibida."""
+        return dict(self.results_model.row_item(row) for row in self.results_proxy.source_rows())
+
     def _filter_results(self):
+        self.search_timer.stop()
         if not self.analysis_results:
             return
-
-        search_query = self.search_input.text().lower().strip()
         status_query = self.status_filter_combo.currentText()
-        
-        filtered_results = {}
-        for patient, info in self.analysis_results.items():
-            patient_status = info.get('status', '').strip() 
-            
-            status_match = (status_query == "Todos" or patient_status == status_query)
-            if not status_match:
-                continue
-
-            patient_name, patient_cns = patient
-            search_match = (not search_query or 
-                            search_query in patient_name.lower() or 
-                            search_query in patient_cns)
-            if not search_match:
-                continue
-            
-            filtered_results[patient] = info
-            
-        self._populate_results_layout(filtered_results)
-    
-    def _clear_results_layout(self):
-        for i in reversed(range(self.results_layout.count())): 
-            widget_item = self.results_layout.itemAt(i)
-            if widget_item:
-                widget = widget_item.widget()
-                if widget:
-                    widget.deleteLater()
-
-    def _populate_results_layout(self, results_to_display):
-        self._clear_results_layout()
-        if not results_to_display:
-            self.results_layout.addWidget(QLabel("Nenhum paciente encontrado com os filtros atuais."))
+        clinic_query = self.clinic_filter_combo.currentText()
+        self.results_proxy.set_filter(
+            self.search_input.text(),
+            status=None if status_query == "Todos" else status_query,
+            clinica=None if clinic_query == "Todas as Clínicas" else clinic_query,
+        )
+        self.empty_results_label.setVisible(self.results_proxy.rowCount() == 0)
+        # Com a análise ainda em andamento, a ação em lote só é liberada quando todos os lotes chegarem.
+        if not self._streaming:
+            self._populate_bulk_exam_combo(self._filtered_results())
+
+    def _populate_bulk_exam_combo(self, filtered_results):
+        pendentes = {}
+        for info in filtered_results.values():
+            for detalhe in info.get('detalhes_obrigatorios', []) + info.get('detalhes_opcionais', []):
+                pendentes[detalhe['exame']] = pendentes.get(detalhe['exame'], 0) + 1
+        current = self.bulk_exam_combo.currentData()
+        self.bulk_exam_combo.clear()
+        for exame in sorted(pendentes):
+            self.bulk_exam_combo.addItem(f"{exame} ({pendentes[exame]})", exame)
+        index = self.bulk_exam_combo.findData(current)
+        if index >= 0:
+            self.bulk_exam_combo.setCurrentIndex(index)
+        self.bulk_ok_btn.setEnabled(bool(pendentes))
+        self._update_export_state()
+
+    def _update_export_state(self):
+        # Durante a exportação o botão vira "Cancelar" e continua habilitado.
+        self.export_btn.setEnabled(self.export_worker is not None or (not self._streaming and bool(self.analysis_results)))
+
+    def _on_export_clicked(self):
+        if self.export_worker is not None:
+            self.export_worker.cancel()
+            self.export_btn.setEnabled(False)
             return
-        mes, ano = self.month_combo.currentIndex() + 1, int(self.year_combo.currentText())
-        analysis_period_str = f"{ano}-{mes:02d}"
-        status_order = {'Internado': 0, 'Pendência de Coleta': 1, 'Pendente': 2, 'Em dia': 3}
-        sorted_results = sorted(results_to_display.items(), key=lambda i: (status_order.get(i[1]['status'], 99), i[0][0]))
-        for patient, info in sorted_results:
-            widget = PatientResultWidget(patient, info, analysis_period_str)
-            widget.request_refresh.connect(self._start_analysis)
-            self.results_layout.addWidget(widget)
\ No newline at end of file
+        items = list(self._filtered_results().items())
+        if not items:
+            QMessageBox.information(self, "Exportar Resultados", "Nenhum paciente com os filtros atuais.")
+            return
+        filtros = "Planilha CSV (*.csv)"
+        if result_exporter.xlsx_available():
+            filtros += ";;Planilha Excel (*.xlsx)"
+        sugestao = f"resultados_{self.analysis_profile}_{self.analysis_period}.csv"
+        filepath, filtro = QFileDialog.getSaveFileName(self, "Exportar Resultados", sugestao, filtros)
+        if not filepath:
+            return
+        path = Path(filepath)
+        fmt = result_exporter.FORMAT_XLSX if "xlsx" in filtro or path.suffix.lower() == ".xlsx" else result_exporter.FORMAT_CSV
+        if fmt == result_exporter.FORMAT_XLSX and not result_exporter.xlsx_available():
+            QMessageBox.warning(self, "Exportar Resultados", "A exportação para Excel requer o pacote 'openpyxl'. Exporte em CSV.")
+            return
+        path = path.with_suffix(f".{fmt}")
+        thread = QThread()
+        worker = ExportWorker(items, path, fmt, self.split_clinic_check.isChecked())
+        worker.moveToThread(thread)
+        thread.started.connect(worker.run)
+        worker.progress.connect(self._on_export_progress)
+        worker.finished.connect(self._on_export_finished)
+        worker.error.connect(self._on_export_error)
+        worker.cancelled.connect(self._on_export_cancelled)
+        for signal in (worker.finished, worker.error, worker.cancelled):
+            signal.connect(thread.quit)
+        thread.finished.connect(worker.deleteLater)
+        thread.finished.connect(self._on_export_thread_finished)
+        thread.finished.connect(thread.deleteLater)
+        self.export_thread, self.export_worker = thread, worker
+        self.export_btn.setText("Cancelar Exportação (0%)")
+        thread.start()
+
+    def _on_export_progress(self, percent):
+        if self.export_worker is not None:
+            self.export_btn.setText(f"Cancelar Exportação ({percent}%)")
+
+    def _on_export_finished(self, arquivos):
+        pasta = arquivos[0].parent if arquivos else ""
+        NotificationService.show(f"{len(arquivos)} arquivo(s) exportado(s) para {pasta}.")
+
+    def _on_export_error(self, error_msg):
+        QMessageBox.critical(self, "Erro de Exportação", error_msg)
+
+    def _on_export_cancelled(self):
+        NotificationService.show("Exportação cancelada.", "info")
+
+    def _on_export_thread_finished(self):
+        self.export_thread, self.export_worker = None, None
+        self.export_btn.setText("Exportar Resultados")
+        self._update_export_state()
+
+    def _mark_exam_ok(self, chave, exame):
+        # O card é atualizado na hora; se a gravação falhar, ele volta ao estado anterior e o erro chega pelo banner.
+        # `chave` é o CNS ou, para pacientes sem CNS, o nome normalizado (search_index.patient_key).
+        self._apply_overrides({chave: {exame}}, error_message="Não foi possível registrar o exame como OK")
+
+    def _mark_all_pending_ok(self):
+        exame = self.bulk_exam_combo.currentData()
+        if not exame or not self.analysis_results:
+            return
+        alvos = [patient_key(*patient) for patient, info in self._filtered_results().items()
+                 if any(d['exame'] == exame for d in info.get('detalhes_obrigatorios', []) + info.get('detalhes_opcionais', []))]
+        if not alvos:
+            return
+        reply = QMessageBox.question(self, "Confirmar Ação em Lote",
+                                     f"Marcar '{exame}' como OK para {len(alvos)} paciente(s) filtrado(s)?",
+                                     QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+                                     QMessageBox.StandardButton.No)
+        if reply != QMessageBox.StandardButton.Yes:
+            return
+        self._apply_overrides({chave: {exame} for chave in alvos},
+                              success_message=f"'{exame}' marcado como OK para {len(alvos)} paciente(s).",
+                              error_message="Não foi possível registrar os exames como OK")
+
+    @staticmethod
+    def _overrides_applied(resultados, exames_por_paciente):
+        from src.core import exam_processor
+        alterados = {}
+        for patient, info in resultados.items():
+            chave = patient_key(*patient)
+            if chave in exames_por_paciente:
+                alterados[patient] = exam_processor.aplicar_overrides(info, exames_por_paciente[chave])
+        return alterados
+
+    def _apply_overrides(self, exames_por_paciente, success_message=None, error_message=None):
+        alterados = self._overrides_applied(self.analysis_results, exames_por_paciente)
+        destinos = [(self.analysis_results, alterados)]
+        por_perfil = {self.analysis_profile: alterados}
+        # Depois de uma análise de todos os perfis, o paciente também está nos resultados (e no histórico) de outros perfis.
+        for perfil, (resultados, _, _) in self.all_profiles_results.items():
+            mudancas = alterados if perfil == self.analysis_profile else self._overrides_applied(resultados, exames_por_paciente)
+            destinos.append((resultados, mudancas))
+            if mudancas:
+                por_perfil[perfil] = mudancas
+        # Guarda (original, aplicado) de cada paciente antes de trocar, para desfazer na tela se a gravação falhar.
+        trocas = [(resultados, {patient: (resultados[patient], info) for patient, info in mudancas.items()})
+                  for resultados, mudancas in destinos]
+        for resultados, mudancas in destinos:
+            resultados.update(mudancas)
+        # Overrides e histórico vão numa única operação da fila: ou tudo é gravado, ou nada.
+        entries = [(chave, exame, self.analysis_period) for chave, exames in exames_por_paciente.items() for exame in exames]
+        WriteQueue.submit(db.add_overrides_with_results, entries, self.analysis_period, por_perfil,
+                          on_error=lambda _e: self._revert_overrides(trocas),
+                          success_message=success_message, error_message=error_message)
+        # Atualiza os cards no lugar, sem refiltrar, para não perder a posição da lista.
+        self.results_model.update_patients(alterados)
+        self._update_metrics()
+        if not self._streaming:
+            self._populate_bulk_exam_combo(self._filtered_results())
+
+    def _revert_overrides(self, trocas):
+        restaurados = {}
+        for resultados, pacientes in trocas:
+            for patient, (original, aplicado) in pacientes.items():
+                # Só desfaz o que ainda está como foi aplicado (outra marcação ou nova análise pode ter vindo depois).
+                if resultados.get(patient) is aplicado:
+                    resultados[patient] = original
+                    if resultados is self.analysis_results:
+                        restaurados[patient] = original
+        if not restaurados:
+            return
+        self.results_model.update_patients(restaurados)
+        self._update_metrics()
+        if not self._streaming:
+            self._populate_bulk_exam_combo(self._filtered_results())
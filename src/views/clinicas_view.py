@@ -5,6 +5,7 @@ from PySide6.QtWidgets import (
 )
 from src.core import database_manager as db
 from src.core.notification_service import NotificationService
+from src.core.write_queue import WriteQueue
 
 class ClinicasView(QWidget):
     def __init__(self, parent=None):
@@ -50,7 +51,7 @@ class ClinicasView(QWidget):
     def _load_clinicas(self):
         self.list_widget.clear()
         clinicas = db.get_clinicas()
-        self.list_widget.addItems(clinicas)
+        self.list_widget.addItems(list(clinicas))
         self._update_remove_button_state()
 
     def _add_clinica(self):
@@ -63,10 +64,11 @@ class ClinicasView(QWidget):
             QMessageBox.warning(self, "Atenção", f"A clínica '{new_name}' já está cadastrada.")
             return
         current_items.append(new_name)
-        db.save_clinicas(sorted(current_items))
-        self._load_clinicas()
         self.new_clinica_input.clear()
-        NotificationService.show(f"Clínica '{new_name}' adicionada com sucesso.")
+        WriteQueue.submit(db.save_clinicas, sorted(current_items),
+                          on_success=lambda _: self._load_clinicas(),
+                          success_message=f"Clínica '{new_name}' adicionada com sucesso.",
+                          error_message="Não foi possível adicionar a clínica")
 
     def _remove_clinicas(self):
         selected_items = self.list_widget.selectedItems()
@@ -81,9 +83,13 @@ class ClinicasView(QWidget):
         current_items = [self.list_widget.item(i).text() for i in range(self.list_widget.count())]
         items_to_remove = {item.text() for item in selected_items}
         updated_list = [item for item in current_items if item not in items_to_remove]
-        db.save_clinicas(updated_list)
+        WriteQueue.submit(db.save_clinicas, updated_list,
+                          on_success=lambda _, n=len(selected_items): self._on_clinicas_removed(n),
+                          error_message="Não foi possível remover as clínicas")
+
+    def _on_clinicas_removed(self, count):
         self._load_clinicas()
-        NotificationService.show(f"{len(selected_items)} clínica(s) removida(s) com sucesso.", "info")
+        NotificationService.show(f"{count} clínica(s) removida(s) com sucesso.", "info")
 
     def _update_remove_button_state(self):
         self.remove_btn.setEnabled(len(self.list_widget.selectedItems()) > 0)
\ No newline at end of file
@@ -1,48 +1,108 @@
-from PySide6.QtCore import QPropertyAnimation, QEasingCurve, Signal
-from PySide6.QtWidgets import QStackedWidget, QWidget, QGraphicsOpacityEffect
+import logging
+import time
+from PySide6.QtCore import Qt, QVariantAnimation, QAbstractAnimation, QEasingCurve, Signal
+from PySide6.QtGui import QPainter, QPixmap
+from PySide6.QtWidgets import QStackedWidget, QWidget
+
+# Views cuja captura passa disso trocam sem animação dali em diante.
+EXPENSIVE_GRAB_MS = 30
+# Propriedade dinâmica para uma view dispensar a transição (definida também automaticamente pelo custo acima).
+SKIP_TRANSITION_PROPERTY = "skipTransition"
+
+class _CrossFadeOverlay(QWidget):
+    """Desenha a captura da view anterior e, por cima, a da próxima com opacidade crescente."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setAttribute(Qt.WidgetAttribute.WA_TransparentForMouseEvents)
+        self.from_pixmap = QPixmap()
+        self.to_pixmap = QPixmap()
+        self.progress = 0.0
+        self.hide()
+
+    def set_progress(self, value):
+        self.progress = value
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.drawPixmap(0, 0, self.from_pixmap)
+        painter.setOpacity(self.progress)
+        painter.drawPixmap(0, 0, self.to_pixmap)
 
 class AnimatedStackedWidget(QStackedWidget):
+    """QStackedWidget com transição em cross-fade.
+
+    Cada view é capturada uma única vez (QWidget.grab) e a animação só repinta as duas imagens; a
+    árvore de widgets não é redesenhada a cada quadro. A troca é imediata com reduce_motion ligado,
+    com a janela oculta ou quando alguma das views é cara demais para capturar.
+    """
     animation_finished = Signal()
 
     def __init__(self, parent=None):
         super().__init__(parent)
         self.duration = 250
-        self.next_index = -1
-        self.is_animating = False
-        self.animation_out = QPropertyAnimation()
-        self.animation_in = QPropertyAnimation()
+        self.reduce_motion = False
+        self._overlay = _CrossFadeOverlay(self)
+        self._animation = QVariantAnimation(self)
+        self._animation.setStartValue(0.0)
+        self._animation.setEndValue(1.0)
+        self._animation.setEasingCurve(QEasingCurve.Type.InOutQuad)
+        self._animation.valueChanged.connect(self._overlay.set_progress)
+        self._animation.finished.connect(self._on_animation_finished)
+
+    @property
+    def is_animating(self) -> bool:
+        return self._animation.state() == QAbstractAnimation.State.Running
 
     def setCurrentIndex(self, index: int):
-        if self.currentIndex() == index or self.is_animating:
+        if self.currentIndex() == index:
             return
-        self.is_animating = True
-        self.next_index = index
+        # Um novo clique durante a transição encerra a anterior e segue para o destino novo.
+        if self.is_animating:
+            self._animation.stop()
+            self._on_animation_finished()
         previous_widget = self.currentWidget()
-        self._setup_animation(self.animation_out, previous_widget, 1.0, 0.0)
-        self.animation_out.finished.connect(self._on_fade_out_finished)
-        self.animation_out.start()
-
-    def _on_fade_out_finished(self):
-        self.animation_out.finished.disconnect(self._on_fade_out_finished)
-        self.currentWidget().setGraphicsEffect(None)
-        super().setCurrentIndex(self.next_index)
-        next_widget = self.currentWidget()
-        self._setup_animation(self.animation_in, next_widget, 0.0, 1.0)
-        self.animation_in.finished.connect(self._on_fade_in_finished)
-        self.animation_in.start()
-
-    def _on_fade_in_finished(self):
-        self.animation_in.finished.disconnect(self._on_fade_in_finished)
-        self.currentWidget().setGraphicsEffect(None)
-        self.is_animating = False
-        self.animation_finished.emit()
+        next_widget = self.widget(index)
+        if not self._should_animate(previous_widget, next_widget):
+            super().setCurrentIndex(index)
+            self.animation_finished.emit()
+            return
+        from_pixmap = self._grab(previous_widget)
+        super().setCurrentIndex(index)
+        to_pixmap = self._grab(next_widget) if from_pixmap is not None else None
+        if to_pixmap is None:
+            self.animation_finished.emit()
+            return
+        self._overlay.from_pixmap = from_pixmap
+        self._overlay.to_pixmap = to_pixmap
+        self._overlay.progress = 0.0
+        self._overlay.setGeometry(self.rect())
+        self._overlay.raise_()
+        self._overlay.show()
+        self._animation.setDuration(self.duration)
+        self._animation.start()
 
-    def _setup_animation(self, animation: QPropertyAnimation, widget: QWidget, start: float, end: float):
-        effect = QGraphicsOpacityEffect(widget)
-        widget.setGraphicsEffect(effect)
-        animation.setTargetObject(effect)
-        animation.setPropertyName(b"opacity")
-        animation.setDuration(self.duration)
-        animation.setEasingCurve(QEasingCurve.Type.InOutQuad)
-        animation.setStartValue(start)
-        animation.setEndValue(end)
\ No newline at end of file
+    def _should_animate(self, previous_widget: QWidget, next_widget: QWidget) -> bool:
+        if self.reduce_motion or self.duration <= 0 or not self.isVisible():
+            return False
+        if previous_widget is None or next_widget is None:
+            return False
+        return not (previous_widget.property(SKIP_TRANSITION_PROPERTY) or next_widget.property(SKIP_TRANSITION_PROPERTY))
+
+    def _grab(self, widget: QWidget):
+        inicio = time.perf_counter()
+        pixmap = widget.grab()
+        elapsed_ms = (time.perf_counter() - inicio) * 1000
+        if elapsed_ms > EXPENSIVE_GRAB_MS:
+            widget.setProperty(SKIP_TRANSITION_PROPERTY, True)
+            logging.info(f"Transição desativada para {type(widget).__name__}: captura levou {elapsed_ms:.0f} ms")
+            return None
+        return pixmap
+
+    def _on_animation_finished(self):
+        self._overlay.hide()
+        # Libera as capturas; a próxima transição tira novas.
+        self._overlay.from_pixmap = QPixmap()
+        self._overlay.to_pixmap = QPixmap()
+        self.animation_finished.emit()
@@ -1,8 +1,10 @@
-from PySide6.QtCore import Qt, QSize
+from PySide6.QtCore import Qt, QSize, Signal
 from PySide6.QtGui import QMovie, QColor, QPainter
-from PySide6.QtWidgets import QWidget, QLabel, QVBoxLayout
+from PySide6.QtWidgets import QWidget, QLabel, QVBoxLayout, QProgressBar, QPushButton
 
 class LoadingOverlay(QWidget):
+    cancel_requested = Signal()
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setAttribute(Qt.WidgetAttribute.WA_TranslucentBackground)
@@ -18,11 +20,38 @@ class LoadingOverlay(QWidget):
         self.loading_text = QLabel("Processando Análise...", self)
         self.loading_text.setStyleSheet("color: #FFFFFF; font-weight: bold; font-size: 12pt;")
 
-        layout.addWidget(self.spinner_label)
-        layout.addWidget(self.loading_text)
+        self.stage_label = QLabel("", self)
+        self.stage_label.setStyleSheet("color: #FFFFFF; font-size: 10pt;")
+        self.progress_bar = QProgressBar(self)
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.setFixedWidth(320)
+        self.cancel_button = QPushButton("Cancelar", self)
+        self.cancel_button.setFixedWidth(120)
+        self.cancel_button.clicked.connect(self._on_cancel_clicked)
+
+        layout.addWidget(self.spinner_label, alignment=Qt.AlignmentFlag.AlignCenter)
+        layout.addWidget(self.loading_text, alignment=Qt.AlignmentFlag.AlignCenter)
+        layout.addWidget(self.stage_label, alignment=Qt.AlignmentFlag.AlignCenter)
+        layout.addWidget(self.progress_bar, alignment=Qt.AlignmentFlag.AlignCenter)
+        layout.addWidget(self.cancel_button, alignment=Qt.AlignmentFlag.AlignCenter)
 
         self.setVisible(False)
 
+    def set_progress(self, stage: str, percent: int):
+        self.stage_label.setText(f"{stage} ({percent}%)")
+        self.progress_bar.setValue(percent)
+
+    def reset(self):
+        self.stage_label.setText("")
+        self.progress_bar.setValue(0)
+        self.cancel_button.setEnabled(True)
+        self.cancel_button.setText("Cancelar")
+
+    def _on_cancel_clicked(self):
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.setText("Cancelando...")
+        self.cancel_requested.emit()
+
     def paintEvent(self, event):
         painter = QPainter(self)
         painter.setRenderHint(QPainter.RenderHint.Antialiasing)
@@ -36,4 +65,4 @@ class LoadingOverlay(QWidget):
 
     def hideEvent(self, event):
         super().hideEvent(event)
-        self.movie.stop()
\ No newline at end of file
+        self.movie.stop()
@@ -1,6 +1,9 @@
-from PySide6.QtCore import Qt
-from PySide6.QtGui import QFontMetrics
+from PySide6.QtCore import Qt, Signal, QSize, QRect, QRectF, QPoint, QEvent
+from PySide6.QtGui import QFont, QFontMetrics, QColor, QPainter, QPen
 from PySide6.QtWidgets import QStyledItemDelegate, QComboBox, QStyle
+from src.core.theme_manager import ThemeManager
+from src.core.search_index import patient_key
+from .result_models import PatientRole, InfoRole, ExpandedRole, SECTION_OBRIGATORIOS, SECTION_RESOLVIDOS
 
 
 class ComboBoxDelegate(QStyledItemDelegate):
@@ -8,20 +11,23 @@ class ComboBoxDelegate(QStyledItemDelegate):
     def __init__(self, items, parent=None):
         super().__init__(parent)
         self.items = items
+        # Largura da lista suspensa; depende só dos itens e da fonte, então é medida no primeiro editor.
+        self._popup_width = None
+
+    def set_items(self, items):
+        self.items = items
+        self._popup_width = None
 
     def createEditor(self, parent, option, index):
         editor = QComboBox(parent)
         editor.addItems(self.items)
 
-        font_metrics = QFontMetrics(editor.font())
-        max_width = 0
-        for item in self.items:
-            width = font_metrics.horizontalAdvance(item)
-            if width > max_width:
-                max_width = width
-
-        extra_space = editor.style().pixelMetric(QStyle.PixelMetric.PM_ScrollBarExtent) + 40
-        editor.view().setMinimumWidth(max_width + extra_space)
+        if self._popup_width is None:
+            font_metrics = QFontMetrics(editor.font())
+            max_width = max((font_metrics.horizontalAdvance(item) for item in self.items), default=0)
+            extra_space = editor.style().pixelMetric(QStyle.PixelMetric.PM_ScrollBarExtent) + 40
+            self._popup_width = max_width + extra_space
+        editor.view().setMinimumWidth(self._popup_width)
         
         return editor
 
@@ -39,4 +45,234 @@ class ComboBoxDelegate(QStyledItemDelegate):
         model.setData(index, value, Qt.ItemDataRole.EditRole)
 
     def updateEditorGeometry(self, editor, option, index):
-        editor.setGeometry(option.rect)
\ No newline at end of file
+        editor.setGeometry(option.rect)
+
+class _CardLayout:
+    """Geometria de um card, calculada uma vez por paciente/largura/estado de expansão."""
+    __slots__ = ('info', 'height', 'ops', 'targets')
+
+    def __init__(self, info):
+        self.info = info
+        self.height = 0
+        self.ops = []
+        self.targets = []
+
+
+class PatientCardDelegate(QStyledItemDelegate):
+    """Desenha os cards de resultado da análise diretamente no viewport, sem widgets por paciente.
+
+    Cada card tem cabeçalho colorido pelo status, resumo, motivo da internação e as seções recolhíveis de
+    exames obrigatórios pendentes (com botão OK por exame) e de exames resolvidos manualmente. Cliques em
+    seções e botões são tratados em editorEvent por teste de posição.
+    """
+    override_requested = Signal(str, str)
+
+    STATUS_COLORS = {'Em dia': '#28a745', 'Pendente': '#fd7e14', 'Pendência de Coleta': '#ffc107', 'Internado': '#6c757d'}
+    STATUS_ICONS = {'Em dia': '✔', 'Pendente': '⚠️', 'Pendência de Coleta': '❓', 'Internado': '🏥'}
+    CARD_MARGIN = 6
+    PAD_X, PAD_Y = 15, 10
+    SPACING = 8
+    OK_SIZE = QSize(45, 26)
+    LAYOUT_CACHE_LIMIT = 2000
+
+    def __init__(self, palette=None, parent=None):
+        super().__init__(parent)
+        self.palette = palette or ThemeManager.palette
+        self._font_key = None
+        self._layouts = {}
+
+    def set_palette(self, palette):
+        # Só as cores mudam; a geometria dos cards em cache continua válida.
+        self.palette = palette
+
+    def _ensure_fonts(self, base_font):
+        if self._font_key == base_font.key():
+            return
+        self._font_key = base_font.key()
+        self._layouts.clear()
+        self.body_font = QFont(base_font)
+        self.bold_font = QFont(base_font)
+        self.bold_font.setWeight(QFont.Weight.DemiBold)
+        self.italic_font = QFont(base_font)
+        self.italic_font.setItalic(True)
+        self.small_font = QFont(base_font)
+        self.small_font.setPointSizeF(max(base_font.pointSizeF() - 1.5, 7))
+        self.header_font = QFont(base_font)
+        self.header_font.setPointSizeF(11)
+        self.header_font.setWeight(QFont.Weight.DemiBold)
+        self.header_small_font = QFont(self.header_font)
+        self.header_small_font.setPointSizeF(9)
+        self.header_small_font.setWeight(QFont.Weight.Medium)
+        self.icon_font = QFont(base_font)
+        self.icon_font.setPointSizeF(14)
+        self.status_font = QFont(base_font)
+        self.status_font.setPointSizeF(10)
+        self.status_font.setBold(True)
+        self.fm_body = QFontMetrics(self.body_font)
+        self.fm_small = QFontMetrics(self.small_font)
+        self.fm_header = QFontMetrics(self.header_font)
+        self.fm_header_small = QFontMetrics(self.header_small_font)
+        self.fm_bold = QFontMetrics(self.bold_font)
+        self.fm_status = QFontMetrics(self.status_font)
+
+    def _wrapped_height(self, metrics, width, text):
+        return metrics.boundingRect(0, 0, width, 100000, int(Qt.TextFlag.TextWordWrap), text).height()
+
+    def _card_layout(self, index, width):
+        patient = index.data(PatientRole)
+        info = index.data(InfoRole)
+        expanded = index.data(ExpandedRole)
+        key = (patient, width, expanded)
+        cached = self._layouts.get(key)
+        if cached is not None and cached.info is info:
+            return cached
+        layout = _CardLayout(info)
+        ops, targets = layout.ops, layout.targets
+        inner_w = width - 2 * self.PAD_X
+        y = 0
+        header_h = self.fm_header.height() + self.fm_header_small.height() + 16
+        ops.append(('header', QRect(0, y, width, header_h), None))
+        y += header_h + self.PAD_Y
+        if summary := info.get('exames_faltantes', ''):
+            h = self._wrapped_height(self.fm_body, inner_w, summary)
+            ops.append(('summary', QRect(self.PAD_X, y, inner_w, h), summary))
+            y += h + self.SPACING
+        if motivo := info.get('motivo_internacao'):
+            text = f"Motivo da Internação: {motivo}"
+            h = self._wrapped_height(self.fm_body, inner_w, text)
+            ops.append(('text', QRect(self.PAD_X, y, inner_w, h), text))
+            y += h + self.SPACING
+        toggle_h = self.fm_body.height() + 16
+        sections = ((SECTION_OBRIGATORIOS, "Exames Obrigatórios Pendentes", info.get('detalhes_obrigatorios', [])),
+                    (SECTION_RESOLVIDOS, "Exames Resolvidos Manualmente", info.get('detalhes_resolvidos', [])))
+        for section, title, items in sections:
+            if not items:
+                continue
+            is_open = section in expanded
+            toggle_rect = QRect(self.PAD_X, y, inner_w, toggle_h)
+            ops.append(('toggle', toggle_rect, f"{'▼' if is_open else '►'} {title} ({len(items)})"))
+            targets.append((toggle_rect, 'toggle', section))
+            y += toggle_h + self.SPACING
+            if not is_open:
+                continue
+            for item in items:
+                if section == SECTION_OBRIGATORIOS:
+                    row_h = max(self.fm_body.height() + self.fm_small.height() + 4, self.OK_SIZE.height())
+                    ok_rect = QRect(self.PAD_X + inner_w - self.OK_SIZE.width(), y + (row_h - self.OK_SIZE.height()) // 2,
+                                    self.OK_SIZE.width(), self.OK_SIZE.height())
+                    text_rect = QRect(self.PAD_X + 10, y, inner_w - self.OK_SIZE.width() - 20, row_h)
+                    ops.append(('exam', text_rect, item))
+                    ops.append(('ok', ok_rect, None))
+                    targets.append((ok_rect, 'ok', item['exame']))
+                else:
+                    row_h = self.fm_body.height()
+                    ops.append(('resolved', QRect(self.PAD_X + 10, y, inner_w - 10, row_h), item))
+                y += row_h + self.SPACING
+        layout.height = y + self.PAD_Y - self.SPACING + 2 * self.CARD_MARGIN
+        if len(self._layouts) >= self.LAYOUT_CACHE_LIMIT:
+            self._layouts.clear()
+        self._layouts[key] = layout
+        return layout
+
+    def sizeHint(self, option, index):
+        self._ensure_fonts(option.font)
+        width = option.rect.width() if option.rect.width() > 0 else 600
+        return QSize(width, self._card_layout(index, width).height)
+
+    def paint(self, painter, option, index):
+        self._ensure_fonts(option.font)
+        rect = option.rect
+        layout = self._card_layout(index, rect.width())
+        nome, cns = index.data(PatientRole)
+        status = layout.info.get('status', 'N/A')
+        palette = self.palette
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.translate(rect.left(), rect.top() + self.CARD_MARGIN)
+        card = QRectF(0.5, 0.5, rect.width() - 1, layout.height - 2 * self.CARD_MARGIN - 1)
+        painter.setPen(QPen(QColor(palette.border), 1))
+        painter.setBrush(QColor(palette.surface))
+        painter.drawRoundedRect(card, 8, 8)
+        for kind, r, payload in layout.ops:
+            if kind == 'header':
+                header_color = QColor(self.STATUS_COLORS.get(status, palette.primary))
+                # O cabeçalho amarelo pede texto escuro em qualquer tema.
+                text_color = QColor('#1C1C1E' if status == 'Pendência de Coleta' else '#ffffff')
+                # Cantos arredondados só em cima: retângulo arredondado + metade inferior reta.
+                painter.setPen(Qt.PenStyle.NoPen)
+                painter.setBrush(header_color)
+                painter.drawRoundedRect(QRectF(r).adjusted(0.5, 0.5, -0.5, 0), 8, 8)
+                painter.drawRect(QRectF(r.left() + 0.5, r.center().y(), r.width() - 1, r.height() / 2))
+                painter.setPen(text_color)
+                painter.setFont(self.icon_font)
+                icon_rect = QRect(r.left() + self.PAD_X, r.top(), 32, r.height())
+                painter.drawText(icon_rect, int(Qt.AlignmentFlag.AlignVCenter | Qt.AlignmentFlag.AlignLeft), self.STATUS_ICONS.get(status, '●'))
+                painter.setFont(self.status_font)
+                status_text = status.upper()
+                status_w = self.fm_status.horizontalAdvance(status_text) + 4
+                painter.drawText(QRect(r.right() - self.PAD_X - status_w, r.top(), status_w, r.height()),
+                                 int(Qt.AlignmentFlag.AlignVCenter | Qt.AlignmentFlag.AlignRight), status_text)
+                name_x = icon_rect.right() + 8
+                name_w = r.width() - name_x - status_w - 2 * self.PAD_X
+                painter.setFont(self.header_font)
+                painter.drawText(QRect(name_x, r.top() + 8, name_w, self.fm_header.height()),
+                                 int(Qt.AlignmentFlag.AlignLeft), self.fm_header.elidedText(nome, Qt.TextElideMode.ElideRight, name_w))
+                painter.setFont(self.header_small_font)
+                painter.drawText(QRect(name_x, r.top() + 8 + self.fm_header.height(), name_w, self.fm_header_small.height()),
+                                 int(Qt.AlignmentFlag.AlignLeft), f"CNS: {cns}")
+            elif kind == 'summary':
+                painter.setFont(self.italic_font)
+                painter.setPen(QColor(palette.text_secondary))
+                painter.drawText(r, int(Qt.TextFlag.TextWordWrap), payload)
+            elif kind == 'text':
+                painter.setFont(self.body_font)
+                painter.setPen(QColor(palette.text_primary))
+                painter.drawText(r, int(Qt.TextFlag.TextWordWrap), payload)
+            elif kind == 'toggle':
+                painter.setPen(Qt.PenStyle.NoPen)
+                painter.setBrush(QColor(palette.surface_variant))
+                painter.drawRoundedRect(QRectF(r), 6, 6)
+                painter.setFont(self.bold_font)
+                painter.setPen(QColor(palette.text_primary))
+                painter.drawText(r.adjusted(8, 0, -8, 0), int(Qt.AlignmentFlag.AlignVCenter | Qt.AlignmentFlag.AlignLeft), payload)
+            elif kind == 'exam':
+                painter.setPen(QColor(palette.text_primary))
+                painter.setFont(self.bold_font)
+                line_h = self.fm_body.height()
+                painter.drawText(QRect(r.left(), r.top(), r.width(), line_h), int(Qt.AlignmentFlag.AlignLeft),
+                                 self.fm_bold.elidedText(f"{payload['exame']} (Freq: {payload['frequencia']})", Qt.TextElideMode.ElideRight, r.width()))
+                painter.setFont(self.small_font)
+                painter.setPen(QColor(palette.text_secondary))
+                painter.drawText(QRect(r.left(), r.top() + line_h + 2, r.width(), self.fm_small.height()), int(Qt.AlignmentFlag.AlignLeft),
+                                 f"Último: {payload['ultimo_realizado']} | Próximo: {payload['proxima_data']}")
+            elif kind == 'ok':
+                painter.setPen(Qt.PenStyle.NoPen)
+                painter.setBrush(QColor(palette.success))
+                painter.drawRoundedRect(QRectF(r), 4, 4)
+                painter.setFont(self.small_font)
+                painter.setPen(QColor('#ffffff'))
+                painter.drawText(r, int(Qt.AlignmentFlag.AlignCenter), "OK")
+            elif kind == 'resolved':
+                painter.setFont(self.body_font)
+                painter.setPen(QColor(palette.text_primary))
+                painter.drawText(r, int(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter),
+                                 f"• {payload['exame']}: {payload['status']}")
+        painter.restore()
+
+    def editorEvent(self, event, model, option, index):
+        if event.type() != QEvent.Type.MouseButtonRelease or event.button() != Qt.MouseButton.LeftButton:
+            return super().editorEvent(event, model, option, index)
+        self._ensure_fonts(option.font)
+        layout = self._card_layout(index, option.rect.width())
+        pos = event.position().toPoint() - option.rect.topLeft() - QPoint(0, self.CARD_MARGIN)
+        for rect, action, payload in layout.targets:
+            if not rect.contains(pos):
+                continue
+            if action == 'toggle':
+                expanded = set(index.data(ExpandedRole))
+                expanded.symmetric_difference_update({payload})
+                model.setData(index, expanded, ExpandedRole)
+            elif action == 'ok':
+                self.override_requested.emit(patient_key(*index.data(PatientRole)), payload)
+            return True
+        return False
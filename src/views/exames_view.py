@@ -1,4 +1,4 @@
-from PySide6.QtCore import Signal
+from PySide6.QtCore import Qt, Signal
 from PySide6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton,
     QTableWidget, QTableWidgetItem, QHeaderView, QMessageBox,
@@ -6,12 +6,14 @@ from PySide6.QtWidgets import (
 )
 from src.core import database_manager as db
 from src.core.notification_service import NotificationService
+from src.core.write_queue import WriteQueue
 
 class ExamesView(QWidget):
     exames_changed = Signal()
 
     def __init__(self, parent=None):
         super().__init__(parent)
+        self.usage_index = {}
         self.main_layout = QVBoxLayout(self)
         self.main_layout.setContentsMargins(20, 20, 20, 20)
         self.main_layout.setSpacing(15)
@@ -39,10 +41,11 @@ class ExamesView(QWidget):
         add_layout.addWidget(self.aliases_input, 2, 1)
         add_layout.setColumnStretch(1, 1)
         self.table = QTableWidget()
-        self.table.setColumnCount(2)
-        self.table.setHorizontalHeaderLabels(["Nome Padrão", "Apelidos (separados por vírgula)"])
+        self.table.setColumnCount(3)
+        self.table.setHorizontalHeaderLabels(["Nome Padrão", "Apelidos (separados por vírgula)", "Usado em"])
         self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
         self.table.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeMode.Stretch)
+        self.table.horizontalHeader().setSectionResizeMode(2, QHeaderView.ResizeMode.ResizeToContents)
         self.table.verticalHeader().setVisible(False)
         self.table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
         self.table.setAlternatingRowColors(True)
@@ -68,6 +71,7 @@ class ExamesView(QWidget):
         self.table.blockSignals(True)
         self.table.setRowCount(0)
         exames_dict = db.get_exames_with_aliases()
+        self.usage_index = db.get_exame_usage_index()
         for nome_padrao, details in sorted(exames_dict.items()):
             row_position = self.table.rowCount()
             self.table.insertRow(row_position)
@@ -76,9 +80,32 @@ class ExamesView(QWidget):
             aliases_item = QTableWidgetItem(aliases_str)
             self.table.setItem(row_position, 0, nome_item)
             self.table.setItem(row_position, 1, aliases_item)
+            self.table.setItem(row_position, 2, self._usage_item(nome_padrao))
         self.table.blockSignals(False)
         self._update_button_state()
 
+    def _usage_item(self, nome_padrao):
+        rotinas = self.usage_index.get(nome_padrao, ())
+        item = QTableWidgetItem(f"{len(rotinas)} rotina(s)" if rotinas else "-")
+        item.setFlags(item.flags() & ~Qt.ItemFlag.ItemIsEditable)
+        item.setToolTip(", ".join(rotinas))
+        return item
+
+    def _refresh_usage(self):
+        # Regras de rotina podem ter mudado em outra tela; o índice vem do cache enquanto a configuração não mudar.
+        usage_index = db.get_exame_usage_index()
+        if usage_index is self.usage_index:
+            return
+        self.usage_index = usage_index
+        for row in range(self.table.rowCount()):
+            nome_item = self.table.item(row, 0)
+            if nome_item:
+                self.table.setItem(row, 2, self._usage_item(nome_item.text()))
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self._refresh_usage()
+
     def _add_row_to_table(self):
         nome_padrao = self.nome_input.text().strip()
         if not nome_padrao:
@@ -94,6 +121,7 @@ class ExamesView(QWidget):
         aliases_item = QTableWidgetItem(self.aliases_input.text().strip())
         self.table.setItem(row_position, 0, nome_item)
         self.table.setItem(row_position, 1, aliases_item)
+        self.table.setItem(row_position, 2, self._usage_item(nome_padrao))
         self.nome_input.clear()
         self.aliases_input.clear()
         self.nome_input.setFocus()
@@ -103,7 +131,8 @@ class ExamesView(QWidget):
         if not selected_rows:
             return
         exames_to_remove = [self.table.item(row, 0).text() for row in selected_rows]
-        usage_report = {exame: db.check_exame_usage(exame) for exame in exames_to_remove if db.check_exame_usage(exame)}
+        self._refresh_usage()
+        usage_report = {exame: self.usage_index[exame] for exame in exames_to_remove if exame in self.usage_index}
         if usage_report:
             msg = "Os seguintes exames não podem ser removidos pois estão em uso:\n\n"
             for exame, rotinas in usage_report.items():
@@ -135,13 +164,14 @@ class ExamesView(QWidget):
             aliases_str = aliases_item.text() if aliases_item else ""
             aliases = sorted(list(set(alias.strip() for alias in aliases_str.split(',') if alias.strip())))
             novos_exames_dict[nome_padrao] = {"aliases": aliases}
-        try:
-            db.save_exames_from_dict(novos_exames_dict)
-            NotificationService.show("Exames e apelidos salvos com sucesso!")
-            self._load_exames()
-            self.exames_changed.emit()
-        except Exception as e:
-            QMessageBox.critical(self, "Erro ao Salvar", f"Não foi possível salvar os dados.\n\nErro: {e}")
+        WriteQueue.submit(db.save_exames_from_dict, novos_exames_dict,
+                          on_success=self._on_exames_saved,
+                          success_message="Exames e apelidos salvos com sucesso!",
+                          error_message="Não foi possível salvar os exames")
+
+    def _on_exames_saved(self, _):
+        self._load_exames()
+        self.exames_changed.emit()
 
     def _update_button_state(self):
         self.remove_btn.setEnabled(len(self.table.selectedItems()) > 0)
\ No newline at end of file
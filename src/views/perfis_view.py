@@ -6,6 +6,7 @@ from PySide6.QtWidgets import (
 )
 from src.core import database_manager as db
 from src.core.notification_service import NotificationService
+from src.core.write_queue import WriteQueue
 
 class PerfisView(QWidget):
     def __init__(self, parent=None):
@@ -101,7 +102,7 @@ class PerfisView(QWidget):
 
     def _populate_rotina_selector(self):
         self.rotina_selector_combo.clear()
-        self.rotina_selector_combo.addItems(["-- Nenhuma --"] + db.get_rotina_names())
+        self.rotina_selector_combo.addItems(["-- Nenhuma --", *db.get_rotina_names()])
 
     def _populate_clinics_lists(self, assigned_clinics=None):
         assigned_clinics = assigned_clinics or []
@@ -155,13 +156,14 @@ class PerfisView(QWidget):
         if selected_rotina == "-- Nenhuma --":
             selected_rotina = ""
         assigned_clinics = [self.assigned_clinics_list.item(i).text() for i in range(self.assigned_clinics_list.count())]
-        try:
-            db.save_perfil(self.current_profile_name, new_profile_name, selected_rotina, assigned_clinics)
-            NotificationService.show(f"Perfil '{new_profile_name}' salvo com sucesso!")
-            self._populate_profile_selector()
-            self.profile_selector_combo.setCurrentText(new_profile_name)
-        except Exception as e:
-            QMessageBox.critical(self, "Erro ao Salvar", f"Não foi possível salvar o perfil.\n\nErro: {e}")
+        WriteQueue.submit(db.save_perfil, self.current_profile_name, new_profile_name, selected_rotina, assigned_clinics,
+                          on_success=lambda _: self._on_profile_saved(new_profile_name),
+                          success_message=f"Perfil '{new_profile_name}' salvo com sucesso!",
+                          error_message="Não foi possível salvar o perfil")
+
+    def _on_profile_saved(self, profile_name):
+        self._populate_profile_selector()
+        self.profile_selector_combo.setCurrentText(profile_name)
 
     def _delete_profile(self):
         if not self.current_profile_name: return
@@ -170,9 +172,11 @@ class PerfisView(QWidget):
                                      QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
                                      QMessageBox.StandardButton.No)
         if reply == QMessageBox.StandardButton.Yes:
-            try:
-                db.delete_perfil(self.current_profile_name)
-                NotificationService.show(f"Perfil '{self.current_profile_name}' deletado.", "info")
-                self.load_initial_data()
-            except Exception as e:
-                QMessageBox.critical(self, "Erro ao Deletar", f"Não foi possível deletar o perfil.\n\nErro: {e}")
\ No newline at end of file
+            nome = self.current_profile_name
+            WriteQueue.submit(db.delete_perfil, nome,
+                              on_success=lambda _: self._on_profile_deleted(nome),
+                              error_message="Não foi possível deletar o perfil")
+
+    def _on_profile_deleted(self, profile_name):
+        NotificationService.show(f"Perfil '{profile_name}' deletado.", "info")
+        self.load_initial_data()
\ No newline at end of file
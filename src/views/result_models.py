@@ -0,0 +1,133 @@
+from PySide6.QtCore import Qt, QAbstractListModel, QModelIndex, QSortFilterProxyModel
+from src.core.search_index import PatientSearchIndex, patient_key
+
+STATUS_ORDER = {'Internado': 0, 'Pendência de Coleta': 1, 'Pendente': 2, 'Em dia': 3}
+
+# Roles usadas pelo PatientCardDelegate.
+PatientRole = Qt.ItemDataRole.UserRole + 1
+InfoRole = Qt.ItemDataRole.UserRole + 2
+ExpandedRole = Qt.ItemDataRole.UserRole + 3
+
+# Seções recolhíveis de cada card.
+SECTION_OBRIGATORIOS = 'obrigatorios'
+SECTION_RESOLVIDOS = 'resolvidos'
+
+def sort_key(item):
+    patient, info = item
+    return (STATUS_ORDER.get(info['status'], 99), patient[0])
+
+class PatientResultsModel(QAbstractListModel):
+    """Lista de resultados da análise, um item por paciente: ((nome, cns), info).
+
+    O estado de expansão das seções fica no modelo, por paciente (search_index.patient_key), para sobreviver a
+    refiltragens.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._rows = []
+        self._row_by_patient = {}
+        self._expanded = {}
+        self.search_index = PatientSearchIndex()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        patient, info = self._rows[index.row()]
+        if role == PatientRole:
+            return patient
+        if role == InfoRole:
+            return info
+        if role == ExpandedRole:
+            return self._expanded.get(patient_key(*patient), frozenset())
+        if role == Qt.ItemDataRole.DisplayRole:
+            return patient[0]
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return f"{patient[0]} - CNS: {patient[1]}"
+        return None
+
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        if not index.isValid() or role != ExpandedRole:
+            return False
+        self._expanded[patient_key(*self._rows[index.row()][0])] = frozenset(value)
+        self.dataChanged.emit(index, index, [ExpandedRole])
+        return True
+
+    def set_results(self, items):
+        """Substitui o conteúdo por `items` (iterável de (paciente, info)), ordenados por status e nome."""
+        self.beginResetModel()
+        self._rows = sorted(items, key=sort_key)
+        self._row_by_patient = {patient: row for row, (patient, _) in enumerate(self._rows)}
+        self.search_index = PatientSearchIndex()
+        for row, ((nome, cns), info) in enumerate(self._rows):
+            self.search_index.add(row, nome, cns, info['status'], info.get('clinica'))
+        self.endResetModel()
+
+    def append_results(self, items):
+        """Acrescenta `items` ao fim da lista, na ordem recebida. Usado enquanto a análise ainda entrega lotes;
+        set_results reordena tudo no final."""
+        items = [item for item in items if item[0] not in self._row_by_patient]
+        if not items:
+            return
+        first = len(self._rows)
+        for row, ((nome, cns), info) in enumerate(items, first):
+            self._row_by_patient[(nome, cns)] = row
+            self.search_index.add(row, nome, cns, info['status'], info.get('clinica'))
+        self.beginInsertRows(QModelIndex(), first, first + len(items) - 1)
+        self._rows.extend(items)
+        self.endInsertRows()
+
+    def update_patients(self, alterados):
+        """Troca o info dos pacientes informados sem recriar o modelo."""
+        for patient, info in alterados.items():
+            row = self._row_by_patient.get(patient)
+            if row is None:
+                continue
+            self._rows[row] = (patient, info)
+            self.search_index.update_status(row, info['status'])
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [InfoRole])
+
+    def row_item(self, row):
+        return self._rows[row]
+
+    def clear_expanded(self):
+        self._expanded.clear()
+
+class PatientResultsFilterProxy(QSortFilterProxyModel):
+    """Mostra só as linhas do modelo de origem que atendem à busca, ao status e à clínica.
+
+    O conjunto de linhas é calculado pelo índice de busca em set_filter; linhas acrescentadas depois
+    (lotes de uma análise em andamento) são conferidas uma a uma com PatientSearchIndex.matches.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._criteria = None
+        self._allowed_rows = None
+        self._filtered_upto = 0
+
+    def set_filter(self, query="", status=None, clinica=None):
+        index = self.sourceModel().search_index
+        if query.strip() or status is not None or clinica is not None:
+            self._criteria = (query, status, clinica)
+            self._allowed_rows = index.filter(query, status, clinica)
+        else:
+            self._criteria = None
+            self._allowed_rows = None
+        self._filtered_upto = len(index)
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        if self._criteria is None:
+            return True
+        if source_row < self._filtered_upto:
+            return source_row in self._allowed_rows
+        return self.sourceModel().search_index.matches(source_row, *self._criteria)
+
+    def source_rows(self):
+        """Linhas de origem visíveis, na ordem da lista."""
+        return [self.mapToSource(self.index(row, 0)).row() for row in range(self.rowCount())]
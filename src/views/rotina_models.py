@@ -0,0 +1,146 @@
+from PySide6.QtCore import Qt, QAbstractItemModel, QModelIndex
+
+HEADERS = ["Exame / Regra", "Período", "Frequência", "Tipo"]
+# Regra exibida para exames sem configuração na rotina.
+DEFAULT_RULE = ("Sempre", "Não Cobra", "Opcional")
+NEW_RULE = ("Sempre", "Mensal", "Opcional")
+_EXAME_FLAGS = Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable
+_RULE_FLAGS = _EXAME_FLAGS | Qt.ItemFlag.ItemIsEditable
+
+class RotinaRulesModel(QAbstractItemModel):
+    """Árvore exame -> regras da rotina em edição.
+
+    Linhas de primeiro nível são os exames (internalId 0); as regras são filhas, com internalId igual à
+    linha do exame + 1. Cada regra é a lista [Período, Frequência, Tipo]. O modelo guarda as regras como
+    foram carregadas e mantém o conjunto de exames alterados, para que o salvamento envie só esses.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._exames = []
+        self._rules = []
+        self._saved = []
+        self._dirty = set()
+
+    def set_rotina(self, exames, rotina_details):
+        self.beginResetModel()
+        self._exames = list(exames)
+        self._saved = [tuple((r["Período"], r["Frequência"], r["Tipo"]) for r in rotina_details.get(exame, ()))
+                       or (DEFAULT_RULE,) for exame in self._exames]
+        self._rules = [[list(rule) for rule in rules] for rules in self._saved]
+        self._dirty.clear()
+        self.endResetModel()
+
+    def clear(self):
+        self.set_rotina((), {})
+
+    def index(self, row, column, parent=QModelIndex()):
+        if not 0 <= column < len(HEADERS) or row < 0:
+            return QModelIndex()
+        if not parent.isValid():
+            return self.createIndex(row, column, 0) if row < len(self._exames) else QModelIndex()
+        if parent.internalId() != 0 or row >= len(self._rules[parent.row()]):
+            return QModelIndex()
+        return self.createIndex(row, column, parent.row() + 1)
+
+    def parent(self, index):
+        if not index.isValid() or index.internalId() == 0:
+            return QModelIndex()
+        return self.createIndex(index.internalId() - 1, 0, 0)
+
+    def rowCount(self, parent=QModelIndex()):
+        if not parent.isValid():
+            return len(self._exames)
+        if parent.internalId() == 0 and parent.column() == 0:
+            return len(self._rules[parent.row()])
+        return 0
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return HEADERS[section]
+        return None
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role not in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.EditRole):
+            return None
+        if index.internalId() == 0:
+            return self._exames[index.row()] if index.column() == 0 else None
+        if index.column() == 0:
+            return f"Regra {index.row() + 1}"
+        return self._rules[index.internalId() - 1][index.row()][index.column() - 1]
+
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        if not index.isValid() or role != Qt.ItemDataRole.EditRole or index.internalId() == 0 or index.column() == 0:
+            return False
+        exame_row = index.internalId() - 1
+        rule = self._rules[exame_row][index.row()]
+        if rule[index.column() - 1] == value:
+            return False
+        rule[index.column() - 1] = value
+        self._update_dirty(exame_row)
+        self.dataChanged.emit(index, index, [role])
+        return True
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.ItemFlag.NoItemFlags
+        return _RULE_FLAGS if index.internalId() != 0 and index.column() > 0 else _EXAME_FLAGS
+
+    def is_rule(self, index):
+        return index.isValid() and index.internalId() != 0
+
+    def exame_row(self, index):
+        return index.row() if index.internalId() == 0 else index.internalId() - 1
+
+    def exame_name(self, row):
+        return self._exames[row]
+
+    def rule_count(self, exame_row):
+        return len(self._rules[exame_row])
+
+    def add_rule(self, exame_row):
+        parent = self.index(exame_row, 0)
+        row = len(self._rules[exame_row])
+        self.beginInsertRows(parent, row, row)
+        self._rules[exame_row].append(list(NEW_RULE))
+        self.endInsertRows()
+        self._update_dirty(exame_row)
+        return self.index(row, 0, parent)
+
+    def remove_rule(self, exame_row, rule_row):
+        parent = self.index(exame_row, 0)
+        self.beginRemoveRows(parent, rule_row, rule_row)
+        del self._rules[exame_row][rule_row]
+        self.endRemoveRows()
+        # Os rótulos "Regra N" das linhas seguintes mudam.
+        remaining = len(self._rules[exame_row])
+        if rule_row < remaining:
+            self.dataChanged.emit(self.index(rule_row, 0, parent), self.index(remaining - 1, 0, parent))
+        self._update_dirty(exame_row)
+
+    def _update_dirty(self, exame_row):
+        if tuple(map(tuple, self._rules[exame_row])) == self._saved[exame_row]:
+            self._dirty.discard(exame_row)
+        else:
+            self._dirty.add(exame_row)
+
+    def is_dirty(self):
+        return bool(self._dirty)
+
+    def dirty_config(self):
+        """Regras dos exames alterados desde o carregamento, no formato de db.save_rotina."""
+        return {self._exames[row]: [{"Período": p, "Frequência": f, "Tipo": t} for p, f, t in self._rules[row]]
+                for row in sorted(self._dirty)}
+
+    def mark_saved(self, config):
+        """Registra `config` (o que foi enviado ao banco) como o novo estado salvo."""
+        rows = {exame: row for row, exame in enumerate(self._exames)}
+        for exame, rules in config.items():
+            row = rows.get(exame)
+            if row is None:
+                continue
+            self._saved[row] = tuple((r["Período"], r["Frequência"], r["Tipo"]) for r in rules)
+            self._update_dirty(row)
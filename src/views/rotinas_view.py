@@ -1,13 +1,110 @@
-from PySide6.QtCore import Qt, Slot
+from PySide6.QtCore import Qt, Slot, QModelIndex
 from PySide6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QLabel,
-    QPushButton, QComboBox, QLineEdit, QTreeWidget,
-    QTreeWidgetItem, QHeaderView, QMessageBox, QFrame,
-    QGridLayout
+    QPushButton, QComboBox, QLineEdit, QTreeView,
+    QHeaderView, QMessageBox, QFrame, QGridLayout,
+    QAbstractItemView, QDialog, QDialogButtonBox,
+    QTableWidget, QTableWidgetItem
 )
 from src.core import database_manager as db
+from src.core.rule_engine import Periodo
 from src.core.notification_service import NotificationService
+from src.core.write_queue import WriteQueue
 from .delegates import ComboBoxDelegate
+from .rotina_models import RotinaRulesModel
+
+class PeriodosDialog(QDialog):
+    """Cadastro dos períodos das regras: nome e faixa de meses de tratamento (em branco = sem limite)."""
+    COLUMNS = ["Nome", "Do mês", "Até o mês", "Usado em"]
+
+    def __init__(self, periodos, usage_index, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Períodos das Regras")
+        self.resize(640, 360)
+        self.usage_index = usage_index
+        layout = QVBoxLayout(self)
+        layout.addWidget(QLabel("Quando mais de um período contém o mês do paciente, vale o de faixa mais estreita; "
+                                "'Do mês' e 'Até o mês' em branco deixam a faixa aberta."))
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        self.table.verticalHeader().setVisible(False)
+        for periodo in periodos:
+            self._append_row(periodo, existente=True)
+        buttons_layout = QHBoxLayout()
+        add_btn = QPushButton("Adicionar Período")
+        remove_btn = QPushButton("Remover Período")
+        remove_btn.setObjectName("removeButton")
+        buttons_layout.addWidget(add_btn)
+        buttons_layout.addWidget(remove_btn)
+        buttons_layout.addStretch()
+        button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Save | QDialogButtonBox.StandardButton.Cancel)
+        layout.addWidget(self.table)
+        layout.addLayout(buttons_layout)
+        layout.addWidget(button_box)
+        add_btn.clicked.connect(self._add_row)
+        remove_btn.clicked.connect(self._remove_row)
+        button_box.accepted.connect(self._validate_and_accept)
+        button_box.rejected.connect(self.reject)
+
+    def _append_row(self, periodo, existente):
+        row = self.table.rowCount()
+        self.table.insertRow(row)
+        nome_item = QTableWidgetItem(periodo.nome)
+        if existente:
+            # Renomear deixaria órfãs as regras gravadas com o nome antigo.
+            nome_item.setFlags(nome_item.flags() & ~Qt.ItemFlag.ItemIsEditable)
+        uso_item = QTableWidgetItem(", ".join(self.usage_index.get(periodo.nome, ())))
+        uso_item.setFlags(uso_item.flags() & ~Qt.ItemFlag.ItemIsEditable)
+        self.table.setItem(row, 0, nome_item)
+        self.table.setItem(row, 1, QTableWidgetItem("" if periodo.mes_inicio is None else str(periodo.mes_inicio)))
+        self.table.setItem(row, 2, QTableWidgetItem("" if periodo.mes_fim is None else str(periodo.mes_fim)))
+        self.table.setItem(row, 3, uso_item)
+        return row
+
+    def _add_row(self):
+        row = self._append_row(Periodo("", None, None), existente=False)
+        self.table.setCurrentCell(row, 0)
+        self.table.editItem(self.table.item(row, 0))
+
+    def _remove_row(self):
+        row = self.table.currentRow()
+        if row < 0:
+            QMessageBox.warning(self, "Atenção", "Selecione um período para remover.")
+            return
+        nome = self.table.item(row, 0).text()
+        usage = self.usage_index.get(nome)
+        if usage:
+            QMessageBox.warning(self, "Período em Uso", f"O período '{nome}' não pode ser removido pois tem regras na(s) rotina(s): {', '.join(usage)}.")
+            return
+        self.table.removeRow(row)
+
+    def periodos(self):
+        return [Periodo(self.table.item(row, 0).text().strip(), self._mes(row, 1), self._mes(row, 2))
+                for row in range(self.table.rowCount())]
+
+    def _mes(self, row, column):
+        texto = self.table.item(row, column).text().strip()
+        return int(texto) if texto else None
+
+    def _validate_and_accept(self):
+        try:
+            periodos = self.periodos()
+        except ValueError:
+            QMessageBox.warning(self, "Atenção", "Os meses devem ser números inteiros ou ficar em branco.")
+            return
+        nomes = [p.nome for p in periodos]
+        if not all(nomes) or len(set(nomes)) != len(nomes):
+            QMessageBox.warning(self, "Atenção", "Cada período precisa de um nome, sem repetições.")
+            return
+        for p in periodos:
+            if any(mes is not None and mes < 1 for mes in (p.mes_inicio, p.mes_fim)):
+                QMessageBox.warning(self, "Atenção", f"Período '{p.nome}': os meses de tratamento começam em 1.")
+                return
+            if p.mes_inicio is not None and p.mes_fim is not None and p.mes_inicio > p.mes_fim:
+                QMessageBox.warning(self, "Atenção", f"Período '{p.nome}': o mês inicial é maior que o final.")
+                return
+        self.accept()
 
 class RotinasView(QWidget):
     
@@ -55,21 +152,26 @@ class RotinasView(QWidget):
         filter_layout.addWidget(QLabel("<b>Filtro:</b>"))
         filter_layout.addWidget(self.filter_input)
         
-        self.tree = QTreeWidget()
-        self.tree.setColumnCount(4)
-        self.tree.setHeaderLabels(["Exame / Regra", "Período", "Frequência", "Tipo"])
+        self.rules_model = RotinaRulesModel(self)
+        self.tree = QTreeView()
+        self.tree.setModel(self.rules_model)
         self.tree.header().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
         self.tree.setAlternatingRowColors(True)
-        self.periodo_options = ["Sempre", "Primeiro Ano", "Após Primeiro Ano", "Primeiro Mês", "Primeiro Trimestre"]
+        self.tree.setUniformRowHeights(True)
+        self.tree.setEditTriggers(QAbstractItemView.EditTrigger.DoubleClicked | QAbstractItemView.EditTrigger.EditKeyPressed)
+        # As opções de período vêm do banco (load_initial_data); as demais são fixas.
         self.freq_options = ["Mensal", "Trimestral", "Semestral", "Anual", "Não Cobra"]
         self.tipo_options = ["Obrigatório", "Opcional"]
-        self.tree.setItemDelegateForColumn(1, ComboBoxDelegate(self.periodo_options, self.tree))
+        self.periodo_delegate = ComboBoxDelegate([], self.tree)
+        self.tree.setItemDelegateForColumn(1, self.periodo_delegate)
         self.tree.setItemDelegateForColumn(2, ComboBoxDelegate(self.freq_options, self.tree))
         self.tree.setItemDelegateForColumn(3, ComboBoxDelegate(self.tipo_options, self.tree))
 
         rule_buttons_layout = QHBoxLayout()
         self.add_rule_btn = QPushButton("Adicionar Regra")
         self.remove_rule_btn = QPushButton("Remover Regra")
+        self.periodos_btn = QPushButton("Gerenciar Períodos")
+        rule_buttons_layout.addWidget(self.periodos_btn)
         rule_buttons_layout.addStretch()
         rule_buttons_layout.addWidget(self.add_rule_btn)
         rule_buttons_layout.addWidget(self.remove_rule_btn)
@@ -99,6 +201,7 @@ class RotinasView(QWidget):
         self.filter_input.textChanged.connect(self._filter_tree)
         self.add_rule_btn.clicked.connect(self._add_rule)
         self.remove_rule_btn.clicked.connect(self._remove_rule)
+        self.periodos_btn.clicked.connect(self._edit_periodos)
 
     @Slot()
     def refresh_data(self):
@@ -106,11 +209,12 @@ class RotinasView(QWidget):
 
     def load_initial_data(self):
         self._load_rotina_names()
+        self._load_periodos()
         self.all_exames = sorted(db.get_exames_with_aliases().keys())
         if self.rotina_selector_combo.count() > 0:
             self._on_rotina_selected(self.rotina_selector_combo.currentText())
         else:
-            self.tree.clear()
+            self.rules_model.clear()
             self.save_btn.setEnabled(False)
             self.delete_btn.setEnabled(False)
 
@@ -122,13 +226,25 @@ class RotinasView(QWidget):
         self.base_rotina_combo.clear()
         rotina_names = db.get_rotina_names()
         if rotina_names:
-            self.rotina_selector_combo.addItems(rotina_names)
-            self.base_rotina_combo.addItems(["-- Em Branco --"] + rotina_names)
+            self.rotina_selector_combo.addItems(list(rotina_names))
+            self.base_rotina_combo.addItems(["-- Em Branco --", *rotina_names])
             if current_selection in rotina_names:
                 self.rotina_selector_combo.setCurrentText(current_selection)
         self.rotina_selector_combo.blockSignals(False)
         self.base_rotina_combo.blockSignals(False)
 
+    def _load_periodos(self):
+        self.periodo_delegate.set_items([p.nome for p in db.get_periodos()])
+
+    def _edit_periodos(self):
+        dialog = PeriodosDialog(db.get_periodos(), db.get_periodo_usage_index(), self)
+        if dialog.exec() != QDialog.DialogCode.Accepted:
+            return
+        WriteQueue.submit(db.save_periodos, dialog.periodos(),
+                          on_success=lambda _: self._load_periodos(),
+                          success_message="Períodos atualizados com sucesso!",
+                          error_message="Não foi possível salvar os períodos")
+
     def _on_rotina_selected(self, rotina_name):
         self.current_rotina_name = rotina_name
         is_valid_rotina = bool(rotina_name)
@@ -136,59 +252,42 @@ class RotinasView(QWidget):
         self.delete_btn.setEnabled(is_valid_rotina)
         self.tree.setEnabled(is_valid_rotina)
         if not is_valid_rotina:
-            self.tree.clear()
+            self.rules_model.clear()
             return
-        rotina_details = db.get_rotina_details(rotina_name)
-        self._populate_tree(rotina_details)
-
-    def _populate_tree(self, rotina_details):
-        self.tree.clear()
-        for exame_nome in self.all_exames:
-            rules = rotina_details.get(exame_nome, [])
-            parent_item = QTreeWidgetItem(self.tree, [exame_nome])
-            parent_item.setData(0, Qt.ItemDataRole.UserRole, "exame")
-            parent_item.setFlags(parent_item.flags() & ~Qt.ItemFlag.ItemIsEditable)
-            if not rules:
-                child_item = QTreeWidgetItem(parent_item, ["Regra 1", "Sempre", "Não Cobra", "Opcional"])
-                child_item.setData(0, Qt.ItemDataRole.UserRole, "regra")
-                child_item.setFlags(child_item.flags() | Qt.ItemFlag.ItemIsEditable)
-            else:
-                for i, rule in enumerate(rules):
-                    child_item = QTreeWidgetItem(parent_item, [f"Regra {i+1}", rule["Período"], rule["Frequência"], rule["Tipo"]])
-                    child_item.setData(0, Qt.ItemDataRole.UserRole, "regra")
-                    child_item.setFlags(child_item.flags() | Qt.ItemFlag.ItemIsEditable)
-        self._filter_tree(self.filter_input.text())
+        # Troca só os dados do modelo; a árvore cria as linhas de regra sob demanda ao expandir.
+        self.rules_model.set_rotina(self.all_exames, db.get_rotina_details(rotina_name))
+        # O reset do modelo já mostra todas as linhas; só reaplica o filtro se houver um.
+        if self.filter_input.text():
+            self._filter_tree(self.filter_input.text())
 
     def _filter_tree(self, text):
         search_term = text.lower()
-        for i in range(self.tree.topLevelItemCount()):
-            item = self.tree.topLevelItem(i)
-            item.setHidden(search_term not in item.text(0).lower())
+        root = QModelIndex()
+        for row in range(self.rules_model.rowCount()):
+            hidden = search_term not in self.rules_model.exame_name(row).lower()
+            if self.tree.isRowHidden(row, root) != hidden:
+                self.tree.setRowHidden(row, root, hidden)
 
     def _add_rule(self):
-        selected_item = self.tree.currentItem()
-        if not selected_item:
+        index = self.tree.currentIndex()
+        if not index.isValid():
             QMessageBox.warning(self, "Atenção", "Selecione um exame para adicionar uma regra.")
             return
-        parent_item = selected_item if selected_item.data(0, Qt.ItemDataRole.UserRole) == "exame" else selected_item.parent()
-        rule_count = parent_item.childCount()
-        new_rule_item = QTreeWidgetItem(parent_item, [f"Regra {rule_count + 1}", "Sempre", "Mensal", "Opcional"])
-        new_rule_item.setData(0, Qt.ItemDataRole.UserRole, "regra")
-        new_rule_item.setFlags(new_rule_item.flags() | Qt.ItemFlag.ItemIsEditable)
-        parent_item.setExpanded(True)
+        exame_row = self.rules_model.exame_row(index)
+        new_index = self.rules_model.add_rule(exame_row)
+        self.tree.expand(self.rules_model.index(exame_row, 0))
+        self.tree.setCurrentIndex(new_index)
 
     def _remove_rule(self):
-        selected_item = self.tree.currentItem()
-        if not selected_item or selected_item.data(0, Qt.ItemDataRole.UserRole) != "regra":
+        index = self.tree.currentIndex()
+        if not self.rules_model.is_rule(index):
             QMessageBox.warning(self, "Atenção", "Selecione uma regra para remover.")
             return
-        parent_item = selected_item.parent()
-        if parent_item.childCount() <= 1:
+        exame_row = self.rules_model.exame_row(index)
+        if self.rules_model.rule_count(exame_row) <= 1:
             QMessageBox.warning(self, "Ação não permitida", "Cada exame deve ter pelo menos uma regra. Edite-a para 'Não Cobra' se necessário.")
             return
-        parent_item.removeChild(selected_item)
-        for i in range(parent_item.childCount()):
-            parent_item.child(i).setText(0, f"Regra {i+1}")
+        self.rules_model.remove_rule(exame_row, index.row())
 
     def _create_new_rotina(self):
         new_name = self.new_rotina_name_input.text().strip()
@@ -200,31 +299,39 @@ class RotinasView(QWidget):
             return
         base_name = self.base_rotina_combo.currentText()
         if base_name == "-- Em Branco --": base_name = None
-        try:
-            db.create_rotina(new_name, base_name)
-            NotificationService.show(f"Nova rotina '{new_name}' criada com sucesso!")
-            self.new_rotina_name_input.clear()
-            self._load_rotina_names()
-            self.rotina_selector_combo.setCurrentText(new_name)
-        except Exception as e:
-            QMessageBox.critical(self, "Erro", f"Não foi possível criar a rotina.\n\nErro: {e}")
+        self.new_rotina_name_input.clear()
+        WriteQueue.submit(db.create_rotina, new_name, base_name,
+                          on_success=lambda _: self._on_rotina_created(new_name),
+                          success_message=f"Nova rotina '{new_name}' criada com sucesso!",
+                          error_message="Não foi possível criar a rotina")
+
+    def _on_rotina_created(self, rotina_name):
+        self._load_rotina_names()
+        self.rotina_selector_combo.setCurrentText(rotina_name)
 
     def _save_rotina_changes(self):
         if not self.current_rotina_name: return
-        config_dict = {}
-        for i in range(self.tree.topLevelItemCount()):
-            parent_item = self.tree.topLevelItem(i)
-            exame_nome = parent_item.text(0)
-            rules_list = []
-            for j in range(parent_item.childCount()):
-                child_item = parent_item.child(j)
-                rules_list.append({"Período": child_item.text(1), "Frequência": child_item.text(2), "Tipo": child_item.text(3)})
-            config_dict[exame_nome] = rules_list
-        try:
-            db.save_rotina(self.current_rotina_name, config_dict)
-            NotificationService.show(f"Rotina '{self.current_rotina_name}' atualizada com sucesso!")
-        except Exception as e:
-            QMessageBox.critical(self, "Erro ao Salvar", f"Não foi possível salvar a rotina.\n\nErro: {e}")
+        if not self.rules_model.is_dirty():
+            NotificationService.show("Nenhuma alteração para salvar.", "info")
+            return
+        # Só os exames alterados vão para o banco.
+        config_dict = self.rules_model.dirty_config()
+        # A rotina guarda uma regra por exame e período; duas regras no mesmo período seriam ambíguas.
+        duplicados = sorted(exame for exame, regras in config_dict.items()
+                            if len({r["Período"] for r in regras}) != len(regras))
+        if duplicados:
+            QMessageBox.warning(self, "Períodos Repetidos",
+                                "Cada exame pode ter só uma regra por período. Corrija: " + ", ".join(duplicados))
+            return
+        nome = self.current_rotina_name
+        WriteQueue.submit(db.save_rotina, nome, config_dict, partial=True,
+                          on_success=lambda _: self._on_rotina_saved(nome, config_dict),
+                          success_message=f"Rotina '{nome}' atualizada com sucesso!",
+                          error_message="Não foi possível salvar a rotina")
+
+    def _on_rotina_saved(self, rotina_name, config_dict):
+        if rotina_name == self.current_rotina_name:
+            self.rules_model.mark_saved(config_dict)
 
     def _delete_rotina(self):
         if not self.current_rotina_name: return
@@ -237,9 +344,11 @@ class RotinasView(QWidget):
             return
         reply = QMessageBox.question(self, "Confirmar Remoção", f"Tem certeza que deseja deletar a rotina '{self.current_rotina_name}'?", QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No, QMessageBox.StandardButton.No)
         if reply == QMessageBox.StandardButton.Yes:
-            try:
-                db.delete_rotina(self.current_rotina_name)
-                NotificationService.show(f"Rotina '{self.current_rotina_name}' deletada.", "info")
-                self.load_initial_data()
-            except Exception as e:
-                QMessageBox.critical(self, "Erro ao Deletar", f"Não foi possível deletar a rotina.\n\nErro: {e}")
\ No newline at end of file
+            nome = self.current_rotina_name
+            WriteQueue.submit(db.delete_rotina, nome,
+                              on_success=lambda _: self._on_rotina_deleted(nome),
+                              error_message="Não foi possível deletar a rotina")
+
+    def _on_rotina_deleted(self, rotina_name):
+        NotificationService.show(f"Rotina '{rotina_name}' deletada.", "info")
+        self.load_initial_data()
\ No newline at end of file